@@ -1,6 +1,8 @@
 from django.test import TestCase
 from backend import const
 from backend.test_common import *
+from backend.unittest import PersonFixtureMixin
+import json
 
 class PermissionsTestCase(NMBasicFixtureMixin, NMTestUtilsMixin, TestCase):
     def setUp(self):
@@ -42,3 +44,92 @@ class PermissionsTestCase(NMBasicFixtureMixin, NMTestUtilsMixin, TestCase):
         self.assertVisit(WhenView(), ThenSuccess())
         for u in self.users.keys():
             self.assertVisit(WhenView(user=self.users[u]), ThenSuccess())
+
+
+def streamed_json(response):
+    return json.loads(b"".join(response.streaming_content).decode("utf8"))
+
+
+class PeopleQueriesTestCase(PersonFixtureMixin, TestCase):
+    def _count_queries(self, url="api_people", key="r"):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        client = self.make_test_client("dd_nu")
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(reverse(url))
+            self.assertEqual(response.status_code, 200)
+            data = streamed_json(response)[key]
+        return len(ctx.captured_queries), data
+
+    def test_constant_queries(self):
+        self.fingerprints.create("dc", person=self.persons.dc, fpr="1793D6AB75663E6BF104953A634F4BD1E7AD5568", is_active=True, audit_skip=True)
+        count, people = self._count_queries()
+        fprs = {p["uid"]: p["fpr"] for p in people}
+        self.assertEqual(fprs[self.persons.dc.uid], "1793D6AB75663E6BF104953A634F4BD1E7AD5568")
+        self.assertIsNone(fprs[self.persons.dm.uid])
+
+        self.fingerprints.create("dm", person=self.persons.dm, fpr="66B4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB", is_active=True, audit_skip=True)
+        self.fingerprints.create("dm_ga", person=self.persons.dm_ga, fpr="0EED77DC41D760FDE44035FF5556A34E04A3610B", is_active=True, audit_skip=True)
+        self.persons.create("extra", status=const.STATUS_DC)
+        self.assertEqual(self._count_queries()[0], count)
+
+    def test_status_constant_queries(self):
+        count, people = self._count_queries("api_status", "people")
+        self.assertEqual(people[self.persons.dd_nu.username], {"status": const.STATUS_DD_NU})
+        self.ams.create("am", person=self.persons.dd_nu, is_am=True)
+        self.persons.create("extra", status=const.STATUS_DC)
+        count1, people = self._count_queries("api_status", "people")
+        self.assertEqual(count1, count)
+        self.assertEqual(people[self.persons.dd_nu.username], {"status": const.STATUS_DD_NU, "is_am": True})
+
+
+class PaginationTestCase(PersonFixtureMixin, TestCase):
+    def _walk(self, url, key, limit):
+        client = self.make_test_client("dd_nu")
+        pages = []
+        data = {"limit": limit}
+        while True:
+            response = client.get(reverse(url), data=data)
+            self.assertEqual(response.status_code, 200)
+            res = streamed_json(response)
+            pages.append(res[key])
+            if res["next"] is None: break
+            data["after"] = res["next"]
+        return pages
+
+    def test_people(self):
+        client = self.make_test_client("dd_nu")
+        full = streamed_json(client.get(reverse("api_people")))
+        self.assertNotIn("next", full)
+        pages = self._walk("api_people", "r", 2)
+        self.assertTrue(all(len(p) <= 2 for p in pages))
+        self.assertEqual([p for page in pages for p in page], full["r"])
+
+    def test_status(self):
+        client = self.make_test_client("dd_nu")
+        full = streamed_json(client.get(reverse("api_status")))["people"]
+        pages = self._walk("api_status", "people", 3)
+        merged = {}
+        for page in pages:
+            self.assertLessEqual(len(page), 3)
+            merged.update(page)
+        self.assertEqual(merged, full)
+
+    def test_bad_cursor(self):
+        client = self.make_test_client("dd_nu")
+        for url in "api_people", "api_status":
+            for data in {"after": "invalid"}, {"limit": "invalid"}, {"limit": "0"}, {"limit": "-1"}:
+                response = client.get(reverse(url), data=data)
+                self.assertEqual(response.status_code, 400)
+
+    def test_etag(self):
+        client = self.make_test_client("dd_nu")
+        for url in "api_people", "api_status":
+            response = client.get(reverse(url))
+            etag = response["ETag"]
+            response = client.get(reverse(url), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.persons.create("extra_" + url, status=const.STATUS_DC)
+            response = client.get(reverse(url), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
@@ -1,15 +1,25 @@
 from django import http
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.db.models import Q, Max, Count
 from django.utils.translation import ugettext as _
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.forms.models import model_to_dict
 from django.views.generic import View
 from django.views.decorators.csrf import csrf_exempt
 import backend.models as bmodels
 from apikeys.mixins import APIVisitorMixin
 from backend import const
+import base64
+import binascii
 import datetime
+import hashlib
 import json
 
+# Number of people loaded from the database at a time when streaming results
+API_BATCH_SIZE = getattr(settings, "API_BATCH_SIZE", 1000)
+
 class Serializer(json.JSONEncoder):
     def default(self, o):
         if hasattr(o, "strftime"):
@@ -23,6 +33,135 @@ def json_response(val, status_code=200):
     json.dump(val, res, cls=Serializer, indent=1)
     return res
 
+def encode_cursor(values):
+    """
+    Encode the sort key of the last object returned into an opaque string
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor created by encode_cursor, raising ValueError if it is not
+    valid
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8"))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid cursor")
+    return values
+
+
+class KeysetPager(object):
+    """
+    Iterate a QuerySet sorted by the given fields, loading it in batches with
+    keyset pagination, so that each batch is a cheap indexed query regardless
+    of how far into the results it is.
+
+    If limit is set, iteration stops after limit objects, and self.next is set
+    to the cursor to use to get the following page, or None if there are no
+    more objects.
+    """
+    def __init__(self, queryset, fields, after=None, limit=None, batch_size=None):
+        self.queryset = queryset
+        self.fields = fields
+        self.after = decode_cursor(after, len(fields)) if after else None
+        self.limit = limit
+        self.batch_size = batch_size or API_BATCH_SIZE
+        self.next = None
+
+    def _filter_after(self, values):
+        # (a, b, c) > (x, y, z) as a Q object
+        res = Q()
+        for idx, name in enumerate(self.fields):
+            cond = Q(**{name + "__gt": values[idx]})
+            for prev, prev_name in enumerate(self.fields[:idx]):
+                cond &= Q(**{prev_name: values[prev]})
+            res |= cond
+        return res
+
+    def _sort_key(self, obj):
+        return [getattr(obj, name) for name in self.fields]
+
+    def __iter__(self):
+        last = self.after
+        remaining = self.limit
+        while True:
+            size = self.batch_size
+            # Fetch one more object than needed, to know if there is a next page
+            if remaining is not None: size = min(size, remaining + 1)
+            queryset = self.queryset
+            if last is not None: queryset = queryset.filter(self._filter_after(last))
+            batch = list(queryset.order_by(*self.fields)[:size])
+            if remaining is not None and len(batch) > remaining:
+                batch = batch[:remaining]
+                yield from batch
+                if batch: self.next = encode_cursor(self._sort_key(batch[-1]))
+                return
+            yield from batch
+            if len(batch) < size: return
+            if remaining is not None: remaining -= len(batch)
+            last = self._sort_key(batch[-1])
+
+
+def json_streaming_response(name, items, mapping=False, extra=None):
+    """
+    Stream a JSON object with a single field called name, containing the list
+    of items encoded one at a time.
+
+    If mapping is True, items are (key, value) pairs and the field is a JSON
+    object instead of a list.
+
+    extra is an optional function called after items has been consumed, that
+    returns a dict of other fields to add to the result.
+    """
+    def generate():
+        yield "{{\n {}: {}".format(json.dumps(name), "{" if mapping else "[")
+        sep = "\n  "
+        for item in items:
+            if mapping:
+                yield sep + json.dumps(item[0]) + ": " + json.dumps(item[1], cls=Serializer, sort_keys=True)
+            else:
+                yield sep + json.dumps(item, cls=Serializer, sort_keys=True)
+            sep = ",\n  "
+        yield "\n }" if mapping else "\n ]"
+        if extra is not None:
+            for key, val in sorted(extra().items()):
+                yield ",\n {}: {}".format(json.dumps(key), json.dumps(val, cls=Serializer))
+        yield "\n}\n"
+    return http.StreamingHttpResponse(generate(), content_type="application/json")
+
+
+def people_etag(request, *args):
+    """
+    Compute an ETag for a listing of people, which changes when any person is
+    added, removed or changed, or when AM flags change
+    """
+    persons = bmodels.Person.objects.aggregate(Count("id"), Max("id"), Max("status_changed"))
+    audit = bmodels.PersonAuditLog.objects.aggregate(Max("id"), Max("logdate"))
+    ams = list(bmodels.AM.objects.filter(Q(is_am=True) | Q(is_fd=True) | Q(is_dam=True)).order_by("person_id").values_list("person_id", "is_am", "is_fd", "is_dam"))
+    state = [sorted(persons.items()), sorted(audit.items()), ams, request.get_full_path()]
+    state.extend(args)
+    return quote_etag(hashlib.sha1(repr(state).encode("utf8")).hexdigest())
+
+
+def parse_limit(value):
+    """
+    Parse the limit query argument, raising ValueError if it is not a
+    positive number
+    """
+    if not value: return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if limit <= 0:
+        raise ValueError("limit must be a positive number")
+    return limit
+
+
 def person_to_json(p, **kw):
     res = model_to_dict(p, **kw)
     res["fullname"] = p.fullname
@@ -39,11 +178,13 @@ class People(APIVisitorMixin, View):
             if self.visitor.is_admin:
                 fields.append("fd_comment")
 
-        try:
-            res = []
+        etag = people_etag(request, fields)
+        response = get_conditional_response(request, etag=etag)
+        if response is not None: return response
 
+        try:
             # Build query
-            people = bmodels.Person.objects.all()
+            people = bmodels.Person.objects.with_fingerprint()
 
             for arg in "cn", "mn", "sn", "email", "uid":
                 val = request.GET.get(arg, None)
@@ -65,27 +206,52 @@ class People(APIVisitorMixin, View):
                 val = request.GET.get("fd_comment", "")
                 if val: people = people.filter(fd_comment__icontains=val)
 
-            for p in people.order_by("cn", "sn"):
-                res.append(person_to_json(p, fields=fields))
-
-            return json_response(dict(r=res))
+            try:
+                pager = KeysetPager(people, ("cn", "sn", "id"), after=request.GET.get("after", None),
+                                    limit=parse_limit(request.GET.get("limit", None)))
+            except ValueError as e:
+                return json_response(dict(e=str(e)), status_code=400)
+            # Run the first query now, so that errors in the query parameters
+            # can still be reported with an error code
+            pages = iter(pager)
+            first = next(pages, None)
         except Exception as e:
             #import traceback
             #traceback.print_exc()
             return json_response(dict(e=str(e)), status_code=500)
 
+        def generate():
+            if first is None: return
+            yield person_to_json(first, fields=fields)
+            for p in pages:
+                yield person_to_json(p, fields=fields)
+
+        response = json_streaming_response("r", generate(), extra=(lambda: {"next": pager.next}) if pager.limit else None)
+        response["ETag"] = etag
+        return response
+
 
 class Status(APIVisitorMixin, View):
-    def _serialize_people(self, people):
-        res = {}
-        for p in people:
-            perms = p.perms
-            rp = {
-                "status": p.status,
-            }
-            if "am" in perms: rp["is_am"] = True
-            res[p.username] = rp
-        return json_response(dict(people=res))
+    def _serialize_people(self, people, after=None, limit=None, etag=None):
+        # Resolve AM flags with a join instead of a query per person
+        people = people.select_related("am")
+        try:
+            pager = KeysetPager(people, ("username",), after=after, limit=limit)
+        except ValueError as e:
+            return http.HttpResponseBadRequest(str(e))
+
+        def generate():
+            for p in pager:
+                perms = p.perms
+                rp = {
+                    "status": p.status,
+                }
+                if "am" in perms: rp["is_am"] = True
+                yield p.username, rp
+
+        response = json_streaming_response("people", generate(), mapping=True, extra=(lambda: {"next": pager.next}) if limit else None)
+        if etag is not None: response["ETag"] = etag
+        return response
 
     def get(self, request, *args, **kw):
         q_status = request.GET.get("status", None)
@@ -100,6 +266,15 @@ class Status(APIVisitorMixin, View):
         if (q_status or q_all) and not self.visitor:
             raise PermissionDenied
 
+        try:
+            limit = parse_limit(request.GET.get("limit", None))
+        except ValueError as e:
+            return http.HttpResponseBadRequest(str(e))
+
+        etag = people_etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is not None: return response
+
         # Get a QuerySet with the people to return
         persons = bmodels.Person.objects.all()
         if q_status:
@@ -111,7 +286,7 @@ class Status(APIVisitorMixin, View):
         else:
             return http.HttpResponseServerError("request cannot be understood")
 
-        return self._serialize_people(persons)
+        return self._serialize_people(persons, after=request.GET.get("after", None), limit=limit, etag=etag)
 
     def post(self, request, *args, **kw):
         names = [str(x) for x in json.loads(request.body.decode("utf8"))]
@@ -37,3 +37,9 @@ admin.site.register(bmodels.Process, ProcessAdmin)
 class LogAdmin(admin.ModelAdmin):
     raw_id_fields = ('changed_by',)
 admin.site.register(bmodels.Log, LogAdmin)
+
+class QueuedMailAdmin(admin.ModelAdmin):
+    list_display = ("created", "subject", "recipients", "attempts", "sent", "failed")
+    list_filter = ("failed",)
+    search_fields = ("subject", "recipients")
+admin.site.register(bmodels.QueuedMail, QueuedMailAdmin)
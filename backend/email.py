@@ -7,7 +7,6 @@ try:
     from email.Iterators import typed_subpart_iterator
 except ImportError:
     from email.iterators import typed_subpart_iterator
-import mailbox
 from . import const
 import logging
 
@@ -146,13 +145,3 @@ def decode_header(val):
         else:
             res.append(buf.decode(charset, errors="replace"))
     return " ".join(res)
-
-def get_mbox_as_dicts(filename):
-    try:  ## we are reading, have not to flush with close
-        for message in mailbox.mbox(filename, create=False):
-            msg_dict = {'Body': get_body(message)}
-            for hkey, hval in list(message.items()):
-                msg_dict[hkey] = decode_header(hval)
-            yield msg_dict
-    except mailbox.NoSuchMailboxError:
-        return
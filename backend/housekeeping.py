@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
 from django.conf import settings
 import django_housekeeping as hk
 from django.db import connection, transaction
@@ -23,8 +24,8 @@ from django.contrib.sites.models import Site
 from backend import const
 from . import models as bmodels
 from . import utils, const
-import gzip
 import datetime
+import gzip
 import json
 import os.path
 import logging
@@ -32,6 +33,14 @@ import logging
 log = logging.getLogger(__name__)
 
 BACKUP_DIR = getattr(settings, "BACKUP_DIR", None)
+# Back up only the people changed since the last full backup, doing a full
+# backup every BACKUP_FULL_INTERVAL days
+BACKUP_INCREMENTAL = getattr(settings, "BACKUP_INCREMENTAL", False)
+BACKUP_FULL_INTERVAL = getattr(settings, "BACKUP_FULL_INTERVAL", 7)
+# File recording the last full backup
+BACKUP_STATEFILE = getattr(settings, "BACKUP_STATEFILE", None)
+# Number of threads compressing backups
+BACKUP_COMPRESS_WORKERS = getattr(settings, "BACKUP_COMPRESS_WORKERS", 4)
 
 STAGES = ["backup", "main", "stats"]
 
@@ -72,32 +81,90 @@ class MakeLink(hk.Task):
 
 class BackupDB(hk.Task):
     """
-    Backup of the whole database
+    Backup of the whole database.
+
+    With BACKUP_INCREMENTAL, backups between full ones only contain the people
+    that are new or changed since the last full backup. Their db-manifest.json
+    names the full backup they are based on, and lists the usernames removed
+    since then: utils.restore_backup rebuilds the database export from them.
     """
+    def _load_state(self, fname):
+        try:
+            with open(fname) as fd:
+                state = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        state["base_started"] = parse_datetime(state["base_started"])
+        return state
+
+    def _save_json(self, fname, data):
+        data = {k: v.isoformat() if hasattr(v, "isoformat") else v for k, v in data.items()}
+        with utils.atomic_writer(fname, mode="wt", chmod=0o640) as fd:
+            json.dump(data, fd, indent=2, sort_keys=True)
+
     def run_backup(self, stage):
         if self.hk.outdir is None:
             log.info("HOUSEKEEPING_ROOT is not set: skipping backups")
             return
 
-        people = list(bmodels.export_db(full=True))
-
         class Serializer(json.JSONEncoder):
             def default(self, o):
                 if hasattr(o, "strftime"):
                     return o.strftime("%Y-%m-%d %H:%M:%S")
                 return json.JSONEncoder.default(self, o)
 
-        # Base filename for the backup
+        started = now()
         basedir = self.hk.outdir.path()
-        fname = os.path.join(basedir, "db-full.json.gz")
+        statefile = BACKUP_STATEFILE or os.path.join(os.path.dirname(basedir), "db-backup-state.json")
+
+        # See if we can do an incremental backup against the last full one
+        state = self._load_state(statefile) if BACKUP_INCREMENTAL else None
+        if state is not None:
+            if started - state["base_started"] >= datetime.timedelta(days=BACKUP_FULL_INTERVAL):
+                state = None
+            elif not os.path.exists(state["base"]):
+                log.warning("%s: base backup %s not found: doing a full backup", self.IDENTIFIER, state["base"])
+                state = None
+        kind = "full" if state is None else "incremental"
+
+        # Base filename for the backup
+        fname = os.path.join(basedir, "db-{}.json.gz".format(kind))
         log.info("%s: backing up to %s", self.IDENTIFIER, fname)
         if self.hk.dry_run:
             return
 
+        people = bmodels.export_db(full=True)
+        if state is not None:
+            with gzip.open(state["base"], "rt", encoding="utf-8") as fd:
+                diff = utils.BackupDiff(utils.iter_json_list(fd))
+            # Compare people as they would be read back from the backup
+            people = diff.changed(json.loads(json.dumps(p, cls=Serializer)) for p in people)
+
+        count = 0
+        def counted(people):
+            nonlocal count
+            for p in people:
+                count += 1
+                yield p
+
         # Write the backup file
         with utils.atomic_writer(fname, mode="wb", chmod=0o640) as fd:
-            with gzip.open(fd, mode="wt", compresslevel=9) as gzfd:
-                json.dump(people, gzfd, cls=Serializer, indent=2)
+            with utils.ParallelGzipWriter(fd, compresslevel=9, workers=BACKUP_COMPRESS_WORKERS) as gzfd:
+                utils.dump_json_list(counted(people), gzfd, cls=Serializer, indent=2)
+
+        # Write a manifest describing the backup, and the full backup it is
+        # based on
+        manifest = {"type": kind, "file": fname, "started": started, "people": count}
+        if state is None:
+            self._save_json(statefile, {"base": fname, "base_started": started})
+        else:
+            manifest["base"] = state["base"]
+            manifest["base_started"] = state["base_started"]
+            manifest["removed"] = diff.removed
+        self._save_json(os.path.join(basedir, "db-manifest.json"), manifest)
+
+        log.info("%s: %s backup of %d people completed in %.1fs",
+                 self.IDENTIFIER, kind, count, (now() - started).total_seconds())
 
 
 class ComputeActiveAM(hk.Task):
@@ -195,20 +262,20 @@ class PersonExpires(hk.Task):
         """
         import process.models as pmodels
         today = datetime.date.today()
+        changes = []
         for p in bmodels.Person.objects.filter(expires__lt=today):
             if p.status != const.STATUS_DC:
                 log.info("%s: removing expiration date for %s who has become %s",
                          self.IDENTIFIER, self.hk.link(p), p.status)
-                p.expires = None
-                p.save(audit_author=self.hk.housekeeper.user, audit_notes="user became {}: removing expiration date".format(const.ALL_STATUS_DESCS[p.status]))
+                changes.append((p, {"expires": None}, "user became {}: removing expiration date".format(const.ALL_STATUS_DESCS[p.status])))
             elif p.processes.exists() or pmodels.Process.objects.filter(person=p).exists():
                 log.info("%s: removing expiration date for %s who now has process history",
                          self.IDENTIFIER, self.hk.link(p))
-                p.expires = None
-                p.save(audit_author=self.hk.housekeeper.user, audit_notes="process detected: removing expiration date")
+                changes.append((p, {"expires": None}, "process detected: removing expiration date"))
             else:
                 log.info("%s: deleting expired Person %s", self.IDENTIFIER, p)
                 p.delete()
+        bmodels.Person.objects.bulk_change(changes, audit_author=self.hk.housekeeper.user)
 
 
 class CheckOneProcessPerPerson(hk.Task):
@@ -349,6 +416,7 @@ class DDUsernames(hk.Task):
     def run_main(self, stage):
         dd_statuses = (const.STATUS_DD_U, const.STATUS_DD_NU)
         post_dd_statuses = (const.STATUS_EMERITUS_DD, const.STATUS_REMOVED_DD)
+        changes = []
         for p in bmodels.Person.objects.filter(status__in=dd_statuses + post_dd_statuses):
             if p.uid is None:
                 log.warning("%s: %s has status %s but uid is empty",
@@ -362,9 +430,10 @@ class DDUsernames(hk.Task):
             if p.username == canonical_username: continue
             log.info("%s: %s has status %s and username %s: setting username to %s",
                         self.IDENTIFIER, self.hk.link(p), p.status, p.username, canonical_username)
-            if not self.hk.dry_run:
-                p.username = canonical_username
-                p.save(audit_author=self.hk.housekeeper.user, audit_notes="updated SSO username to canonical version for the person's status")
+            changes.append((p, {"username": canonical_username}, "updated SSO username to canonical version for the person's status"))
+
+        if not self.hk.dry_run:
+            bmodels.Person.objects.bulk_change(changes, audit_author=self.hk.housekeeper.user)
 
 
 class CheckOneActiveKeyPerPerson(hk.Task):
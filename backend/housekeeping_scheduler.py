@@ -0,0 +1,278 @@
+"""
+Run housekeeping tasks concurrently.
+
+Tasks are the same django_housekeeping tasks run by ./manage.py housekeeping:
+stages run one after the other, and in each stage a task starts as soon as
+all the tasks it DEPENDS on have finished, using a pool of worker threads.
+
+Tasks with EXCLUSIVE = True run alone, with no other task running at the same
+time: this is needed, for example, by tasks that fork worker processes, since
+forking while other threads are busy can deadlock the child processes.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import django_housekeeping as hk
+import collections
+import importlib
+import importlib.util
+import datetime
+import resource
+import time
+import json
+import re
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# Root directory for housekeeping output
+HOUSEKEEPING_ROOT = getattr(settings, "HOUSEKEEPING_ROOT", None)
+# Maximum number of housekeeping tasks running at the same time
+HOUSEKEEPING_WORKERS = getattr(settings, "HOUSEKEEPING_WORKERS", 4)
+
+
+def thread_cpu_time():
+    """
+    Return the CPU time used so far by the current thread
+    """
+    if hasattr(resource, "RUSAGE_THREAD"):
+        ru = resource.getrusage(resource.RUSAGE_THREAD)
+        return ru.ru_utime + ru.ru_stime
+    return time.process_time()
+
+
+class QueryCounter(collections.deque):
+    """
+    Stand-in for connection.queries_log that only counts queries
+    """
+    def __init__(self):
+        super().__init__(maxlen=0)
+        self.count = 0
+
+    def append(self, item):
+        self.count += 1
+
+
+class Outdir(object):
+    """
+    Output directory for a housekeeping run, created on first use
+    """
+    def __init__(self, root, started):
+        self.root = root
+        self.started = started
+        self._path = None
+
+    def path(self):
+        if self._path is None:
+            self._path = os.path.join(self.root, self.started.strftime("%Y%m%d-%H%M%S"))
+            os.makedirs(self._path, exist_ok=True)
+        return self._path
+
+
+def merge_stages(stage_lists):
+    """
+    Merge lists of stage names into a single ordering that respects the order
+    of each list
+    """
+    order = []
+    after = collections.defaultdict(set)
+    for stages in stage_lists:
+        for idx, name in enumerate(stages):
+            if name not in order: order.append(name)
+            after[name].update(stages[:idx])
+
+    res = []
+    while order:
+        for name in order:
+            if not (after[name] - set(res)):
+                break
+        else:
+            raise ValueError("stage order is inconsistent: {}".format(", ".join(order)))
+        res.append(name)
+        order.remove(name)
+    return res
+
+
+class Scheduler(object):
+    """
+    Discover housekeeping tasks and run them.
+
+    An instance is passed to tasks as their hk object: it provides dry_run,
+    outdir, and each task instance as an attribute named after the task.
+    """
+    def __init__(self, dry_run=False, workers=None, outdir=None):
+        self.dry_run = dry_run
+        self.workers = workers or HOUSEKEEPING_WORKERS
+        self.started = now()
+        root = outdir or HOUSEKEEPING_ROOT
+        self.outdir = Outdir(root, self.started) if root else None
+        self.stages = []
+        # Task classes in dependency order
+        self.task_classes = []
+        # Task instances in dependency order
+        self.tasks = []
+        self.report = None
+
+    @staticmethod
+    def task_name(cls):
+        name = getattr(cls, "NAME", None)
+        if name: return name
+        return re.sub(r"(?<!^)(?=[A-Z])", "_", cls.__name__).lower()
+
+    def autodiscover(self):
+        """
+        Load the tasks and stages from the housekeeping module of each app
+        """
+        stage_lists = []
+        classes = []
+        for app_config in apps.get_app_configs():
+            modname = app_config.name + ".housekeeping"
+            if importlib.util.find_spec(modname) is None: continue
+            mod = importlib.import_module(modname)
+            stages = getattr(mod, "STAGES", None)
+            if stages: stage_lists.append(stages)
+            for obj in vars(mod).values():
+                if not isinstance(obj, type) or not issubclass(obj, hk.Task) or obj is hk.Task: continue
+                if obj.__module__ != modname: continue
+                classes.append(obj)
+        self.stages = merge_stages(stage_lists) if stage_lists else ["main"]
+
+        # Sort classes so that dependencies come first
+        classes.sort(key=lambda c: (c.__module__, c.__name__))
+        done = set()
+        def visit(cls, path):
+            if cls in done: return
+            if cls in path:
+                raise ValueError("dependency loop in housekeeping tasks: {}".format(
+                    " -> ".join(c.__name__ for c in path + [cls])))
+            for dep in getattr(cls, "DEPENDS", ()):
+                visit(dep, path + [cls])
+            done.add(cls)
+            self.task_classes.append(cls)
+        for cls in classes:
+            visit(cls, [])
+
+    def init(self):
+        """
+        Instantiate the tasks, in dependency order
+        """
+        for cls in self.task_classes:
+            if "IDENTIFIER" not in vars(cls):
+                cls.IDENTIFIER = "{}.{}".format(cls.__module__, cls.__name__)
+            task = cls(self)
+            setattr(self, self.task_name(cls), task)
+            self.tasks.append(task)
+
+    def _run_task(self, task, stage):
+        """
+        Run a task stage in a worker thread, returning its timing information
+        """
+        info = {"task": task.IDENTIFIER, "stage": stage, "started": now().isoformat()}
+        counter = QueryCounter()
+        old_log, old_force = connection.queries_log, connection.force_debug_cursor
+        connection.queries_log, connection.force_debug_cursor = counter, True
+        wall_start = time.monotonic()
+        cpu_start = thread_cpu_time()
+        try:
+            getattr(task, "run_" + stage)(stage)
+            info["status"] = "ok"
+        except Exception as e:
+            log.exception("%s: failed in stage %s", task.IDENTIFIER, stage)
+            info["status"] = "failed"
+            info["error"] = "{}: {}".format(e.__class__.__name__, e)
+        finally:
+            info["wall_time"] = time.monotonic() - wall_start
+            info["cpu_time"] = thread_cpu_time() - cpu_start
+            info["queries"] = counter.count
+            connection.queries_log, connection.force_debug_cursor = old_log, old_force
+            # Do not leave connections open in idle worker threads
+            connection.close()
+        return info
+
+    def run_stage(self, executor, stage):
+        """
+        Run all the tasks that have a method for this stage, starting each
+        one as soon as its dependencies are done. EXCLUSIVE tasks start once
+        the running tasks are done, and no other task starts until they finish.
+        """
+        tasks = [t for t in self.tasks if hasattr(t, "run_" + stage)]
+        classes = {t.__class__ for t in tasks}
+        # Dependencies that also run in this stage
+        waiting_for = {
+            t: {d for d in getattr(t, "DEPENDS", ()) if d in classes}
+            for t in tasks
+        }
+        done = set()
+        failed = set()
+        running = {}
+        results = []
+        while waiting_for or running:
+            ready = []
+            for task, deps in list(waiting_for.items()):
+                if deps & failed:
+                    log.warning("%s: skipped, since a task it depends on failed", task.IDENTIFIER)
+                    results.append({"task": task.IDENTIFIER, "stage": stage, "status": "skipped"})
+                    failed.add(task.__class__)
+                    del waiting_for[task]
+                elif deps <= done:
+                    ready.append(task)
+            exclusive = [t for t in ready if getattr(t, "EXCLUSIVE", False)]
+            if exclusive:
+                # Start nothing else until the task has run alone
+                ready = [] if running else exclusive[:1]
+            for task in ready:
+                running[executor.submit(self._run_task, task, stage)] = task
+                del waiting_for[task]
+            if not running:
+                # Everything left was skipped
+                continue
+            finished, pending = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                info = future.result()
+                results.append(info)
+                if info["status"] == "ok":
+                    done.add(task.__class__)
+                else:
+                    failed.add(task.__class__)
+        return results
+
+    def run(self):
+        """
+        Run all stages, returning a report of how long each task took
+        """
+        started = time.monotonic()
+        self.report = {
+            "started": self.started.isoformat(),
+            "workers": self.workers,
+            "dry_run": self.dry_run,
+            "stages": [],
+        }
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for stage in self.stages:
+                stage_started = time.monotonic()
+                tasks = self.run_stage(executor, stage)
+                self.report["stages"].append({
+                    "stage": stage,
+                    "wall_time": time.monotonic() - stage_started,
+                    "tasks": tasks,
+                })
+        self.report["wall_time"] = time.monotonic() - started
+        self.report["cpu_time"] = sum(t.get("cpu_time", 0) for s in self.report["stages"] for t in s["tasks"])
+        return self.report
+
+    def save_report(self, pathname=None):
+        """
+        Write the report of the last run as JSON, by default in the output
+        directory. Returns the pathname written, or None if there was nowhere
+        to write it.
+        """
+        if pathname is None:
+            if self.outdir is None: return None
+            pathname = os.path.join(self.outdir.path(), "housekeeping-report.json")
+        with open(pathname, "wt") as fd:
+            json.dump(self.report, fd, indent=2)
+        return pathname
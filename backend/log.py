@@ -0,0 +1,21 @@
+"""
+Logging handlers
+"""
+from django.conf import settings
+from django.core.mail import get_connection
+import django.utils.log
+
+
+class AdminEmailHandler(django.utils.log.AdminEmailHandler):
+    """
+    Error report handler that sends mail directly also when outgoing mail is
+    queued, since errors may be what keeps the queue from being delivered.
+
+    This module is loaded while logging is configured, before models are
+    available, so it cannot import backend.mailqueue.
+    """
+    def connection(self):
+        if settings.EMAIL_BACKEND == "backend.mailqueue.QueueBackend":
+            backend = getattr(settings, "MAIL_QUEUE_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+            return get_connection(backend=backend, fail_silently=True)
+        return super().connection()
@@ -0,0 +1,127 @@
+"""
+Cache of gzip-compressed mailboxes, used to serve mailbox downloads
+"""
+from django.conf import settings
+from django import http
+from .utils import atomic_writer
+from .shortcuts import serve_file
+import gzip
+import io
+import hashlib
+import datetime
+import shutil
+import glob
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# Directory for compressed mailboxes; if None, they are stored next to the
+# mailboxes
+MAILBOX_CACHE_DIR = getattr(settings, "MAILBOX_CACHE_DIR", None)
+
+
+class CompressedMailbox(object):
+    """
+    gzip-compressed copy of a mailbox, optionally with extra data appended.
+
+    The compressed file is named after a key computed from the mtime and
+    size of the mailbox, and from extra_key, so it is rebuilt lazily, the
+    first time it is requested after any of them changed.
+    """
+    def __init__(self, pathname, name, extra=None, extra_key="", extra_last_modified=None, cache_dir=None):
+        """
+        pathname is the mailbox file, name is the file name stored in the
+        gzip header.
+
+        extra is an optional function returning bytes to append to the
+        mailbox, extra_key is a string that changes when they change, and
+        extra_last_modified is the naive UTC datetime of their last change.
+        """
+        self.pathname = pathname
+        self.name = name
+        self.extra = extra
+        self.extra_key = extra_key
+        self.extra_last_modified = extra_last_modified
+        self.cache_dir = cache_dir or MAILBOX_CACHE_DIR or os.path.dirname(pathname)
+        st = os.stat(pathname)
+        self.mtime = st.st_mtime
+        self.key = hashlib.sha1("{}:{}:{}:{}:{}".format(
+            pathname, st.st_mtime_ns, st.st_size, name, extra_key).encode("utf-8")).hexdigest()
+
+    @property
+    def last_modified(self):
+        res = datetime.datetime.utcfromtimestamp(self.mtime)
+        if self.extra_last_modified is not None:
+            res = max(res, self.extra_last_modified)
+        return res
+
+    @property
+    def cache_pathname(self):
+        return os.path.join(self.cache_dir, "{}.{}.gz".format(os.path.basename(self.pathname), self.key[:16]))
+
+    def _build(self, fname):
+        with atomic_writer(fname, mode="wb", chmod=0o640, sync=False) as fd:
+            with gzip.GzipFile(self.name, "wb", 9, fd, mtime=int(self.mtime)) as outfd:
+                with open(self.pathname, "rb") as infd:
+                    shutil.copyfileobj(infd, outfd)
+                if self.extra is not None:
+                    outfd.write(self.extra())
+
+        # Remove compressed versions of older mailbox contents
+        prefix = os.path.join(self.cache_dir, os.path.basename(self.pathname) + ".")
+        for old in glob.glob(glob.escape(prefix) + "*.gz"):
+            if old == fname or len(old) != len(fname): continue
+            try:
+                os.unlink(old)
+            except FileNotFoundError:
+                pass
+
+    def get(self):
+        """
+        Return the pathname of the compressed mailbox, building it if needed
+        """
+        fname = self.cache_pathname
+        if not os.path.exists(fname):
+            log.info("compressing %s into %s", self.pathname, fname)
+            self._build(fname)
+        return fname
+
+    def stream(self, block_size=65536):
+        """
+        Generate the compressed mailbox without writing it to disk
+        """
+        buf = io.BytesIO()
+        def flush():
+            data = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return data
+
+        with gzip.GzipFile(self.name, "wb", 9, buf, mtime=int(self.mtime)) as outfd:
+            with open(self.pathname, "rb") as infd:
+                while True:
+                    data = infd.read(block_size)
+                    if not data: break
+                    outfd.write(data)
+                    data = flush()
+                    if data: yield data
+            if self.extra is not None:
+                outfd.write(self.extra())
+        yield flush()
+
+    def serve(self, request, filename):
+        """
+        Serve the compressed mailbox as a download called filename.
+
+        If the compressed copy cannot be written, a freshly compressed one is
+        streamed instead.
+        """
+        try:
+            fname = self.get()
+        except OSError as e:
+            log.warning("cannot write %s: %s: streaming %s compressed on the fly", self.cache_pathname, e, self.pathname)
+            response = http.StreamingHttpResponse(self.stream(), content_type="application/octet-stream")
+            response["Content-Disposition"] = "attachment; filename=%s" % filename
+            return response
+        return serve_file(request, fname, filename, etag=self.key, last_modified=self.last_modified)
@@ -0,0 +1,161 @@
+"""
+Index of the messages in a mailbox, to list and show them without parsing
+the whole mailbox every time
+"""
+from .utils import atomic_writer
+from .mailbox_cache import MAILBOX_CACHE_DIR
+from . import email as bemail
+import email
+import email.parser
+import hashlib
+import mmap
+import json
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MailboxIndex(object):
+    """
+    Byte offsets, lengths, and decoded From, Date and Subject headers of the
+    messages in a mailbox. The undecoded From header is also kept, to parse
+    addresses from it.
+
+    The index is stored in a JSON file next to the mailbox, or in
+    MAILBOX_CACHE_DIR if set. When the mailbox grows, only the new part is
+    indexed; if it is rewritten in any other way, it is indexed again from
+    the start.
+    """
+    VERSION = 2
+    # Number of bytes at the start of the mailbox used to detect rewrites
+    HEAD_SIZE = 4096
+
+    def __init__(self, pathname, index_dir=None):
+        self.pathname = pathname
+        index_dir = index_dir or MAILBOX_CACHE_DIR or os.path.dirname(pathname)
+        self.index_pathname = os.path.join(index_dir, os.path.basename(pathname) + ".idx")
+        # List of (offset, length, from, date, subject, raw from)
+        self.messages = []
+        self.update()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _load(self):
+        try:
+            with open(self.index_pathname, "rt") as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return None
+        if data.get("version") != self.VERSION: return None
+        return data
+
+    def _save(self, data):
+        try:
+            with atomic_writer(self.index_pathname, mode="wt", chmod=0o640, sync=False) as fd:
+                json.dump(data, fd)
+        except OSError as e:
+            log.warning("cannot write mailbox index %s: %s", self.index_pathname, e)
+
+    def _head(self, mm, size):
+        return hashlib.sha1(mm[:min(size, self.HEAD_SIZE)]).hexdigest()
+
+    def _summarize(self, mm, start, end):
+        """
+        Decode the summary headers of the message between start and end
+        """
+        # Skip the From_ line
+        hstart = mm.find(b"\n", start, end)
+        hstart = end if hstart == -1 else hstart + 1
+        hend = mm.find(b"\n\n", hstart, end)
+        hend = end if hend == -1 else hend + 1
+        headers = email.parser.BytesHeaderParser().parsebytes(mm[hstart:hend])
+        res = []
+        for name in "From", "Date", "Subject":
+            val = headers.get(name)
+            res.append(bemail.decode_header(val) if val is not None else "")
+        raw_from = headers.get("From")
+        res.append(str(raw_from) if raw_from is not None else "")
+        return res
+
+    def _scan(self, mm, start):
+        """
+        Index the messages in mm starting at the given offset
+        """
+        res = []
+        size = len(mm)
+        pos = start
+        while pos < size:
+            nxt = mm.find(b"\nFrom ", pos)
+            end = size if nxt == -1 else nxt + 1
+            res.append([pos, end - pos] + self._summarize(mm, pos, end))
+            pos = end
+        return res
+
+    def update(self):
+        """
+        Bring the index up to date with the mailbox
+        """
+        st = os.stat(self.pathname)
+        data = self._load()
+        if data is not None and data["size"] == st.st_size and data["mtime"] == st.st_mtime_ns:
+            self.messages = data["messages"]
+            return
+
+        if st.st_size == 0:
+            self.messages = []
+            return
+
+        with open(self.pathname, "rb") as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                messages = None
+                if (data is not None and data["size"] <= len(mm)
+                        and data["head"] == self._head(mm, data["size"])):
+                    messages = data["messages"]
+                    # Reindex the last message, which may have grown
+                    start = messages[-1][0] if messages else 0
+                    if mm[start:start + 5] == b"From ":
+                        messages = messages[:-1]
+                    else:
+                        messages = None
+                if messages is None:
+                    start = 0
+                    messages = []
+                messages.extend(self._scan(mm, start))
+                head = self._head(mm, len(mm))
+
+        self.messages = messages
+        self._save({
+            "version": self.VERSION,
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "head": head,
+            "messages": messages,
+        })
+
+    def summary(self, idx):
+        """
+        Return a dict with the From, Date and Subject headers of a message,
+        and with the undecoded From header as RawFrom
+        """
+        offset, length, from_, date, subject, raw_from = self.messages[idx]
+        return {"From": from_, "Date": date, "Subject": subject, "RawFrom": raw_from}
+
+    def get_message(self, idx):
+        """
+        Read and parse a message from the mailbox
+        """
+        offset, length = self.messages[idx][:2]
+        with open(self.pathname, "rb") as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                raw = mm[offset:offset + length]
+        # Skip the From_ line
+        nl = raw.find(b"\n")
+        return email.message_from_bytes(raw[nl + 1:] if nl != -1 else b"")
+
+    def get_body(self, idx):
+        """
+        Return the decoded text body of a message
+        """
+        return bemail.get_body(self.get_message(idx))
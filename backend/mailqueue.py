@@ -0,0 +1,194 @@
+"""
+Outgoing mail queue.
+
+Setting EMAIL_BACKEND to backend.mailqueue.QueueBackend makes every
+EmailMessage.send() store the message in the database, instead of sending it
+during the web request. The send_queued_mail command then delivers queued
+messages through MAIL_QUEUE_BACKEND, reusing the same connection.
+"""
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.utils.timezone import now
+from . import models as bmodels
+import datetime
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# Email backend used to actually deliver queued messages
+MAIL_QUEUE_BACKEND = getattr(settings, "MAIL_QUEUE_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+# Number of messages sent for each database query
+MAIL_QUEUE_BATCH_SIZE = getattr(settings, "MAIL_QUEUE_BATCH_SIZE", 50)
+# Delivery attempts after which a message is marked as failed
+MAIL_QUEUE_MAX_ATTEMPTS = getattr(settings, "MAIL_QUEUE_MAX_ATTEMPTS", 10)
+# Seconds to wait after the first failed attempt; doubles at each failure
+MAIL_QUEUE_RETRY_DELAY = getattr(settings, "MAIL_QUEUE_RETRY_DELAY", 60)
+# Days after which sent messages are removed from the queue
+MAIL_QUEUE_KEEP_DAYS = getattr(settings, "MAIL_QUEUE_KEEP_DAYS", 30)
+# Seconds after which a message claimed by a worker that did not record the
+# result of sending it becomes due again
+MAIL_QUEUE_CLAIM_TIMEOUT = getattr(settings, "MAIL_QUEUE_CLAIM_TIMEOUT", 600)
+
+
+class QueueBackend(BaseEmailBackend):
+    """
+    Email backend that adds messages to the outgoing mail queue
+    """
+    def send_messages(self, email_messages):
+        if not email_messages: return 0
+        bmodels.QueuedMail.objects.bulk_create(
+            bmodels.QueuedMail.from_email_message(msg) for msg in email_messages)
+        return len(email_messages)
+
+
+class Worker(object):
+    """
+    Deliver queued messages, keeping the delivery connection open across
+    messages and batches
+    """
+    def __init__(self, connection=None, batch_size=None, max_attempts=None, retry_delay=None):
+        self.connection = connection or get_connection(MAIL_QUEUE_BACKEND)
+        self.batch_size = batch_size or MAIL_QUEUE_BATCH_SIZE
+        self.max_attempts = max_attempts or MAIL_QUEUE_MAX_ATTEMPTS
+        self.retry_delay = retry_delay or MAIL_QUEUE_RETRY_DELAY
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception as e:
+            log.warning("cannot close mail connection: %s", e)
+
+    def _claim(self, mail):
+        """
+        Mark a message as being sent by this worker, by moving its next
+        attempt time forward. Returns False if another worker claimed it first.
+        """
+        claimed_until = now() + datetime.timedelta(seconds=MAIL_QUEUE_CLAIM_TIMEOUT)
+        updated = bmodels.QueuedMail.objects.filter(
+            pk=mail.pk, sent__isnull=True, failed=False, next_attempt=mail.next_attempt).update(next_attempt=claimed_until)
+        if not updated: return False
+        mail.next_attempt = claimed_until
+        return True
+
+    def _send(self, mail):
+        """
+        Try to send a message, updating its delivery state
+        """
+        try:
+            self.connection.send_messages([mail.to_email_message()])
+        except Exception as e:
+            mail.attempts += 1
+            mail.last_error = "{}: {}".format(e.__class__.__name__, e)
+            if mail.attempts >= self.max_attempts:
+                mail.failed = True
+                log.error("giving up on mail %d to %s after %d attempts: %s", mail.pk, mail.recipients, mail.attempts, mail.last_error)
+            else:
+                mail.next_attempt = now() + datetime.timedelta(seconds=self.retry_delay * 2 ** (mail.attempts - 1))
+                log.warning("cannot send mail %d to %s, will retry at %s: %s", mail.pk, mail.recipients, mail.next_attempt, mail.last_error)
+            # Start again with a fresh connection
+            self.close()
+            mail.save(update_fields=["attempts", "last_error", "failed", "next_attempt"])
+            return False
+
+        mail.sent = now()
+        mail.save(update_fields=["sent"])
+        log.debug("sent mail %d to %s subject %s", mail.pk, mail.recipients, mail.subject)
+        return True
+
+    def run_batch(self):
+        """
+        Send a batch of messages that are due.
+
+        Returns a couple (sent, failed) with the number of messages sent and
+        of failed attempts.
+        """
+        sent = failed = 0
+        batch = list(bmodels.QueuedMail.objects
+                     .filter(sent__isnull=True, failed=False, next_attempt__lte=now())
+                     .order_by("next_attempt", "pk")[:self.batch_size])
+        if not batch: return sent, failed
+        self.connection.open()
+        for mail in batch:
+            # Claim each message before sending it, in case more than one
+            # worker is running. No transaction is kept open while talking to
+            # the mail server, and the result is saved right after sending.
+            if not self._claim(mail): continue
+            if self._send(mail):
+                sent += 1
+            else:
+                failed += 1
+        return sent, failed
+
+    def run_once(self):
+        """
+        Send all messages that are due, then close the connection
+        """
+        sent = failed = 0
+        try:
+            while True:
+                s, f = self.run_batch()
+                sent += s
+                failed += f
+                # Stop at a short batch: the rest is waiting for a retry, or
+                # was taken by another worker
+                if s + f < self.batch_size: break
+        finally:
+            self.close()
+        return sent, failed
+
+    def run(self, poll_interval=5):
+        """
+        Keep sending messages as they are queued.
+
+        The connection is kept open as long as there are messages to send,
+        and closed when the queue is idle.
+        """
+        last_purge = None
+        while True:
+            s, f = self.run_batch()
+            if s + f < self.batch_size:
+                self.close()
+                if last_purge is None or time.monotonic() - last_purge > 3600:
+                    purge()
+                    last_purge = time.monotonic()
+                time.sleep(poll_interval)
+
+
+def purge(days=None):
+    """
+    Remove messages sent more than the given number of days ago
+    """
+    if days is None: days = MAIL_QUEUE_KEEP_DAYS
+    deleted, _ = bmodels.QueuedMail.objects.filter(sent__lt=now() - datetime.timedelta(days=days)).delete()
+    return deleted
+
+
+def stats(since=None):
+    """
+    Return a dict with the queue depth, and with the delivery latency of the
+    messages sent since the given datetime (default: the last 24 hours)
+    """
+    if since is None: since = now() - datetime.timedelta(days=1)
+    pending = bmodels.QueuedMail.objects.filter(sent__isnull=True, failed=False)
+    oldest = pending.order_by("created").values_list("created", flat=True).first()
+    latencies = sorted(
+        (sent - created).total_seconds()
+        for created, sent in bmodels.QueuedMail.objects.filter(sent__gte=since).values_list("created", "sent"))
+
+    def percentile(p):
+        if not latencies: return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    return {
+        "pending": pending.count(),
+        "retrying": pending.filter(attempts__gt=0).count(),
+        "failed": bmodels.QueuedMail.objects.filter(failed=True).count(),
+        "oldest_pending": oldest,
+        "sent": len(latencies),
+        "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+        "latency_p50": percentile(50),
+        "latency_p95": percentile(95),
+        "latency_max": latencies[-1] if latencies else None,
+    }
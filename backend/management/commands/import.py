@@ -19,17 +19,21 @@ from django.core.management.base import BaseCommand, CommandError
 import django.db
 from django.db import connection, transaction
 from django.conf import settings
-import optparse
 import re
 import sys
+import time
+import gzip
 import logging
 import json
 import datetime
 from backend import models as bmodels
 from backend import const
+from backend import utils
 
 log = logging.getLogger(__name__)
 
+AUDIT_NOTES = "imported from json database export"
+
 def parse_datetime(s):
     if s is None: return None
     return datetime.datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
@@ -41,12 +45,68 @@ def lookup_person(s):
         return bmodels.Person.objects.get(email=s)
     elif re.match(r"(?:0x)?[A-F0-9]{16}", s):
         if s.startswith("0x"): s = s[2:]
-        return bmodels.Person.objects.get(fpr__endswith=s)
+        return bmodels.Person.objects.get(fprs__fpr__endswith=s)
     elif re.match(r"[A-F0-9]{40}", s):
-        return bmodels.Person.objects.get(fpr__endswith=s)
+        return bmodels.Person.objects.get(fprs__fpr__endswith=s)
     else:
         return bmodels.Person.lookup(s)
 
+def open_dump(fname):
+    """
+    Open a JSON dump, optionally gzip compressed
+    """
+    if fname.endswith(".gz"):
+        return gzip.open(fname, "rt")
+    else:
+        return open(fname)
+
+def person_from_json(info):
+    return bmodels.Person(
+        username=info["username"],
+        cn=info["cn"],
+        mn=info["mn"],
+        sn=info["sn"],
+        email=info["email"],
+        uid=info["uid"],
+        is_staff=info.get("is_staff", False),
+        is_superuser=info.get("is_superuser", False),
+        status=info["status"],
+        status_changed=parse_datetime(info["status_changed"]),
+        created=parse_datetime(info["created"]),
+        fd_comment=info["fd_comment"] or "",
+    )
+
+def am_from_json(person, aminfo):
+    return bmodels.AM(
+        person=person,
+        slots=aminfo["slots"],
+        is_am=aminfo["is_am"],
+        is_fd=aminfo["is_fd"],
+        is_dam=aminfo["is_dam"],
+        is_am_ctte=aminfo["is_am_ctte"],
+        created=parse_datetime(aminfo["created"]),
+    )
+
+def process_from_json(person, info, manager):
+    return bmodels.Process(
+        person=person,
+        applying_as=info["applying_as"],
+        applying_for=info["applying_for"],
+        progress=info["progress"],
+        archive_key=info["archive_key"],
+        is_active=info["is_active"],
+        manager=manager,
+    )
+
+def log_from_json(process, li, changed_by):
+    return bmodels.Log(
+        process=process,
+        progress=li["progress"],
+        logdate=parse_datetime(li["logdate"]),
+        logtext=li["logtext"],
+        changed_by=changed_by,
+    )
+
 class Importer(object):
     def __init__(self, author):
         # Audit author
@@ -56,42 +116,26 @@ class Importer(object):
         # Key->AM mapping
         self.ams = dict()
 
+    def _audit(self):
+        if self.author:
+            return dict(audit_author=self.author, audit_notes=AUDIT_NOTES)
+        else:
+            return dict(audit_skip=True)
+
     def import_person(self, key, info):
         """
         Import Person and AM objects, caching them in self.people and self.ams
         """
-        p = bmodels.Person(
-            username=info["username"],
-            cn=info["cn"],
-            mn=info["mn"],
-            sn=info["sn"],
-            email=info["email"],
-            uid=info["uid"],
-            fpr=info["fpr"],
-            is_staff=info.get("is_staff", False),
-            is_superuser=info.get("is_superuser", False),
-            status=info["status"],
-            status_changed=parse_datetime(info["status_changed"]),
-            created=parse_datetime(info["created"]),
-            fd_comment=info["fd_comment"] or "",
-        )
-        if self.author:
-            p.save(audit_author=self.author, audit_notes="imported from json database export")
-        else:
-            p.save(audit_skip=True)
+        p = person_from_json(info)
+        p.save(**self._audit())
         self.people[key] = p
 
+        if info["fpr"]:
+            bmodels.Fingerprint.objects.create(person=p, fpr=info["fpr"], is_active=True, **self._audit())
+
         aminfo = info["am"]
         if aminfo:
-            am = bmodels.AM(
-                person=p,
-                slots=aminfo["slots"],
-                is_am=aminfo["is_am"],
-                is_fd=aminfo["is_fd"],
-                is_dam=aminfo["is_dam"],
-                is_am_ctte=aminfo["is_am_ctte"],
-                created=parse_datetime(aminfo["created"]),
-            )
+            am = am_from_json(p, aminfo)
             am.save()
             self.ams[key] = am
 
@@ -100,16 +144,7 @@ class Importer(object):
         Import a process for the given person
         """
         # Create process
-        pr = bmodels.Process(
-            person=person,
-            applying_as=info["applying_as"],
-            applying_for=info["applying_for"],
-            progress=info["progress"],
-            archive_key=info["archive_key"],
-            is_active=info["is_active"],
-        )
-        if info["manager"]:
-            pr.manager = self.ams[info["manager"]]
+        pr = process_from_json(person, info, self.ams[info["manager"]] if info["manager"] else None)
         pr.save()
 
         # Add advocates
@@ -118,15 +153,7 @@ class Importer(object):
 
         # Add log
         for li in info["log"]:
-            l = bmodels.Log(
-                process=pr,
-                progress=li["progress"],
-                logdate=parse_datetime(li["logdate"]),
-                logtext=li["logtext"],
-            )
-
-            if li["changed_by"]:
-                l.changed_by = self.people[li["changed_by"]]
+            l = log_from_json(pr, li, self.people[li["changed_by"]] if li["changed_by"] else None)
             l.save()
 
     @transaction.atomic
@@ -166,36 +193,169 @@ class Importer(object):
         )
 
 
+class BulkImporter(object):
+    """
+    Import a JSON database dump with bulk inserts, giving the same results as
+    Importer.
+
+    The dump is read twice, streaming one record at a time: the first pass
+    creates people, fingerprints and AMs, and the second pass creates
+    processes, advocates and logs, which can refer to anyone in the dump.
+    Each batch of records is imported in its own transaction.
+    """
+    def __init__(self, author, batch_size=1000):
+        # Audit author
+        self.author = author
+        self.batch_size = batch_size
+        # Key->Person id mapping
+        self.people = dict()
+        # Key->AM id mapping
+        self.ams = dict()
+
+    def _batches(self, records):
+        batch = []
+        for info in records:
+            batch.append(info)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch: yield batch
+
+    def _audit_log(self, person_id, changes):
+        return bmodels.PersonAuditLog(person_id=person_id, author=self.author, notes=AUDIT_NOTES,
+                                      changes=bmodels.PersonAuditLog.serialize_changes(changes))
+
+    def _import_people_batch(self, batch):
+        people = [person_from_json(info) for info in batch]
+        # Compute audit information before saving, as Person.save does
+        if self.author:
+            changes = [bmodels.PersonAuditLog.diff(None, p) for p in people]
+        else:
+            changes = [None] * len(people)
+        bmodels.Person.objects.bulk_create(people, batch_size=self.batch_size)
+
+        # Not all databases return the ids of the new rows: look them up
+        ids = dict(bmodels.Person.objects.filter(username__in=[p.username for p in people]).values_list("username", "pk"))
+        fprs = []
+        ams = []
+        audit = []
+        for info, p, person_changes in zip(batch, people, changes):
+            p.pk = ids[p.username]
+            self.people[info["key"]] = p.pk
+            if self.author:
+                audit.append(self._audit_log(p.pk, person_changes))
+            if info["fpr"]:
+                fpr = bmodels.Fingerprint(person=p, fpr=info["fpr"], is_active=True)
+                fprs.append(fpr)
+                if self.author:
+                    audit.append(self._audit_log(p.pk, bmodels.PersonAuditLog.diff_fingerprint(None, fpr)))
+            if info["am"]:
+                ams.append((info["key"], am_from_json(p, info["am"])))
+
+        bmodels.Fingerprint.objects.bulk_create(fprs, batch_size=self.batch_size)
+        bmodels.AM.objects.bulk_create([am for key, am in ams], batch_size=self.batch_size)
+        bmodels.PersonAuditLog.objects.bulk_create(audit, batch_size=self.batch_size)
+
+        if ams:
+            ids = dict(bmodels.AM.objects.filter(person_id__in=[am.person_id for key, am in ams]).values_list("person_id", "pk"))
+            for key, am in ams:
+                self.ams[key] = ids[am.person_id]
+
+    def _import_processes_batch(self, batch):
+        processes = []
+        for info in batch:
+            person = bmodels.Person(pk=self.people[info["key"]])
+            for proc in info["processes"]:
+                manager = bmodels.AM(pk=self.ams[proc["manager"]]) if proc["manager"] else None
+                processes.append((proc, process_from_json(person, proc, manager)))
+        if not processes: return 0
+        bmodels.Process.objects.bulk_create([pr for info, pr in processes], batch_size=self.batch_size)
+
+        ids = dict(bmodels.Process.objects.filter(archive_key__in=[pr.archive_key for info, pr in processes]).values_list("archive_key", "pk"))
+        advocates = []
+        logs = []
+        Advocate = bmodels.Process.advocates.through
+        for info, pr in processes:
+            pr.pk = ids[pr.archive_key]
+            for a in info["advocates"]:
+                advocates.append(Advocate(process_id=pr.pk, person_id=self.people[a]))
+            for li in info["log"]:
+                changed_by = bmodels.Person(pk=self.people[li["changed_by"]]) if li["changed_by"] else None
+                logs.append(log_from_json(pr, li, changed_by))
+        Advocate.objects.bulk_create(advocates, batch_size=self.batch_size)
+        bmodels.Log.objects.bulk_create(logs, batch_size=self.batch_size)
+        return len(processes)
+
+    def _run_pass(self, name, records, func):
+        count_records = 0
+        count = 0
+        start = time.time()
+        for batch in self._batches(records):
+            try:
+                with transaction.atomic():
+                    count += func(batch) or 0
+            except:
+                log.info("Offending batch in %s pass starts with record %s", name, batch[0]["key"])
+                raise
+            count_records += len(batch)
+            elapsed = time.time() - start
+            log.info("%s pass: %d records, %d %s imported, %.1f records/s", name, count_records, count, name,
+                     count_records / elapsed if elapsed else 0)
+        return count
+
+    def import_dump(self, fname):
+        """
+        Import a dump file, which can be gzip compressed
+        """
+        def people_pass(batch):
+            self._import_people_batch(batch)
+            return len(batch)
+
+        with open_dump(fname) as fd:
+            count_people = self._run_pass("people", utils.iter_json_list(fd), people_pass)
+        with open_dump(fname) as fd:
+            count_procs = self._run_pass("processes", utils.iter_json_list(fd), self._import_processes_batch)
+        return dict(
+            people=count_people,
+            procs=count_procs,
+        )
+
+
 class Command(BaseCommand):
     help = 'Import a JSON database dump'
-    option_list = BaseCommand.option_list + (
-        optparse.make_option("--quiet", action="store_true", dest="quiet", default=None, help="Disable progress reporting"),
-        optparse.make_option("--ldap", action="store", default="ldap://db.debian.org", help="LDAP server to use. Default: %default"),
-        optparse.make_option("--author", action="store", default=None, help="user to use as author for the import. Default: %default"),
-        #l = ldap.initialize("ldap://localhost:3389")
-    )
 
-    def handle(self, *fnames, **opts):
+    def add_arguments(self, parser):
+        parser.add_argument("fnames", nargs="+", metavar="file", help="JSON dump file, optionally gzip compressed")
+        parser.add_argument("--quiet", action="store_true", default=None, help="Disable progress reporting")
+        parser.add_argument("--author", action="store", default=None, help="user to use as author for the import")
+        parser.add_argument("--batch-size", action="store", type=int, default=1000,
+                            help="number of records imported in each transaction (default: %(default)s)")
+        parser.add_argument("--slow", action="store_true", help="save one object at a time instead of using bulk inserts")
+
+    def handle(self, fnames, **opts):
         FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
         if opts["quiet"]:
             logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format=FORMAT)
         else:
             logging.basicConfig(level=logging.INFO, stream=sys.stderr, format=FORMAT)
 
-        if not fnames:
-            print("please provide a JSON dump file name", file=sys.stderr)
-            sys.exit(1)
-
         if opts["author"]:
             author = lookup_person(opts["author"])
             if not author:
-                print("Author {} not found".format(opts["author"]), file=sys.stderr)
-                sys.exit(1)
+                raise CommandError("Author {} not found".format(opts["author"]))
         else:
             author = None
 
-        importer = Importer(author=author)
+        if opts["slow"]:
+            importer = Importer(author=author)
+        else:
+            importer = BulkImporter(author=author, batch_size=opts["batch_size"])
+
         for fname in fnames:
-            with open(fname) as fd:
-                stats = importer.import_people(json.load(fd))
-            log.info("%s: imported %d people and %d processes", fname, stats["people"], stats["procs"])
+            start = time.time()
+            if opts["slow"]:
+                with open_dump(fname) as fd:
+                    stats = importer.import_people(json.load(fd))
+            else:
+                stats = importer.import_dump(fname)
+            log.info("%s: imported %d people and %d processes in %.1fs", fname, stats["people"], stats["procs"], time.time() - start)
@@ -18,13 +18,14 @@
 from django.core.management.base import BaseCommand, CommandError
 import django.db
 from django.conf import settings
-import optparse
 import sys
 import logging
 from backend import models as bmodels
 from backend import const
+from backend.utils import atomic_writer
+from backend.mailbox_index import MailboxIndex
+from concurrent.futures import ProcessPoolExecutor
 import email.utils
-import mailbox
 import datetime
 import time
 import json
@@ -50,14 +51,84 @@ def median(l):
         return (l[idx] + l[idx + 1]) / 2.0
 
 
+def read_mailbox(pathname):
+    """
+    Return a list of (date, date_orig, from) for the messages in the mailbox,
+    in mailbox order.
+
+    Only the headers are parsed, using the mailbox index, which only needs
+    to read what was appended since it was last updated.
+    """
+    index = MailboxIndex(pathname)
+    res = []
+    for idx in range(len(index)):
+        msg = index.summary(idx)
+        parsed = email.utils.parsedate(msg["Date"])
+        if parsed is None or not msg["RawFrom"]:
+            log.warning("%s: skipping message %d with no valid Date or From", pathname, idx)
+            continue
+        # Parse the address from the undecoded header, since decoded names
+        # can contain commas and angle brackets
+        t, addr = email.utils.parseaddr(msg["RawFrom"].lower())
+        if "@" not in addr:
+            addr = addr + "@debian.org"
+        res.append((time.mktime(parsed), msg["Date"], addr))
+    return res
+
+
+def _read_mailbox_job(pathname, size, mtime):
+    return pathname, size, mtime, read_mailbox(pathname)
+
+
+class MailboxCache(object):
+    """
+    Per-mailbox results of read_mailbox, stored in a JSON file, and
+    invalidated when the size or mtime of the mailbox change
+    """
+    VERSION = 2
+
+    def __init__(self, pathname):
+        self.pathname = pathname
+        self.mailboxes = {}
+
+    def load(self):
+        try:
+            with open(self.pathname, "rt") as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return
+        if data.get("version") != self.VERSION: return
+        self.mailboxes = data["mailboxes"]
+
+    def save(self):
+        with atomic_writer(self.pathname, mode="wt", sync=False) as fd:
+            json.dump({"version": self.VERSION, "mailboxes": self.mailboxes}, fd)
+
+    def get(self, pathname, size, mtime):
+        cached = self.mailboxes.get(pathname)
+        if cached is None: return None
+        if cached["size"] != size or cached["mtime"] != mtime: return None
+        return cached["mails"]
+
+    def set(self, pathname, size, mtime, mails):
+        self.mailboxes[pathname] = {"size": size, "mtime": mtime, "mails": mails}
+
+    def prune(self, pathnames):
+        """
+        Forget mailboxes not in pathnames
+        """
+        for pathname in list(self.mailboxes.keys()):
+            if pathname not in pathnames:
+                del self.mailboxes[pathname]
+
+
 class Interaction(object):
-    data = {'emails': {}, 'process': {}}
-    unsort_data = []
+    def __init__(self):
+        self.data = {'emails': {}, 'process': {}}
 
-    @classmethod
-    def _add_data(cls, key, data_key, data, date_diff):
-        if data[data_key] not in cls.data[key]:
-            cls.data[key][data[data_key]] = {
+    def _add_data(self, key, data_key, data, date_diff):
+        if data[data_key] not in self.data[key]:
+            self.data[key][data[data_key]] = {
                 'num_mails': 1,
                 'date_first': data['date'],
                 'date_last': data['date'],
@@ -66,77 +137,114 @@ class Interaction(object):
                 'response_time': []
             }
         else:
-            d = cls.data[key][data[data_key]]
+            d = self.data[key][data[data_key]]
             d['num_mails'] = d['num_mails'] + 1
             d['date_last'] = data['date']
             d['date_last_orig'] = data['date_orig']
             if date_diff is not None:
                 d['response_time'].append(date_diff)
 
-    @classmethod
-    def _add(cls, data):
-        if data['process'] not in cls.data['process']:
+    def _add(self, data):
+        if data['process'] not in self.data['process']:
             date_diff = None
-            cls._add_data('process', 'process', data, date_diff)
+            self._add_data('process', 'process', data, date_diff)
             log.debug("%s skiped. First mail" % data['date_orig'])
-            cls._add_data('emails', 'From', data, date_diff)
+            self._add_data('emails', 'From', data, date_diff)
         else:
-            d = cls.data['process'][data['process']]
+            d = self.data['process'][data['process']]
             date_diff = data['date'] - d['date_last']
-            cls._add_data('process', 'process', data, date_diff)
+            self._add_data('process', 'process', data, date_diff)
             log.debug("%s - %s -> %s" % (data['date_orig'],
                                          d['date_last_orig'], date_diff))
             if(date_diff > 0):
-                cls._add_data('emails', 'From', data, date_diff)
+                self._add_data('emails', 'From', data, date_diff)
             else:
                 log.warn("date_diff: %s skiped!!" % date_diff)
 
-    def add(self, process_key, msg):
-        d = {'process': process_key}
-        d['date'] = time.mktime(email.utils.parsedate(msg["Date"]))
-        d['date_orig'] = msg["Date"]
-        t, d['From'] = email.utils.parseaddr(msg["From"].lower())
-        if "@" not in d['From']:
-            d['From'] = d['From'] + "@debian.org"
-        self.unsort_data.append(d)
-
-    @classmethod
-    def _median(cls, process_key):
+    def add_mailbox(self, process_key, mails):
+        """
+        Add the results of read_mailbox for the mailbox of a process
+        """
+        for date, date_orig, from_ in sorted(mails, key=lambda x: x[0]):
+            self._add({'process': process_key, 'date': date, 'date_orig': date_orig, 'From': from_})
+        self._median(process_key)
+
+    def _median(self, process_key):
         if process_key is not None:
-            if process_key in cls.data['process']:
-                d = cls.data['process'][process_key]
+            if process_key in self.data['process']:
+                d = self.data['process'][process_key]
                 log.debug("response_time: %s" % d['response_time'])
                 d['median'] = median(d['response_time'])
                 log.debug("%s -> median: %s" % (process_key, d['median']))
         else:
-            for k, d in cls.data['emails'].items():
+            for k, d in self.data['emails'].items():
                 if d['num_mails'] > 1:
                     d['median'] = median(d['response_time'])
 
-    def generate_stats(self, process_key):
-        self.sort_data = sorted(self.unsort_data,
-                                key=lambda x: x['date'], reverse=False)
-        self.unsort_data = []
-        for d in self.sort_data:
-            self._add(d)
-        self._median(process_key)
-
     def generate_email_stats(self):
         self._median(None)
 
     def export(self, filename):
-        with open(filename, 'w') as outfile:
+        with atomic_writer(filename, mode="wt", sync=False) as outfile:
             json.dump(self.data, outfile)
 
 
+def compute_stats(processes, cache, jobs=None):
+    """
+    Compute mailbox statistics for the given processes.
+
+    Mailboxes not in the cache, or changed since they were cached, are read
+    in parallel by a pool of jobs processes; results are then merged in the
+    order of processes.
+    """
+    mailboxes = []
+    todo = []
+    for process in processes:
+        key = process.lookup_key
+        mailbox_file = process.mailbox_file
+        log.debug("%s[%s] -> %s" % (str(process), key, mailbox_file))
+        if not mailbox_file:
+            log.warn("%s[%s] skiped, no mailbox file defined" %
+                     (str(process), key))
+            continue
+        st = os.stat(mailbox_file)
+        mailboxes.append((key, mailbox_file))
+        if cache.get(mailbox_file, st.st_size, st.st_mtime_ns) is None:
+            todo.append((mailbox_file, st.st_size, st.st_mtime_ns))
+
+    if todo:
+        log.info("%d/%d mailboxes need reading", len(todo), len(mailboxes))
+        if jobs == 1:
+            results = [_read_mailbox_job(*args) for args in todo]
+        else:
+            # Do not share the database connection with the workers
+            django.db.connections.close_all()
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_read_mailbox_job, *zip(*todo)))
+        for pathname, size, mtime, mails in results:
+            cache.set(pathname, size, mtime, mails)
+            log.info("%s processed", pathname)
+    cache.prune(set(pathname for key, pathname in mailboxes))
+
+    interactions = Interaction()
+    for key, pathname in mailboxes:
+        interactions.add_mailbox(key, cache.mailboxes[pathname]["mails"])
+    interactions.generate_email_stats()
+    return interactions
+
+
 class Command(BaseCommand):
     help = 'Generate stats for Process'
-    option_list = BaseCommand.option_list + (
-        optparse.make_option("--quiet", action="store_true", dest="quiet",
-                             default=None, help="Disable progress reporting"),
-        optparse.make_option("--debug", action="store_true", dest="debug",
-                             default=None, help="Enable debug"),
-    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quiet", action="store_true", dest="quiet",
+                            default=None, help="Disable progress reporting")
+        parser.add_argument("--debug", action="store_true", dest="debug",
+                            default=None, help="Enable debug")
+        parser.add_argument("--jobs", action="store", type=int, default=None,
+                            help="Number of processes used to read mailboxes (default: number of CPUs)")
+        parser.add_argument("--full", action="store_true",
+                            help="Ignore cached results and read all mailboxes")
 
     def handle(self, *args, **opts):
         FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
@@ -153,20 +261,11 @@ class Command(BaseCommand):
 
         managed_process = \
             bmodels.Process.objects.filter(manager__isnull=False)
-        interactions = Interaction()
-
-        for progress in managed_process:
-            key = progress.lookup_key
-            mailbox_file = progress.mailbox_file
-            log.debug("%s[%s] -> %s" % (str(progress), key, mailbox_file))
-            if mailbox_file:
-                for msg in mailbox.mbox(mailbox_file, create=False):
-                    interactions.add(key, msg)
-                interactions.generate_stats(key)
-                log.info("%s processed", mailbox_file)
-            else:
-                log.warn("%s[%s] skiped, no mailbox file defined" %
-                         (str(progress), key))
 
-        interactions.generate_email_stats()
+        cache = MailboxCache(os.path.join(settings.DATA_DIR, 'mbox_stats_cache.json'))
+        if not opts["full"]:
+            cache.load()
+
+        interactions = compute_stats(managed_process, cache, jobs=opts["jobs"])
+        cache.save()
         interactions.export(os.path.join(settings.DATA_DIR, 'mbox_stats.json'))
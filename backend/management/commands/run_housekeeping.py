@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+import sys
+import logging
+from backend.housekeeping_scheduler import Scheduler
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run housekeeping tasks, running independent tasks concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quiet", action="store_true", default=None, help="Disable progress reporting")
+        parser.add_argument("--dry-run", action="store_true", help="Verify what would be done, without changing any data")
+        parser.add_argument("--workers", action="store", type=int, default=None, help="Maximum number of tasks running at the same time (default: HOUSEKEEPING_WORKERS)")
+        parser.add_argument("--outdir", action="store", default=None, help="Root directory for housekeeping output (default: HOUSEKEEPING_ROOT)")
+        parser.add_argument("--report", action="store", default=None, help="Write the JSON timing report to this file (default: in the output directory)")
+
+    def handle(self, **opts):
+        FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
+        if opts["quiet"]:
+            logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format=FORMAT)
+        else:
+            logging.basicConfig(level=logging.INFO, stream=sys.stderr, format=FORMAT)
+
+        scheduler = Scheduler(dry_run=opts["dry_run"], workers=opts["workers"], outdir=opts["outdir"])
+        scheduler.autodiscover()
+        scheduler.init()
+        report = scheduler.run()
+
+        for stage in report["stages"]:
+            for task in sorted(stage["tasks"], key=lambda t: -t.get("wall_time", 0)):
+                log.info("%s/%s: %s, %.1fs wall, %.1fs cpu, %d queries",
+                         stage["stage"], task["task"], task["status"],
+                         task.get("wall_time", 0), task.get("cpu_time", 0), task.get("queries", 0))
+        pathname = scheduler.save_report(opts["report"])
+        if pathname is not None:
+            log.info("timing report written to %s", pathname)
+        log.info("housekeeping completed in %.1fs", report["wall_time"])
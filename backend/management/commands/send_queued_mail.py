@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+import sys
+import logging
+from backend import mailqueue
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Deliver the messages in the outgoing mail queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quiet", action="store_true", default=None, help="Disable progress reporting")
+        parser.add_argument("--once", action="store_true", help="Send the messages that are due and exit, instead of waiting for new ones")
+        parser.add_argument("--poll", action="store", type=float, default=5, help="Seconds between checks for new messages (default: %(default)s)")
+
+    def handle(self, **opts):
+        FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
+        if opts["quiet"]:
+            logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format=FORMAT)
+        else:
+            logging.basicConfig(level=logging.INFO, stream=sys.stderr, format=FORMAT)
+
+        worker = mailqueue.Worker()
+        if opts["once"]:
+            sent, failed = worker.run_once()
+            log.info("%d messages sent, %d failed attempts", sent, failed)
+        else:
+            try:
+                worker.run(poll_interval=opts["poll"])
+            except KeyboardInterrupt:
+                worker.close()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0023_person_last_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('from_email', models.CharField(blank=True, default='', max_length=255)),
+                ('recipients', models.TextField(blank=True, default='', help_text='comma-separated recipient addresses')),
+                ('subject', models.TextField(blank=True, default='')),
+                ('message', models.TextField(default='{}')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('sent', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
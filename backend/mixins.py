@@ -1,7 +1,12 @@
 from django.views.generic import TemplateView
 from django.core.exceptions import PermissionDenied
 from django.core import signing
+from django.core.paginator import Paginator, InvalidPage
+from django.urls import reverse
+from django.utils.html import linebreaks
+from django import http
 from . import models as bmodels
+from .mailbox_index import MailboxIndex
 
 class OverrideView(Exception):
     """
@@ -187,3 +192,58 @@ class TokenAuthMixin:
             if u is not None:
                 self.request.user = u
         super().load_objects()
+
+
+class MailArchiveMixin:
+    """
+    Paginated listing of a process mailbox, with message bodies loaded on
+    request
+    """
+    # Number of messages per page
+    paginate_by = 100
+    # Name of the URL of a message body. It takes the same keyword arguments
+    # as the URL of the view, plus msg with the index of the message.
+    message_url_name = None
+
+    def get_mailbox_index(self):
+        fname = self.process.mailbox_file
+        if fname is None: raise http.Http404
+        return MailboxIndex(fname)
+
+    def get_message_url(self, idx):
+        """
+        Return the URL of the body of the message with the given index
+        """
+        kwargs = dict(self.kwargs)
+        kwargs["msg"] = idx
+        return reverse(self.message_url_name, kwargs=kwargs)
+
+    def get_context_data(self, **kw):
+        ctx = super().get_context_data(**kw)
+        index = self.get_mailbox_index()
+        paginator = Paginator(range(len(index)), self.paginate_by, allow_empty_first_page=True)
+        try:
+            page = paginator.page(self.request.GET.get("page", 1))
+        except InvalidPage:
+            raise http.Http404
+        mails = []
+        for idx in page.object_list:
+            mail = index.summary(idx)
+            mail["url"] = self.get_message_url(idx)
+            mails.append(mail)
+        ctx["mails"] = mails
+        ctx["page_obj"] = page
+        ctx["class"] = "clickable"
+        return ctx
+
+
+class MailArchiveMessageMixin(MailArchiveMixin):
+    """
+    Return the decoded body of a message in a process mailbox, as a HTML
+    fragment
+    """
+    def get(self, request, *args, **kw):
+        index = self.get_mailbox_index()
+        idx = int(self.kwargs["msg"])
+        if idx >= len(index): raise http.Http404
+        return http.HttpResponse(linebreaks(index.get_body(idx), autoescape=True))
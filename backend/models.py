@@ -3,7 +3,7 @@ Core models of the New Member site
 """
 from django.utils.translation import ugettext_lazy as _
 from django.utils.timezone import utc, now
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth.models import BaseUserManager, PermissionsMixin
@@ -11,6 +11,7 @@ from django.forms.models import model_to_dict
 from . import const
 from .fields import *
 from .utils import cached_property
+import copy
 import datetime
 import urllib.request, urllib.parse, urllib.error
 import os.path
@@ -21,6 +22,8 @@ from django.db.models.signals import post_save
 
 PROCESS_MAILBOX_DIR = getattr(settings, "PROCESS_MAILBOX_DIR_OLD", "/srv/nm.debian.org/mbox/applicants/")
 DM_IMPORT_DATE = getattr(settings, "DM_IMPORT_DATE", None)
+# Number of rows written by each query in bulk updates
+BULK_BATCH_SIZE = getattr(settings, "BULK_BATCH_SIZE", 500)
 
 
 class Permissions(set):
@@ -42,7 +45,11 @@ class PersonVisitorPermissions(VisitorPermissions):
     """
     Store NM-specific permissions
     """
-    def __init__(self, person, visitor):
+    def __init__(self, person, visitor, resolver=None):
+        """
+        resolver, if given, is a process.models.PermissionResolver used to
+        look up the active processes of the person
+        """
         super(PersonVisitorPermissions, self).__init__(visitor)
         # Person being visited
         self.person = person.person
@@ -51,14 +58,21 @@ class PersonVisitorPermissions(VisitorPermissions):
         # info, since this database then becomes a read-only mirror of LDAP
         self.person_has_ldap_record = self.person.status not in (const.STATUS_DC, const.STATUS_DM)
 
-        # Possible new statuses that the person can have
-        self.person_possible_new_statuses = self.person.possible_new_statuses
+        if resolver is not None:
+            active = resolver.active_processes(self.person)
+            # Possible new statuses that the person can have
+            self.person_possible_new_statuses = self.person.compute_possible_new_statuses([x.applying_for for x in active])
+            # True if there are active processes currently frozen for review
+            self.person_has_frozen_processes = any(x.frozen for x in active)
+        else:
+            # Possible new statuses that the person can have
+            self.person_possible_new_statuses = self.person.possible_new_statuses
 
-        # True if there are active processes currently frozen for review
-        self.person_has_frozen_processes = False
-        import process.models as pmodels
-        if pmodels.Process.objects.filter(person=self.person, frozen_by__isnull=False, closed_time__isnull=True).exists():
-            self.person_has_frozen_processes = True
+            # True if there are active processes currently frozen for review
+            self.person_has_frozen_processes = False
+            import process.models as pmodels
+            if pmodels.Process.objects.filter(person=self.person, frozen_by__isnull=False, closed_time__isnull=True).exists():
+                self.person_has_frozen_processes = True
 
         if self.visitor is None:
             pass
@@ -119,6 +133,82 @@ class ProcessVisitorPermissions(PersonVisitorPermissions):
             self.add("view_mbox")
 
 
+def bulk_update(model, objs, fields, batch_size=None):
+    """
+    Write the given fields of all objs to the database, using one UPDATE query
+    for each batch of objects.
+
+    This does what QuerySet.bulk_update does in newer versions of Django.
+    """
+    objs = list(objs)
+    if not objs: return
+    batch_size = batch_size or BULK_BATCH_SIZE
+    fields = [model._meta.get_field(name) for name in fields]
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        values = {}
+        for field in fields:
+            attrs = [getattr(o, field.attname) for o in batch]
+            if all(a == attrs[0] for a in attrs):
+                values[field.name] = attrs[0]
+            else:
+                values[field.name] = models.Case(
+                    *(models.When(pk=o.pk, then=models.Value(a, output_field=field)) for o, a in zip(batch, attrs)),
+                    output_field=field)
+        model.objects.filter(pk__in=[o.pk for o in batch]).update(**values)
+
+
+class AuditedChanges(object):
+    """
+    Collect changes to many objects, to write them all at once together with
+    their PersonAuditLog entries
+    """
+    def __init__(self, model, audit_author=None, audit_skip=False):
+        self.model = model
+        self.author = audit_author
+        self.audit_skip = audit_skip
+        # Map a tuple of field names to the objects that changed them, by id()
+        self.updates = {}
+        # Unsaved PersonAuditLog entries
+        self.logs = []
+        self.changed = []
+        self._changed_ids = set()
+
+    def apply(self, obj, values):
+        """
+        Set the values of the fields of obj, and return a copy of obj as it
+        was before, or None if nothing changed
+        """
+        old = copy.copy(obj)
+        fields = []
+        for name, value in values.items():
+            if getattr(obj, name) == value: continue
+            setattr(obj, name, value)
+            fields.append(self.model._meta.get_field(name).name)
+        if not fields: return None
+        # The same object can be changed more than once
+        self.updates.setdefault(tuple(sorted(fields)), {})[id(obj)] = obj
+        if id(obj) not in self._changed_ids:
+            self._changed_ids.add(id(obj))
+            self.changed.append(obj)
+        return old
+
+    def log(self, person_id, notes, changes):
+        if self.audit_skip or not changes: return
+        if not self.author:
+            raise RuntimeError("Cannot save a {} instance without providing Author information".format(self.model.__name__))
+        self.logs.append(PersonAuditLog(person_id=person_id, author=self.author, notes=notes or "",
+                                        changes=PersonAuditLog.serialize_changes(changes)))
+
+    def save(self, batch_size=None):
+        if not self.changed: return []
+        with transaction.atomic():
+            for fields, objs in self.updates.items():
+                bulk_update(self.model, list(objs.values()), fields, batch_size=batch_size)
+            PersonAuditLog.objects.bulk_create(self.logs, batch_size=batch_size or BULK_BATCH_SIZE)
+        return self.changed
+
+
 class PersonManager(BaseUserManager):
     def create_user(self, email, **other_fields):
         if not email:
@@ -137,6 +227,32 @@ class PersonManager(BaseUserManager):
         other_fields["is_superuser"] = True
         return self.create_user(email, **other_fields)
 
+    def bulk_change(self, changes, audit_author=None, audit_skip=False, batch_size=None):
+        """
+        Change many Person objects at once, creating the same audit log
+        entries as saving them one at a time.
+
+        changes is a sequence of (person, {field: value}, audit_notes). The
+        person objects are used as they are to compute differences for the
+        audit log, so they should be freshly loaded from the database.
+
+        Returns the list of the people that have been changed.
+        """
+        res = AuditedChanges(self.model, audit_author=audit_author, audit_skip=audit_skip)
+        for person, values, notes in changes:
+            old = res.apply(person, values)
+            if old is None: continue
+            res.log(person.pk, notes, PersonAuditLog.diff(old, person))
+        return res.save(batch_size=batch_size)
+
+    def with_fingerprint(self):
+        """
+        Return a QuerySet of people that also loads their active fingerprint,
+        so that Person.fingerprint and Person.fpr do not run a query for each
+        person
+        """
+        return self.get_queryset().prefetch_related(prefetch_active_fingerprint())
+
     def get_or_none(self, *args, **kw):
         """
         Same as get(), but returns None instead of raising DoesNotExist if the
@@ -290,10 +406,15 @@ class Person(PermissionsMixin, models.Model):
         Return the Fingerprint associated to this person, or None if there is
         none
         """
+        # Use the active fingerprints loaded by prefetch_active_fingerprint,
+        # if available
+        active = getattr(self, "active_fprs", None)
+        if active is None:
+            active = self.fprs.filter(is_active=True)
         # If there is more than one active fingerprint, return a random one.
         # This should not happen, and a nightly maintenance task will warn if
         # it happens.
-        for f in self.fprs.filter(is_active=True):
+        for f in active:
             return f
         return None
 
@@ -464,6 +585,16 @@ class Person(PermissionsMixin, models.Model):
         Return a list of possible new statuses that can be requested for the
         person
         """
+        return self.compute_possible_new_statuses()
+
+    def compute_possible_new_statuses(self, applying_for=None):
+        """
+        Return a list of possible new statuses that can be requested for the
+        person.
+
+        applying_for is the list of statuses the person is applying for in
+        active processes. If None, it is read from the database.
+        """
         if self.pending: return []
 
         statuses = list(self._new_status_table.get(self.status, []))
@@ -471,9 +602,10 @@ class Person(PermissionsMixin, models.Model):
         # Compute statuses one is already applying for in active processes
         blacklist = []
         if statuses:
-            import process.models as pmodels
-            for proc in pmodels.Process.objects.filter(person=self, closed_time__isnull=True):
-                blacklist.append(proc.applying_for)
+            if applying_for is None:
+                import process.models as pmodels
+                applying_for = pmodels.Process.objects.filter(person=self, closed_time__isnull=True).values_list("applying_for", flat=True)
+            blacklist.extend(applying_for)
         if const.STATUS_DD_U in blacklist: blacklist.append(const.STATUS_DD_NU)
         if const.STATUS_DD_NU in blacklist: blacklist.append(const.STATUS_DD_U)
         # When a non uploader is becoming emeritus, disable applying for upload rights
@@ -599,6 +731,53 @@ class FingerprintManager(BaseUserManager):
         res.save(using=self._db, audit_author=audit_author, audit_notes=audit_notes, audit_skip=audit_skip)
         return res
 
+    def bulk_change(self, changes, audit_author=None, audit_skip=False, batch_size=None):
+        """
+        Change many Fingerprint objects at once, creating the same audit log
+        entries as saving them one at a time, including the deactivation of
+        the other keys of a person when an active key is saved. If more than
+        one key of a person is active after the changes, the last one wins.
+
+        changes is a sequence of (fingerprint, {field: value}, audit_notes).
+        The fingerprint objects are used as they are to compute differences
+        for the audit log, so they should be freshly loaded from the database.
+
+        Returns the list of the fingerprints that have been changed.
+        """
+        res = AuditedChanges(self.model, audit_author=audit_author, audit_skip=audit_skip)
+        # Map person_id to the list of (fingerprint, notes) of their keys that
+        # are active after the change, in order
+        activated = {}
+        for fpr, values, notes in changes:
+            old = res.apply(fpr, values)
+            if old is not None:
+                diff = PersonAuditLog.diff_fingerprint(old, fpr)
+                if old.person_id != fpr.person_id:
+                    res.log(old.person_id, notes, diff)
+                res.log(fpr.person_id, notes, diff)
+            # Saving an active key deactivates all the other keys of the person
+            if fpr.is_active:
+                activated.setdefault(fpr.person_id, []).append((fpr, notes))
+
+        if activated:
+            # Active keys that are not in this batch are deactivated by the
+            # first key of their person saved as active
+            in_batch = [fpr.pk for fpr in res.changed]
+            in_batch.extend(fpr.pk for keys in activated.values() for fpr, notes in keys)
+            deactivate = [
+                (other, activated[other.person_id][0][1])
+                for other in self.filter(person_id__in=activated.keys(), is_active=True).exclude(pk__in=in_batch)]
+            # Active keys in this batch are deactivated by the next one
+            for keys in activated.values():
+                for (fpr, notes), (next_fpr, next_notes) in zip(keys, keys[1:]):
+                    deactivate.append((fpr, next_notes))
+            for fpr, notes in deactivate:
+                old = res.apply(fpr, {"is_active": False})
+                if old is None: continue
+                res.log(fpr.person_id, notes, PersonAuditLog.diff_fingerprint(old, fpr))
+
+        return res.save(batch_size=batch_size)
+
 
 class Fingerprint(models.Model):
     """
@@ -668,6 +847,17 @@ class Fingerprint(models.Model):
                 fpr.save(audit_notes=notes, audit_author=author, audit_skip=audit_skip)
 
 
+def prefetch_active_fingerprint(lookup="fprs"):
+    """
+    Return a Prefetch object that loads the active fingerprints of people in
+    their active_fprs attribute, which is used by Person.fingerprint.
+
+    lookup can be changed to prefetch the fingerprints of related people, as
+    in prefetch_active_fingerprint("person__fprs").
+    """
+    return models.Prefetch(lookup, queryset=Fingerprint.objects.filter(is_active=True), to_attr="active_fprs")
+
+
 class PersonAuditLog(models.Model):
     person = models.ForeignKey(Person, related_name="audit_log")
     logdate = models.DateTimeField(null=False, auto_now_add=True)
@@ -1038,6 +1228,58 @@ class Log(models.Model):
         return cls(**kw)
 
 
+class QueuedMail(models.Model):
+    """
+    An outgoing email, waiting to be sent by the mail queue worker
+    """
+    created = models.DateTimeField(null=False, default=now, db_index=True)
+    from_email = models.CharField(max_length=255, null=False, blank=True, default="")
+    recipients = models.TextField(null=False, blank=True, default="", help_text=_("comma-separated recipient addresses"))
+    subject = models.TextField(null=False, blank=True, default="")
+    # JSON-encoded fields of the EmailMessage
+    message = models.TextField(null=False, default="{}")
+    attempts = models.PositiveIntegerField(null=False, default=0)
+    next_attempt = models.DateTimeField(null=False, default=now, db_index=True)
+    last_error = models.TextField(null=False, blank=True, default="")
+    sent = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Set when the worker gives up retrying
+    failed = models.BooleanField(null=False, default=False)
+
+    def __str__(self):
+        return "{}: {} to {}".format(self.created, self.subject, self.recipients)
+
+    @classmethod
+    def from_email_message(cls, msg):
+        """
+        Create a QueuedMail (without saving it) from a Django EmailMessage
+        """
+        if msg.attachments or getattr(msg, "alternatives", None):
+            raise ValueError("the mail queue does not support attachments")
+        fields = {
+            "from_email": msg.from_email,
+            "to": list(msg.to),
+            "cc": list(msg.cc),
+            "bcc": list(msg.bcc),
+            "reply_to": list(msg.reply_to),
+            "subject": str(msg.subject),
+            "body": str(msg.body),
+            "headers": {k: str(v) for k, v in msg.extra_headers.items()},
+        }
+        return cls(
+            from_email=msg.from_email,
+            recipients=", ".join(msg.recipients()),
+            subject=fields["subject"],
+            message=json.dumps(fields))
+
+    def to_email_message(self, connection=None):
+        """
+        Rebuild the Django EmailMessage
+        """
+        from django.core.mail import EmailMessage
+        fields = json.loads(self.message)
+        return EmailMessage(connection=connection, **fields)
+
+
 MOCK_FD_COMMENTS = [
     "Cannot get GPG signatures because of extremely sensitive teeth",
     "Only has internet connection on days which are prime numbers",
@@ -1050,105 +1292,130 @@ MOCK_LOGTEXTS = [
     "ok", "hmm", "meh", "asdf", "moo", "...", "üñįç♥ḋə"
 ]
 
-def export_db(full=False):
+def export_db(full=False, queryset=None, batch_size=None):
     """
     Export the whole databae into a json-serializable array.
 
     If full is False, then the output is stripped of privacy-sensitive
     information.
+
+    queryset can be used to export only some people. People are loaded
+    BULK_BATCH_SIZE at a time, with a fixed number of queries per batch.
     """
-    import random
+    if queryset is None: queryset = Person.objects.all()
+    batch_size = batch_size or BULK_BATCH_SIZE
 
     fd = list(Person.objects.filter(am__is_fd=True))
 
     # Use order_by so that dumps are easier to diff
-    for idx, p in enumerate(Person.objects.all().order_by("uid", "email")):
-        # Person details
-        ep = dict(
-            username=p.username,
-            key=p.lookup_key,
-            cn=p.cn,
-            mn=p.mn,
-            sn=p.sn,
-            email=p.email,
-            uid=p.uid,
-            fpr=p.fpr,
-            is_staff=p.is_staff,
-            is_superuser=p.is_superuser,
-            status=p.status,
-            status_changed=p.status_changed,
-            created=p.created,
-            fd_comment=None,
-            am=None,
-            processes=[],
+    pks = list(queryset.order_by("uid", "email").values_list("pk", flat=True))
+    for start in range(0, len(pks), batch_size):
+        chunk = pks[start:start + batch_size]
+        people = Person.objects.with_fingerprint().filter(pk__in=chunk).select_related("am").prefetch_related(
+            models.Prefetch("processes", queryset=Process.objects.order_by("applying_for").select_related("manager__person").prefetch_related(
+                "advocates",
+                models.Prefetch("log", queryset=Log.objects.order_by("logdate").select_related("changed_by")),
+            )))
+        by_pk = {p.pk: p for p in people}
+        for pk in chunk:
+            # Skip people deleted while exporting
+            p = by_pk.get(pk)
+            if p is None: continue
+            yield _export_person(p, full, fd)
+
+
+def _export_person(p, full, fd):
+    """
+    Export a Person, with prefetched processes, as a json-serializable dict
+    """
+    import random
+
+    # Person details
+    ep = dict(
+        username=p.username,
+        key=p.lookup_key,
+        cn=p.cn,
+        mn=p.mn,
+        sn=p.sn,
+        email=p.email,
+        uid=p.uid,
+        fpr=p.fpr,
+        is_staff=p.is_staff,
+        is_superuser=p.is_superuser,
+        status=p.status,
+        status_changed=p.status_changed,
+        created=p.created,
+        fd_comment=None,
+        am=None,
+        processes=[],
+    )
+
+    if full:
+        ep["fd_comment"] = p.fd_comment
+    else:
+        if random.randint(1, 100) < 20:
+            ep["fd_comment"] = random.choice(MOCK_FD_COMMENTS)
+
+    # AM details
+    am = p.am_or_none
+    if am:
+        ep["am"] = dict(
+            slots=am.slots,
+            is_am=am.is_am,
+            is_fd=am.is_fd,
+            is_dam=am.is_dam,
+            is_am_ctte=am.is_am_ctte,
+            created=am.created)
+
+    # Process details
+    for pr in p.processes.all():
+        epr = dict(
+            applying_as=pr.applying_as,
+            applying_for=pr.applying_for,
+            progress=pr.progress,
+            is_active=pr.is_active,
+            archive_key=pr.archive_key,
+            manager=None,
+            advocates=[],
+            log=[],
         )
+        ep["processes"].append(epr)
 
-        if full:
-            ep["fd_comment"] = p.fd_comment
+        # Also get a list of actors who can be used for mock logging later
+        if pr.manager:
+            epr["manager"] = pr.manager.lookup_key
+            actors = [pr.manager.person] + fd
         else:
-            if random.randint(1, 100) < 20:
-                ep["fd_comment"] = random.choice(MOCK_FD_COMMENTS)
-
-        # AM details
-        am = p.am_or_none
-        if am:
-            ep["am"] = dict(
-                slots=am.slots,
-                is_am=am.is_am,
-                is_fd=am.is_fd,
-                is_dam=am.is_dam,
-                is_am_ctte=am.is_am_ctte,
-                created=am.created)
-
-        # Process details
-        for pr in p.processes.all().order_by("applying_for"):
-            epr = dict(
-                applying_as=pr.applying_as,
-                applying_for=pr.applying_for,
-                progress=pr.progress,
-                is_active=pr.is_active,
-                archive_key=pr.archive_key,
-                manager=None,
-                advocates=[],
-                log=[],
-            )
-            ep["processes"].append(epr)
-
-            # Also get a list of actors who can be used for mock logging later
-            if pr.manager:
-                epr["manager"] = pr.manager.lookup_key
-                actors = [pr.manager.person] + fd
+            actors = fd
+
+        for a in pr.advocates.all():
+            epr["advocates"].append(a.lookup_key)
+
+        # Log details
+        last_progress = None
+        for l in pr.log.all():
+            if not full and last_progress == l.progress:
+                # Consolidate consecutive entries to match simplification
+                # done by public interface
+                continue
+
+            el = dict(
+                changed_by=None,
+                progress=l.progress,
+                logdate=l.logdate,
+                logtext=None)
+
+            if full:
+                if l.changed_by:
+                    el["changed_by"] = l.changed_by.lookup_key
+                el["logtext"] = l.logtext
             else:
-                actors = fd
-
-            for a in pr.advocates.all():
-                epr["advocates"].append(a.lookup_key)
-
-            # Log details
-            last_progress = None
-            for l in pr.log.all().order_by("logdate"):
-                if not full and last_progress == l.progress:
-                    # Consolidate consecutive entries to match simplification
-                    # done by public interface
-                    continue
-
-                el = dict(
-                    changed_by=None,
-                    progress=l.progress,
-                    logdate=l.logdate,
-                    logtext=None)
-
-                if full:
-                    if l.changed_by:
-                        el["changed_by"] = l.changed_by.lookup_key
-                    el["logtext"] = l.logtext
-                else:
-                    if l.changed_by:
-                        el["changed_by"] = random.choice(actors).lookup_key
-                    el["logtext"] = random.choice(MOCK_LOGTEXTS)
+                if l.changed_by:
+                    el["changed_by"] = random.choice(actors).lookup_key
+                el["logtext"] = random.choice(MOCK_LOGTEXTS)
 
-                epr["log"].append(el)
+            epr["log"].append(el)
 
-                last_progress = l.progress
+            last_progress = l.progress
 
-        yield ep
+    return ep
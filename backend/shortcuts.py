@@ -6,3 +6,85 @@ def build_absolute_uri(location, request=None):
     site = get_current_site(request)
     return "https://{}{}".format(site.domain, location)
 
+
+
+def _parse_range(header, size):
+    """
+    Parse a single-range Range header, returning (start, end) with end
+    excluded, None if the header should be ignored, or False if the range
+    cannot be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[6:].strip().partition("-")
+    try:
+        if not sep:
+            return None
+        elif not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0: return False
+            return max(0, size - length), size
+        else:
+            start = int(start)
+            end = int(end) + 1 if end else size
+    except ValueError:
+        return None
+    if start >= size or end <= start: return False
+    return start, min(end, size)
+
+
+def serve_file(request, pathname, filename, content_type="application/octet-stream", etag=None, last_modified=None):
+    """
+    Serve a file as a download, supporting conditional requests and resuming
+    with single Range requests.
+
+    etag is an unquoted string, last_modified a naive UTC datetime.
+    """
+    from django import http
+    from django.utils.cache import get_conditional_response
+    from django.utils.http import http_date, quote_etag
+    import calendar
+    import os
+
+    if etag is not None: etag = quote_etag(etag)
+    last_modified_ts = calendar.timegm(last_modified.utctimetuple()) if last_modified is not None else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+    if response is None:
+        size = os.path.getsize(pathname)
+        byte_range = None
+        if request.method == "GET":
+            byte_range = _parse_range(request.META.get("HTTP_RANGE"), size)
+            # Ignore the range if the file changed since the client got it
+            if_range = request.META.get("HTTP_IF_RANGE")
+            if if_range and if_range not in (etag, http_date(last_modified_ts) if last_modified_ts else None):
+                byte_range = None
+
+        if byte_range is False:
+            response = http.HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(size)
+        elif byte_range is None:
+            response = http.FileResponse(open(pathname, "rb"), content_type=content_type)
+            response["Content-Length"] = size
+        else:
+            start, end = byte_range
+            def read_range(block_size=65536):
+                with open(pathname, "rb") as fd:
+                    fd.seek(start)
+                    remaining = end - start
+                    while remaining > 0:
+                        data = fd.read(min(block_size, remaining))
+                        if not data: break
+                        remaining -= len(data)
+                        yield data
+            response = http.StreamingHttpResponse(read_range(), status=206, content_type=content_type)
+            response["Content-Range"] = "bytes {}-{}/{}".format(start, end - 1, size)
+            response["Content-Length"] = end - start
+        if response.status_code != 416:
+            response["Content-Disposition"] = "attachment; filename=%s" % filename
+
+    response["Accept-Ranges"] = "bytes"
+    if etag is not None: response["ETag"] = etag
+    if last_modified_ts is not None: response["Last-Modified"] = http_date(last_modified_ts)
+    return response
@@ -0,0 +1,103 @@
+from django.test import TestCase
+from django.db import transaction
+from backend import const
+from backend.unittest import PersonFixtureMixin
+import backend.models as bmodels
+import datetime
+import json
+
+
+class Rollback(Exception):
+    pass
+
+
+class TestBulkChange(PersonFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fingerprints.create("dd_nu", person=cls.persons.dd_nu, fpr="1793D6AB75663E6BF104953A634F4BD1E7AD5568", is_active=True, audit_skip=True)
+        cls.fingerprints.create("dd_nu_old", person=cls.persons.dd_nu, fpr="66B4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB", is_active=False, audit_skip=True)
+        cls.fingerprints.create("dm", person=cls.persons.dm, fpr="0EED77DC41D760FDE44035FF5556A34E04A3610B", is_active=True, audit_skip=True)
+
+    def _audit(self):
+        return sorted(
+            (l.person_id, l.author_id, l.notes, json.dumps(json.loads(l.changes), sort_keys=True))
+            for l in bmodels.PersonAuditLog.objects.all())
+
+    def _state(self, model, fields):
+        return list(model.objects.order_by("pk").values_list(*fields))
+
+    def assertSameAsSave(self, model, changes, fields, queries=6):
+        """
+        Check that bulk_change has the same effect as saving each object
+        """
+        def load():
+            return [(model.objects.get(pk=pk), values, notes) for pk, values, notes in changes]
+
+        try:
+            with transaction.atomic():
+                for obj, values, notes in load():
+                    for k, v in values.items(): setattr(obj, k, v)
+                    obj.save(audit_author=self.persons.fd, audit_notes=notes)
+                expected = (self._audit(), self._state(model, fields))
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.assertEqual(self._audit(), [])
+        objs = load()
+        # One update per set of changed fields, plus deactivating other keys
+        # for fingerprints, one insert, and the savepoint
+        with self.assertNumQueries(queries):
+            model.objects.bulk_change(objs, audit_author=self.persons.fd)
+        self.assertEqual((self._audit(), self._state(model, fields)), expected)
+
+    def test_person(self):
+        self.assertSameAsSave(bmodels.Person, [
+            (self.persons.dc.pk, {"expires": datetime.date(2030, 1, 1)}, "extending expiration"),
+            (self.persons.dm.pk, {"last_vote": datetime.date(2017, 1, 2)}, "voted"),
+            (self.persons.dd_nu.pk, {"last_vote": datetime.date(2017, 1, 3), "cn": "Test"}, "voted"),
+            (self.persons.dd_u.pk, {"status": self.persons.dd_u.status}, "nothing"),
+        ], ("expires", "last_vote", "cn", "status"))
+
+    def test_fingerprint(self):
+        self.assertSameAsSave(bmodels.Fingerprint, [
+            (self.fingerprints.dd_nu_old.pk, {"is_active": True}, "new key"),
+            (self.fingerprints.dm.pk, {"last_upload": datetime.date(2017, 1, 2)}, "uploaded"),
+        ], ("is_active", "last_upload"))
+
+    def test_fingerprint_activate_two(self):
+        # The last key activated for a person wins
+        new = bmodels.Fingerprint.objects.create(
+            person=self.persons.dd_nu, fpr="ABB4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB", is_active=False, audit_skip=True)
+        self.assertSameAsSave(bmodels.Fingerprint, [
+            (self.fingerprints.dd_nu_old.pk, {"is_active": True}, "old key"),
+            (new.pk, {"is_active": True}, "new key"),
+        ], ("fpr", "is_active"), queries=5)
+
+    def test_fingerprint_already_active(self):
+        # Saving active keys leaves only one of them active, as save() does
+        bmodels.Fingerprint.objects.filter(pk=self.fingerprints.dd_nu_old.pk).update(is_active=True)
+        changes = [
+            (bmodels.Fingerprint.objects.get(pk=pk), {"last_upload": datetime.date(2017, 1, 2)}, "uploaded")
+            for pk in (self.fingerprints.dd_nu.pk, self.fingerprints.dd_nu_old.pk)]
+        bmodels.Fingerprint.objects.bulk_change(changes, audit_author=self.persons.fd)
+        self.assertEqual(self._state(bmodels.Fingerprint, ("fpr", "is_active", "last_upload")), [
+            (self.fingerprints.dd_nu.fpr, False, datetime.date(2017, 1, 2)),
+            (self.fingerprints.dd_nu_old.fpr, True, datetime.date(2017, 1, 2)),
+            (self.fingerprints.dm.fpr, True, None),
+        ])
+        self.assertEqual(bmodels.PersonAuditLog.objects.filter(person=self.persons.dd_nu).count(), 3)
+
+    def test_requires_author(self):
+        person = bmodels.Person.objects.get(pk=self.persons.dc.pk)
+        with self.assertRaises(RuntimeError):
+            bmodels.Person.objects.bulk_change([(person, {"cn": "Test"}, "")])
+        person = bmodels.Person.objects.get(pk=self.persons.dc.pk)
+        bmodels.Person.objects.bulk_change([(person, {"cn": "Test"}, "")], audit_skip=True)
+        self.assertEqual(bmodels.Person.objects.get(pk=self.persons.dc.pk).cn, "Test")
+        self.assertEqual(self._audit(), [])
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(bmodels.Person.objects.bulk_change([], audit_author=self.persons.fd), [])
@@ -0,0 +1,82 @@
+from django.test import TestCase
+from backend import const
+from backend import utils
+from backend.unittest import PersonFixtureMixin
+import backend.models as bmodels
+import gzip
+import io
+import json
+
+
+class TestExport(PersonFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name, manager in ("dc", "activeam"), ("dm", None):
+            proc = bmodels.Process.objects.create(
+                person=cls.persons[name], applying_as=cls.persons[name].status, applying_for=const.STATUS_DD_U,
+                progress=const.PROGRESS_AM, is_active=True, manager=cls.ams[manager] if manager else None)
+            proc.advocates.add(cls.persons.dd_nu)
+            bmodels.Log.objects.create(changed_by=cls.persons.fd, process=proc, progress=const.PROGRESS_AM, logtext="test " + name)
+
+    def test_queries(self):
+        with self.assertNumQueries(7):
+            small = list(bmodels.export_db(full=True, queryset=bmodels.Person.objects.filter(pk__in=[self.persons.dc.pk, self.persons.dm.pk])))
+        with self.assertNumQueries(7):
+            everyone = list(bmodels.export_db(full=True))
+        self.assertEqual([p["username"] for p in small], [p["username"] for p in everyone if p["username"] in (self.persons.dc.username, self.persons.dm.username)])
+        by_username = {p["username"]: p for p in everyone}
+        proc = by_username[self.persons.dc.username]["processes"][0]
+        self.assertEqual(proc["manager"], self.persons.activeam.lookup_key)
+        self.assertEqual(proc["advocates"], [self.persons.dd_nu.lookup_key])
+        self.assertEqual([l["logtext"] for l in proc["log"]], ["test dc"])
+        self.assertEqual(by_username[self.persons.fd.username]["am"]["is_fd"], True)
+
+        # Batches keep the same order
+        self.assertEqual(list(bmodels.export_db(full=True, batch_size=2)), everyone)
+
+    def _backup(self):
+        class Serializer(json.JSONEncoder):
+            def default(self, o):
+                if hasattr(o, "strftime"):
+                    return o.strftime("%Y-%m-%d %H:%M:%S")
+                return json.JSONEncoder.default(self, o)
+        return [json.loads(json.dumps(p, cls=Serializer)) for p in bmodels.export_db(full=True)]
+
+    def test_incremental_restore(self):
+        base = self._backup()
+
+        # Changes that leave no audit or process log entries
+        self.persons.activeam.am.slots = 5
+        self.persons.activeam.am.save()
+        self.persons.dm.processes.get().advocates.add(self.persons.dd_u)
+        self.persons.dc.cn = "Changed"
+        self.persons.dc.save(audit_skip=True)
+        removed = self.persons.dd_e.username
+        bmodels.Person.objects.filter(pk=self.persons.dd_e.pk).delete()
+        bmodels.Person.objects.create_user(username="new@example.org", email="new@example.org", cn="New", status=const.STATUS_DC, audit_skip=True)
+
+        diff = utils.BackupDiff(base)
+        changed = list(diff.changed(self._backup()))
+        self.assertEqual(sorted(p["username"] for p in changed), sorted([
+            self.persons.activeam.username, self.persons.dm.username, self.persons.dc.username, "new@example.org"]))
+        self.assertEqual(diff.removed, [removed])
+
+        restored = utils.restore_backup(base, changed, diff.removed)
+        self.assertEqual(sorted(restored, key=lambda p: p["username"]), sorted(self._backup(), key=lambda p: p["username"]))
+
+
+class TestBackupUtils(TestCase):
+    def test_dump_json_list(self):
+        for items in [], [1], [{"a": [1, 2], "b": "x\ny"}, None, {"c": {}}]:
+            out = io.StringIO()
+            utils.dump_json_list(iter(items), out, indent=2, sort_keys=True)
+            self.assertEqual(out.getvalue(), json.dumps(items, indent=2, sort_keys=True))
+
+    def test_parallel_gzip(self):
+        data = "".join("line {}\n".format(i) for i in range(20000))
+        out = io.BytesIO()
+        with utils.ParallelGzipWriter(out, workers=3, block_size=1000) as fd:
+            for line in data.splitlines(keepends=True):
+                fd.write(line)
+        self.assertEqual(gzip.decompress(out.getvalue()).decode("utf-8"), data)
@@ -0,0 +1,151 @@
+from django.test import TestCase
+from django.db import connection
+from backend.housekeeping_scheduler import Scheduler, merge_stages
+import django_housekeeping as hk
+import threading
+import tempfile
+import time
+import json
+import os
+
+events = []
+events_lock = threading.Lock()
+
+
+def record(name, what):
+    with events_lock:
+        events.append((name, what, time.monotonic()))
+
+
+class Slow1(hk.Task):
+    def run_main(self, stage):
+        record("slow1", "start")
+        time.sleep(0.2)
+        record("slow1", "end")
+
+
+class Slow2(hk.Task):
+    def run_main(self, stage):
+        record("slow2", "start")
+        time.sleep(0.2)
+        record("slow2", "end")
+
+
+class AfterSlow1(hk.Task):
+    DEPENDS = [Slow1]
+
+    def run_main(self, stage):
+        record("after_slow1", "start")
+
+
+class Exclusive(hk.Task):
+    EXCLUSIVE = True
+
+    def run_main(self, stage):
+        record("exclusive", "start")
+        time.sleep(0.1)
+        record("exclusive", "end")
+
+
+class AfterExclusive(hk.Task):
+    DEPENDS = [Exclusive]
+
+    def run_main(self, stage):
+        record("after_exclusive", "start")
+
+
+class Failing(hk.Task):
+    def run_main(self, stage):
+        raise RuntimeError("test failure")
+
+
+class AfterFailing(hk.Task):
+    DEPENDS = [Failing]
+
+    def run_main(self, stage):
+        record("after_failing", "start")
+
+
+class Queries(hk.Task):
+    def run_stats(self, stage):
+        with connection.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.execute("SELECT 2")
+
+
+class TestScheduler(TestCase):
+    def setUp(self):
+        super().setUp()
+        del events[:]
+        self.workdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def test_merge_stages(self):
+        self.assertEqual(merge_stages([["backup", "main", "stats"], ["main", "reports", "stats"], ["main"]]),
+                         ["backup", "main", "reports", "stats"])
+        with self.assertRaises(ValueError):
+            merge_stages([["a", "b"], ["b", "a"]])
+
+    def test_run(self):
+        scheduler = Scheduler(workers=2, outdir=self.workdir.name)
+        scheduler.stages = ["main", "stats"]
+        scheduler.task_classes = [Slow1, Slow2, AfterSlow1, Failing, AfterFailing, Queries]
+        scheduler.init()
+        self.assertIsInstance(scheduler.slow1, Slow1)
+        self.assertIsInstance(scheduler.after_slow1, AfterSlow1)
+
+        with self.assertLogs("backend.housekeeping_scheduler", level="WARNING"):
+            report = scheduler.run()
+        times = {(name, what): ts for name, what, ts in events}
+        # Independent tasks run at the same time
+        self.assertLess(times["slow2", "start"], times["slow1", "end"])
+        self.assertLess(times["slow1", "start"], times["slow2", "end"])
+        # Dependencies are respected
+        self.assertGreaterEqual(times["after_slow1", "start"], times["slow1", "end"])
+        # Tasks depending on a failed one are skipped
+        self.assertNotIn(("after_failing", "start"), times)
+
+        self.assertEqual([s["stage"] for s in report["stages"]], ["main", "stats"])
+        tasks = {t["task"]: t for s in report["stages"] for t in s["tasks"]}
+        self.assertEqual(tasks[Slow1.IDENTIFIER]["status"], "ok")
+        self.assertGreaterEqual(tasks[Slow1.IDENTIFIER]["wall_time"], 0.2)
+        self.assertLess(tasks[Slow1.IDENTIFIER]["cpu_time"], 0.2)
+        self.assertEqual(tasks[Failing.IDENTIFIER]["status"], "failed")
+        self.assertEqual(tasks[Failing.IDENTIFIER]["error"], "RuntimeError: test failure")
+        self.assertEqual(tasks[AfterFailing.IDENTIFIER]["status"], "skipped")
+        self.assertEqual(tasks[Queries.IDENTIFIER]["queries"], 2)
+        self.assertLess(report["wall_time"], 0.4)
+
+        pathname = scheduler.save_report()
+        self.assertEqual(os.path.dirname(os.path.dirname(pathname)), self.workdir.name)
+        with open(pathname) as fd:
+            self.assertEqual(json.load(fd), report)
+
+    def test_exclusive(self):
+        scheduler = Scheduler(workers=3, outdir=self.workdir.name)
+        scheduler.stages = ["main"]
+        scheduler.task_classes = [Slow1, Exclusive, Slow2, AfterExclusive]
+        scheduler.init()
+        report = scheduler.run()
+        self.assertEqual({t["status"] for t in report["stages"][0]["tasks"]}, {"ok"})
+        times = {(name, what): ts for name, what, ts in events}
+        # Nothing runs at the same time as the exclusive task
+        for name in "slow1", "slow2":
+            self.assertTrue(times[name, "end"] <= times["exclusive", "start"]
+                            or times[name, "start"] >= times["exclusive", "end"])
+        self.assertGreaterEqual(times["after_exclusive", "start"], times["exclusive", "end"])
+        # The other tasks still run concurrently
+        self.assertLess(times["slow2", "start"], times["slow1", "end"])
+
+    def test_autodiscover(self):
+        from backend import housekeeping as bhk
+        scheduler = Scheduler()
+        scheduler.autodiscover()
+        self.assertEqual(scheduler.stages[:2], ["backup", "main"])
+        self.assertEqual(scheduler.stages[-1], "stats")
+        classes = scheduler.task_classes
+        self.assertLess(classes.index(bhk.MakeLink), classes.index(bhk.ComputeActiveAM))
+        self.assertLess(classes.index(bhk.ComputeActiveAM), classes.index(bhk.ComputeAMCTTE))
@@ -0,0 +1,103 @@
+from django.test import TestCase
+from django.db import transaction
+from backend import const
+from backend import utils
+from backend.unittest import PersonFixtureMixin
+import backend.models as bmodels
+import importlib
+import tempfile
+import warnings
+import json
+import io
+import os
+
+bimport = importlib.import_module("backend.management.commands.import")
+
+
+class Rollback(Exception):
+    pass
+
+
+class TestImport(PersonFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fingerprints.create("dc", person=cls.persons.dc, fpr="1793D6AB75663E6BF104953A634F4BD1E7AD5568", is_active=True, audit_skip=True)
+        proc = bmodels.Process.objects.create(
+            person=cls.persons.dc, applying_as=cls.persons.dc.status, applying_for=const.STATUS_DD_U,
+            progress=const.PROGRESS_AM, is_active=True, manager=cls.ams.activeam)
+        proc.advocates.add(cls.persons.dd_nu)
+        bmodels.Log.objects.create(changed_by=cls.persons.fd, process=proc, progress=const.PROGRESS_AM, logtext="test")
+        bmodels.Log.objects.create(changed_by=None, process=proc, progress=const.PROGRESS_AM, logtext="test 2")
+
+    def setUp(self):
+        super().setUp()
+        class Serializer(json.JSONEncoder):
+            def default(self, o):
+                if hasattr(o, "strftime"):
+                    return o.strftime("%Y-%m-%d %H:%M:%S")
+                return json.JSONEncoder.default(self, o)
+        self.workdir = tempfile.TemporaryDirectory()
+        self.dump = os.path.join(self.workdir.name, "dump.json")
+        with open(self.dump, "wt") as fd:
+            utils.dump_json_list(bmodels.export_db(full=True), fd, cls=Serializer, indent=2)
+
+        bmodels.Person.objects.all().delete()
+        self.author = bmodels.Person.objects.create_user(username="importer", email="importer@example.org", cn="Importer", status=const.STATUS_DC, audit_skip=True)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def _state(self):
+        return dict(
+            people=list(bmodels.Person.objects.order_by("username").values_list(
+                "username", "cn", "mn", "sn", "email", "uid", "is_staff", "is_superuser", "status", "status_changed", "created", "fd_comment")),
+            fprs=list(bmodels.Fingerprint.objects.order_by("fpr").values_list("person__username", "fpr", "is_active")),
+            ams=list(bmodels.AM.objects.order_by("person__username").values_list(
+                "person__username", "slots", "is_am", "is_fd", "is_dam", "is_am_ctte", "created")),
+            processes=list(bmodels.Process.objects.order_by("archive_key").values_list(
+                "archive_key", "person__username", "applying_as", "applying_for", "progress", "is_active", "manager__person__username")),
+            advocates=list(bmodels.Process.objects.order_by("archive_key", "advocates__username").values_list("archive_key", "advocates__username")),
+            logs=list(bmodels.Log.objects.order_by("logdate", "logtext").values_list(
+                "process__archive_key", "changed_by__username", "progress", "logdate", "logtext")),
+            audit=sorted(bmodels.PersonAuditLog.objects.values_list("person__username", "author__username", "notes", "changes")),
+        )
+
+    def test_same_as_slow(self):
+        with warnings.catch_warnings():
+            # Dumps contain naive datetimes
+            warnings.simplefilter("ignore", RuntimeWarning)
+
+            try:
+                with transaction.atomic():
+                    with open(self.dump) as fd:
+                        stats = bimport.Importer(self.author).import_people(json.load(fd))
+                    expected = self._state()
+                    raise Rollback()
+            except Rollback:
+                pass
+
+            self.assertEqual(bmodels.Process.objects.count(), 0)
+            importer = bimport.BulkImporter(self.author, batch_size=3)
+            self.assertEqual(importer.import_dump(self.dump), stats)
+
+        state = self._state()
+        self.assertEqual(state, expected)
+        self.assertEqual(len(state["processes"]), 1)
+        self.assertEqual(len(state["logs"]), 2)
+        self.assertTrue(state["audit"])
+
+
+class TestIterJsonList(TestCase):
+    def test_iter(self):
+        for items in [], [1], [{"a": [1, 2], "b": "x\ny]"}, None, 12345, "str,", {"c": {}}]:
+            for indent in None, 2:
+                data = json.dumps(items, indent=indent)
+                for chunk_size in 1, 3, 1000:
+                    self.assertEqual(list(utils.iter_json_list(io.StringIO(data), chunk_size=chunk_size)), items)
+
+    def test_invalid(self):
+        for data in "", "{}", "[1, 2", "[1, {":
+            with self.assertRaises(ValueError):
+                list(utils.iter_json_list(io.StringIO(data), chunk_size=2))
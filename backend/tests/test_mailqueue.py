@@ -0,0 +1,93 @@
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.utils.timezone import now
+from backend import mailqueue
+from backend.log import AdminEmailHandler
+from process.email import build_django_message
+from unittest.mock import patch
+import backend.models as bmodels
+import datetime
+
+
+@override_settings(EMAIL_BACKEND="backend.mailqueue.QueueBackend")
+class TestMailQueue(TestCase):
+    def make_worker(self, **kw):
+        return mailqueue.Worker(mail.get_connection("django.core.mail.backends.locmem.EmailBackend"), **kw)
+
+    def queue(self, subject="Test"):
+        build_django_message(
+            from_email=("nm.debian.org", "nm@debian.org"), to="app@example.org", cc="archive@example.org",
+            reply_to="fd@example.org", subject=subject, body="Test body", headers={"X-Test": "yes"}).send()
+
+    def test_send(self):
+        for i in range(5):
+            self.queue("Test {}".format(i))
+        # Nothing is sent during the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(bmodels.QueuedMail.objects.count(), 5)
+        self.assertEqual(mailqueue.stats()["pending"], 5)
+
+        self.assertEqual(self.make_worker(batch_size=2).run_once(), (5, 0))
+        self.assertEqual([m.subject for m in mail.outbox], ["Test {}".format(i) for i in range(5)])
+        msg = mail.outbox[0]
+        self.assertEqual(msg.from_email, '"nm.debian.org" <nm@debian.org>')
+        self.assertEqual(msg.to, ["app@example.org"])
+        self.assertEqual(msg.cc, ["archive@example.org"])
+        self.assertEqual(msg.reply_to, ["fd@example.org"])
+        self.assertEqual(msg.body, "Test body")
+        self.assertEqual(msg.extra_headers["X-Test"], "yes")
+        self.assertIn("date", msg.extra_headers)
+
+        stats = mailqueue.stats()
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(stats["sent"], 5)
+        self.assertIsNotNone(stats["latency_max"])
+
+        # Sent messages are not sent again, and eventually purged
+        self.assertEqual(self.make_worker().run_once(), (0, 0))
+        self.assertEqual(mailqueue.purge(days=0), 5)
+
+    def test_retry(self):
+        self.queue()
+        worker = self.make_worker(max_attempts=2, retry_delay=60)
+        with patch.object(worker.connection, "send_messages", side_effect=OSError("relay down")):
+            self.assertEqual(worker.run_once(), (0, 1))
+            queued = bmodels.QueuedMail.objects.get()
+            self.assertEqual(queued.attempts, 1)
+            self.assertEqual(queued.last_error, "OSError: relay down")
+            self.assertGreater(queued.next_attempt, now() + datetime.timedelta(seconds=50))
+            self.assertEqual(mailqueue.stats()["retrying"], 1)
+
+            # Nothing is retried before the backoff time
+            self.assertEqual(worker.run_once(), (0, 0))
+
+            # Give up after max_attempts
+            bmodels.QueuedMail.objects.update(next_attempt=now())
+            self.assertEqual(worker.run_once(), (0, 1))
+            queued.refresh_from_db()
+            self.assertTrue(queued.failed)
+            self.assertEqual(mailqueue.stats()["failed"], 1)
+
+        self.assertEqual(worker.run_once(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_claim(self):
+        self.queue()
+        worker = self.make_worker()
+        # Two workers picked the same message: only the first one sends it
+        first, second = bmodels.QueuedMail.objects.get(), bmodels.QueuedMail.objects.get()
+        self.assertTrue(worker._claim(first))
+        self.assertFalse(worker._claim(second))
+        # Claimed messages are not due until the claim expires
+        self.assertEqual(worker.run_once(), (0, 0))
+        bmodels.QueuedMail.objects.update(next_attempt=now())
+        self.assertEqual(worker.run_once(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(ADMINS=[("Admin", "admin@example.org")],
+                       MAIL_QUEUE_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+    def test_admin_email_not_queued(self):
+        AdminEmailHandler().send_mail("Error", "Traceback")
+        self.assertEqual(bmodels.QueuedMail.objects.count(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["admin@example.org"])
@@ -0,0 +1,77 @@
+from django.test import TestCase
+from backend import const
+from backend.unittest import PersonFixtureMixin
+from unittest.mock import patch
+import backend.models as bmodels
+import importlib
+import tempfile
+import os
+
+mbox_stats = importlib.import_module("backend.management.commands.process_mbox_stats")
+
+
+class TestMboxStats(PersonFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.proc = bmodels.Process.objects.create(
+            person=cls.persons.dc, applying_as=cls.persons.dc.status, applying_for=const.STATUS_DD_U,
+            progress=const.PROGRESS_AM, is_active=True, manager=cls.ams.activeam)
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.mailbox_dir = patch.object(bmodels, "PROCESS_MAILBOX_DIR", self.workdir.name)
+        self.mailbox_dir.start()
+        self.mbox = os.path.join(self.workdir.name, self.proc.archive_key + ".mbox")
+        # Messages are sorted by date
+        for sender, hour in ("a@example.org", 10), ("=?utf-8?q?Doe=2C_B?= <b@example.org>", 11), ("c", 12), ("a@example.org", 13):
+            self.append(sender, hour)
+
+    def tearDown(self):
+        self.mailbox_dir.stop()
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def append(self, sender, hour):
+        with open(self.mbox, "at") as fd:
+            print("From nobody Sun Jun 24 19:12:52 2012\nFrom: {}\nDate: Sun, 24 Jun 2012 {:02d}:00:00 +0000\nSubject: Test\n\nTest\n".format(sender, hour), file=fd)
+
+    def compute(self, cache, **kw):
+        return mbox_stats.compute_stats(bmodels.Process.objects.filter(manager__isnull=False), cache, **kw).data
+
+    def test_stats(self):
+        cache = mbox_stats.MailboxCache(os.path.join(self.workdir.name, "cache.json"))
+        with patch.object(mbox_stats, "read_mailbox", wraps=mbox_stats.read_mailbox) as read:
+            data = self.compute(cache, jobs=1)
+            self.assertEqual(read.call_count, 1)
+
+            key = self.proc.lookup_key
+            self.assertEqual(data["process"][key]["num_mails"], 4)
+            self.assertEqual(data["process"][key]["response_time"], [3600, 3600, 3600])
+            self.assertEqual(data["process"][key]["median"], 3600)
+            self.assertEqual(data["emails"]["a@example.org"]["num_mails"], 2)
+            self.assertEqual(data["emails"]["a@example.org"]["response_time"], [3600])
+            # Encoded names do not confuse address parsing
+            self.assertIn("b@example.org", data["emails"])
+            self.assertNotIn("doe@debian.org", data["emails"])
+            self.assertIn("c@debian.org", data["emails"])
+
+            # Unchanged mailboxes are not read again
+            cache.save()
+            cache = mbox_stats.MailboxCache(cache.pathname)
+            cache.load()
+            self.assertEqual(self.compute(cache, jobs=1), data)
+            self.assertEqual(read.call_count, 1)
+
+            # Grown mailboxes are
+            self.append("b@example.org", 9)
+            data = self.compute(cache, jobs=1)
+            self.assertEqual(read.call_count, 2)
+            self.assertEqual(data["process"][key]["num_mails"], 5)
+            self.assertEqual(data["process"][key]["date_first_orig"], "Sun, 24 Jun 2012 09:00:00 +0000")
+
+    def test_parallel(self):
+        serial = self.compute(mbox_stats.MailboxCache(os.path.join(self.workdir.name, "serial.json")), jobs=1)
+        parallel = self.compute(mbox_stats.MailboxCache(os.path.join(self.workdir.name, "parallel.json")), jobs=2)
+        self.assertEqual(serial, parallel)
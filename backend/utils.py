@@ -20,6 +20,10 @@ import os.path
 import os
 import errno
 import shutil
+import collections
+import concurrent.futures
+import gzip
+import json
 from io import BytesIO
 
 class atomic_writer(object):
@@ -137,6 +141,175 @@ def require_dir(pathname, mode=0o777):
         if e.errno != errno.EEXIST:
             raise
 
+def dump_json_list(items, fd, indent=2, **kw):
+    """
+    Write a sequence of items as a JSON list, encoding one item at a time.
+
+    The output is the same as json.dump(list(items), fd, indent=indent, **kw)
+    """
+    sep = "\n" + " " * indent
+    first = True
+    for item in items:
+        fd.write(("[" if first else ",") + sep)
+        fd.write(json.dumps(item, indent=indent, **kw).replace("\n", sep))
+        first = False
+    fd.write("[]" if first else "\n]")
+
+
+def iter_json_list(fd, chunk_size=65536):
+    """
+    Generate the items of a JSON list read from a text file, decoding one
+    item at a time without loading the whole file in memory
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        data = fd.read(chunk_size)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+    while True:
+        # Skip whitespace and separators
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof: break
+            fill()
+        if pos >= len(buf):
+            raise ValueError("unexpected end of JSON list")
+        c = buf[pos]
+        if not started:
+            if c != "[": raise ValueError("JSON data is not a list")
+            started = True
+            pos += 1
+            continue
+        if c == "]":
+            return
+        if c == ",":
+            pos += 1
+            continue
+
+        # Decode the next item, reading more data until it is complete
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof: raise
+                fill()
+                continue
+            # A number could continue in the next chunk
+            if end == len(buf) and not eof:
+                fill()
+                continue
+            break
+        pos = end
+        yield item
+
+
+class BackupDiff(object):
+    """
+    Compare the records of a backup with those of a base backup, to write an
+    incremental backup with only the records that are new or changed.
+
+    Records are JSON-decoded dicts, identified by the value of their key field.
+    """
+    def __init__(self, base, key="username"):
+        self.key = key
+        self.base = {r[key]: r for r in base}
+        self.seen = set()
+
+    def changed(self, records):
+        """
+        Generate the records that are not in the base backup or are different
+        """
+        for r in records:
+            self.seen.add(r[self.key])
+            if self.base.get(r[self.key]) != r:
+                yield r
+
+    @property
+    def removed(self):
+        """
+        Keys of the base records that were not in the records passed to
+        changed()
+        """
+        return sorted(k for k in self.base if k not in self.seen)
+
+
+def restore_backup(base, changed, removed, key="username"):
+    """
+    Apply an incremental backup, as computed by BackupDiff, to the records of
+    its base backup, returning the list of records of the backed up database
+    """
+    changed = collections.OrderedDict((r[key], r) for r in changed)
+    removed = frozenset(removed)
+    res = []
+    for r in base:
+        if r[key] in removed: continue
+        res.append(changed.pop(r[key], r))
+    res.extend(changed.values())
+    return res
+
+
+class ParallelGzipWriter(object):
+    """
+    File-like object that gzip-compresses what is written to it, using a pool
+    of worker threads to compress blocks while more data is being written.
+
+    Each block is written as a separate gzip member: the result can be read
+    with gzip.open or any other gzip decoder.
+    """
+    def __init__(self, fd, compresslevel=9, workers=4, block_size=1024 * 1024):
+        self.fd = fd
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # Limit the number of blocks kept in memory
+        self.max_pending = workers * 2
+        self.pending = collections.deque()
+        self.buf = []
+        self.buf_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+        return False
+
+    def write(self, data):
+        if isinstance(data, str): data = data.encode("utf-8")
+        self.buf.append(data)
+        self.buf_size += len(data)
+        if self.buf_size >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        block = b"".join(self.buf)
+        self.buf = []
+        self.buf_size = 0
+        if block:
+            self.pending.append(self.executor.submit(gzip.compress, block, self.compresslevel))
+        while len(self.pending) >= self.max_pending:
+            self.fd.write(self.pending.popleft().result())
+
+    def close(self):
+        self._submit()
+        while self.pending:
+            self.fd.write(self.pending.popleft().result())
+        self.executor.shutdown(wait=True)
+
+
 # Taken from werkzeug
 class cached_property(object):
     """A decorator that converts a function into a lazy property.  The
@@ -6,5 +6,5 @@ class PersonViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Export process information
     """
-    queryset = bmodels.Person.objects.all().order_by("uid")
+    queryset = bmodels.Person.objects.with_fingerprint().order_by("uid")
     serializer_class = PersonSerializer
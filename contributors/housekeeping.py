@@ -104,11 +104,12 @@ class UpdateLastVote(hk.Task):
         for person in bmodels.Person.objects.filter(status__in=(const.STATUS_DD_U, const.STATUS_DD_NU)):
             by_uid[person.uid] = person
 
+        changes = []
         for uid, date in votes.items():
             date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
             person = by_uid.get(uid)
             if person is None: continue
             if person.last_vote == date: continue
-            # Skip audit since we are only updating statistics data
-            person.last_vote = date
-            person.save(audit_skip=True)
+            changes.append((person, {"last_vote": date}, None))
+        # Skip audit since we are only updating statistics data
+        bmodels.Person.objects.bulk_change(changes, audit_skip=True)
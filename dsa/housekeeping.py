@@ -1,5 +1,6 @@
 import django_housekeeping as hk
 from django.db import transaction
+from django.conf import settings
 from backend.housekeeping import MakeLink, Housekeeper
 from . import models as dmodels
 from backend import const
@@ -7,20 +8,47 @@ import backend.models as bmodels
 import process.models as pmodels
 import backend.ops as bops
 import process.ops as pops
+import json
+import os
 import logging
 
 log = logging.getLogger(__name__)
 
+# Directory where the LDAP snapshot of each run is kept, to report what changed
+# since the previous run; if None, snapshots are not saved
+LDAP_SNAPSHOT_DIR = getattr(settings, "LDAP_SNAPSHOT_DIR", None)
+
+
+class LDAPSnapshot(hk.Task):
+    """
+    Read people from LDAP once, for all the tasks that need them
+    """
+    NAME = "ldap"
+
+    def run_main(self, stage):
+        self.snapshot = dmodels.Snapshot.download()
+        log.info("%s: %d people read from LDAP", self.IDENTIFIER, len(self.snapshot))
+        if LDAP_SNAPSHOT_DIR is None or self.hk.dry_run: return
+
+        pathname = os.path.join(LDAP_SNAPSHOT_DIR, "ldap-people.json")
+        if os.path.exists(pathname):
+            diff = self.snapshot.diff(dmodels.Snapshot.load(pathname))
+            log.info("%s: since the last snapshot, %d people were added, %d removed, %d changed",
+                     self.IDENTIFIER, len(diff["added"]), len(diff["removed"]), len(diff["changed"]))
+            with open(os.path.join(LDAP_SNAPSHOT_DIR, "ldap-diff.json"), "wt") as fd:
+                json.dump(diff, fd, indent=1, sort_keys=True)
+        self.snapshot.save(pathname)
+
 
 class NewGuestAccountsFromDSA(hk.Task):
     """
     Create new Person entries for guest accounts created by DSA
     """
-    DEPENDS = [MakeLink, Housekeeper]
+    DEPENDS = [MakeLink, Housekeeper, LDAPSnapshot]
 
     @transaction.atomic
     def run_main(self, stage):
-        for entry in dmodels.list_people():
+        for entry in self.hk.ldap.snapshot.list_people():
             # Skip DDs
             if entry.is_dd and entry.single("keyFingerPrint") is not None: continue
 
@@ -118,7 +146,7 @@ class CheckLDAPConsistency(hk.Task):
     """
     Show entries that do not match between LDAP and our DB
     """
-    DEPENDS = [MakeLink, Housekeeper]
+    DEPENDS = [MakeLink, Housekeeper, LDAPSnapshot]
 
     def run_main(self, stage):
         # Prefetch people and index them by uid
@@ -127,7 +155,8 @@ class CheckLDAPConsistency(hk.Task):
             if p.uid is None: continue
             people_by_uid[p.uid] = p
 
-        for entry in dmodels.list_people():
+        email_changes = []
+        for entry in self.hk.ldap.snapshot.list_people():
             person = people_by_uid.get(entry.uid, None)
 
             if person is None:
@@ -193,8 +222,7 @@ class CheckLDAPConsistency(hk.Task):
                     if email is not None:
                         log.info("%s: %s changing email_ldap from %s to %s (source: LDAP)",
                                 self.IDENTIFIER, self.hk.link(person), person.email, email)
-                        person.email_ldap = email
-                        person.save(audit_author=self.hk.housekeeper.user, audit_notes="updated email_ldap from LDAP")
+                        email_changes.append((person, {"email_ldap": email}, "updated email_ldap from LDAP"))
                     # It gives lots of errors when run outside of the debian.org
                     # network, since emailForward is not exported there, and it has
                     # no use case I can think of so far
@@ -202,3 +230,5 @@ class CheckLDAPConsistency(hk.Task):
                     # else:
                     #     log.info("%s: %s has email %s but emailForward is empty in LDAP",
                     #              self.IDENTIFIER, self.hk.link(person), person.email)
+
+        bmodels.Person.objects.bulk_change(email_changes, audit_author=self.hk.housekeeper.user)
@@ -3,9 +3,19 @@ Code used to access Debian's LDAP
 """
 from django.db import models
 from django.conf import settings
+from backend.utils import atomic_writer
 import ldap3
+import json
 
 LDAP_SERVER = getattr(settings, "LDAP_SERVER", "ldap://db.debian.org")
+# Number of entries requested for each page of LDAP search results
+LDAP_PAGE_SIZE = getattr(settings, "LDAP_PAGE_SIZE", 500)
+
+# Attributes of people entries used by the site
+LDAP_PEOPLE_ATTRIBUTES = [
+    "uid", "cn", "mn", "sn", "keyFingerPrint", "emailForward",
+    "supplementaryGid", "accountStatus", "gidNumber",
+]
 
 class Entry(object):
     def __init__(self):
@@ -13,43 +23,124 @@ class Entry(object):
         self.attrs = None
         self.uid = None
 
-    def init(self, entry):
+    def init(self, dn, attrs):
         """
-        Init entry to point at these attributes
+        Init entry to point at these attributes.
+
+        attrs is a dict mapping attribute names to lists of values.
         """
-        # FIXME: remove post-stretch, it seems that python3-ldap3 changed API
-        # from stretch to buster
-        try:
-            self.dn = entry.entry_get_dn()
-        except ldap3.core.exceptions.LDAPCursorError:
-            self.dn = entry.entry_dn
-        self.attrs = entry
-        self.uid = entry["uid"][0]
+        self.dn = dn
+        self.attrs = attrs
+        self.uid = attrs["uid"][0]
 
     def single(self, name):
         """
         Return a single value for a LDAP attribute
         """
-        if name not in self.attrs:
-            return None
-        val = self.attrs[name]
+        val = self.attrs.get(name)
         if not val:
             return None
         return val[0]
 
     @property
     def is_dd(self):
-        return "Debian" in self.attrs["supplementaryGid"]
+        return "Debian" in self.attrs.get("supplementaryGid", ())
 
     @property
     def is_guest(self):
-        return "guest" in self.attrs["supplementaryGid"]
+        return "guest" in self.attrs.get("supplementaryGid", ())
 
-def list_people():
+def _normalize_attributes(attrs):
+    """
+    Turn ldap3 search result attributes into a dict of lists of strings
+    """
+    res = {}
+    for name, val in attrs.items():
+        if not isinstance(val, (list, tuple)): val = [val]
+        if not val: continue
+        res[name] = [str(v) for v in val]
+    return res
+
+def search_people(attributes=LDAP_PEOPLE_ATTRIBUTES, page_size=None):
+    """
+    Generate (dn, attributes) for all people in LDAP, fetching results one
+    page at a time
+    """
     conn = ldap3.Connection(LDAP_SERVER, auto_bind=True)
-    conn.search("dc=debian,dc=org", "(objectclass=inetOrgPerson)", ldap3.SUBTREE, attributes=ldap3.ALL_ATTRIBUTES)
+    try:
+        for res in conn.extend.standard.paged_search(
+                "dc=debian,dc=org", "(objectclass=inetOrgPerson)", ldap3.SUBTREE,
+                attributes=attributes, paged_size=page_size or LDAP_PAGE_SIZE, generator=True):
+            if res.get("type") != "searchResEntry": continue
+            attrs = _normalize_attributes(res["attributes"])
+            if "uid" not in attrs: continue
+            yield res["dn"], attrs
+    finally:
+        conn.unbind()
+
+def list_people():
     # Create the object only once
     entry = Entry()
-    for e in conn.entries:
-        entry.init(e)
+    for dn, attrs in search_people():
+        entry.init(dn, attrs)
         yield entry
+
+class Snapshot(object):
+    """
+    People entries read from LDAP, that can be iterated more than once and
+    saved to disk to compare with later snapshots
+    """
+    def __init__(self, people=None):
+        # dn -> attributes
+        self.people = people if people is not None else {}
+
+    @classmethod
+    def download(cls):
+        return cls(dict(search_people()))
+
+    @classmethod
+    def load(cls, pathname):
+        with open(pathname, "rt") as fd:
+            return cls(json.load(fd))
+
+    def save(self, pathname):
+        with atomic_writer(pathname, mode="wt", chmod=0o640) as fd:
+            json.dump(self.people, fd, indent=1, sort_keys=True)
+
+    def __len__(self):
+        return len(self.people)
+
+    def list_people(self):
+        """
+        Generate an Entry for each person, like list_people()
+        """
+        entry = Entry()
+        for dn, attrs in sorted(self.people.items()):
+            entry.init(dn, attrs)
+            yield entry
+
+    def diff(self, old):
+        """
+        Compare with an older snapshot.
+
+        Returns a dict with the uids of added and removed entries, and a dict
+        mapping the uids of changed entries to a dict of changed attributes,
+        as [old, new] lists of values.
+        """
+        old_by_uid = {attrs["uid"][0]: attrs for attrs in old.people.values()}
+        new_by_uid = {attrs["uid"][0]: attrs for attrs in self.people.values()}
+        changed = {}
+        for uid in new_by_uid.keys() & old_by_uid.keys():
+            o, n = old_by_uid[uid], new_by_uid[uid]
+            changes = {}
+            for name in o.keys() | n.keys():
+                ov, nv = o.get(name, []), n.get(name, [])
+                if sorted(ov) != sorted(nv):
+                    changes[name] = [ov, nv]
+            if changes:
+                changed[uid] = changes
+        return {
+            "added": sorted(new_by_uid.keys() - old_by_uid.keys()),
+            "removed": sorted(old_by_uid.keys() - new_by_uid.keys()),
+            "changed": changed,
+        }
@@ -14,3 +14,61 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+from unittest.mock import patch, MagicMock
+from dsa import models as dmodels
+import tempfile
+import os
+
+
+def ldap_result(uid, **attrs):
+    attrs["uid"] = uid
+    return {"type": "searchResEntry", "dn": "uid={},ou=users,dc=debian,dc=org".format(uid), "attributes": attrs}
+
+
+class TestLDAPSnapshot(TestCase):
+    def mock_ldap(self, results):
+        conn = MagicMock()
+        conn.extend.standard.paged_search.return_value = iter(results)
+        return patch("ldap3.Connection", return_value=conn), conn
+
+    def test_download(self):
+        mock, conn = self.mock_ldap([
+            ldap_result("dd", cn="Test", sn=[], keyFingerPrint=["1793D6AB75663E6BF104953A634F4BD1E7AD5568"], supplementaryGid=["Debian", "adm"], gidNumber=800),
+            ldap_result("guest", cn="Guest", supplementaryGid=["guest"]),
+            {"type": "searchResRef", "uri": ["ldap://example.org"]},
+        ])
+        with mock:
+            snapshot = dmodels.Snapshot.download()
+        args, kw = conn.extend.standard.paged_search.call_args
+        self.assertEqual(kw["attributes"], dmodels.LDAP_PEOPLE_ATTRIBUTES)
+        self.assertEqual(kw["paged_size"], dmodels.LDAP_PAGE_SIZE)
+        self.assertTrue(kw["generator"])
+        conn.unbind.assert_called_once_with()
+
+        self.assertEqual(len(snapshot), 2)
+        # Snapshots can be iterated more than once
+        for i in range(2):
+            entries = [(e.uid, e.is_dd, e.is_guest, e.single("gidNumber"), e.single("sn")) for e in snapshot.list_people()]
+            self.assertEqual(entries, [("dd", True, False, "800", None), ("guest", False, True, None, None)])
+
+    def test_diff(self):
+        old = dmodels.Snapshot({
+            "uid=a": {"uid": ["a"], "cn": ["A"], "supplementaryGid": ["Debian", "adm"]},
+            "uid=b": {"uid": ["b"], "cn": ["B"]},
+        })
+        new = dmodels.Snapshot({
+            "uid=a": {"uid": ["a"], "cn": ["A"], "supplementaryGid": ["adm", "Debian"], "accountStatus": ["inactive"]},
+            "uid=c": {"uid": ["c"], "cn": ["C"]},
+        })
+        with tempfile.TemporaryDirectory() as workdir:
+            pathname = os.path.join(workdir, "ldap-people.json")
+            old.save(pathname)
+            old = dmodels.Snapshot.load(pathname)
+        self.assertEqual(new.diff(old), {
+            "added": ["c"],
+            "removed": ["b"],
+            "changed": {"a": {"accountStatus": [[], ["inactive"]]}},
+        })
+        self.assertEqual(new.diff(new), {"added": [], "removed": [], "changed": {}})
@@ -0,0 +1,59 @@
+"""
+Fast parsing helpers for gpg --with-colons --fixed-list-mode output
+
+They work on the raw lines read from gpg, and only decode what is needed.
+"""
+
+
+def decode_line(value):
+    """
+    Decode a line of gpg output.
+
+    gpg normally outputs utf-8, but old keys can have latin1 user ids.
+    """
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("iso8859-1")
+
+
+def split(line):
+    """
+    Decode a line of gpg colon output, if needed, and split it into fields
+    """
+    if line.__class__ is not str:
+        line = decode_line(line)
+    return line.rstrip("\r\n").split(":")
+
+
+def prefixes(types):
+    """
+    Map the line prefixes, as both str and bytes, of the given record types to
+    the record type names
+    """
+    res = {}
+    for t in types:
+        res[t + ":"] = t
+        res[(t + ":").encode("ascii")] = t
+    return res
+
+
+def pub_fingerprints(lines):
+    """
+    Generate the fingerprints of the primary keys found in gpg colon output,
+    skipping the fingerprints of subkeys.
+
+    This is a fast path that only looks at pub, sub and fpr records, and only
+    decodes the fingerprint field.
+    """
+    in_pub = False
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        if line.startswith(b"fpr:"):
+            if in_pub:
+                yield line.split(b":", 10)[9].decode("ascii", errors="replace")
+        elif line.startswith(b"pub:"):
+            in_pub = True
+        elif line.startswith(b"sub:"):
+            in_pub = False
@@ -0,0 +1,288 @@
+"""
+Pool of long-lived GnuPG homedirs used to run operations on Key objects
+"""
+from django.conf import settings
+from collections import OrderedDict
+from contextlib import contextmanager
+import atexit
+import hashlib
+import glob
+import os
+import os.path
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+KEYRINGS_TMPDIR = getattr(settings, "KEYRINGS_TMPDIR", "/srv/keyring.debian.org/data/tmp_keyrings")
+# Maximum number of homedirs kept around
+KEYRINGS_POOL_SIZE = getattr(settings, "KEYRINGS_POOL_SIZE", 64)
+# Maximum number of gpg processes run concurrently by the pool
+KEYRINGS_POOL_WORKERS = getattr(settings, "KEYRINGS_POOL_WORKERS", 4)
+
+
+class PoolStats(object):
+    """
+    Counters about the activity of a GPGPool
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Requests served by an existing homedir with the right key imported
+        self.hits = 0
+        # Requests that needed a new homedir, or a key reimport
+        self.misses = 0
+        # Homedirs removed to make space for new ones
+        self.evictions = 0
+        # Number of gpg processes started
+        self.spawns = 0
+        # Total and maximum time spent waiting for a free gpg slot
+        self.queue_wait = 0.0
+        self.queue_wait_max = 0.0
+
+    def add(self, name, value=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def add_wait(self, elapsed):
+        with self.lock:
+            self.queue_wait += elapsed
+            if elapsed > self.queue_wait_max:
+                self.queue_wait_max = elapsed
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if not total: return None
+        return self.hits / total
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "evictions": self.evictions,
+                "spawns": self.spawns,
+                "queue_wait": self.queue_wait,
+                "queue_wait_max": self.queue_wait_max,
+                "queue_wait_avg": self.queue_wait / self.spawns if self.spawns else None,
+            }
+
+
+def remove_homedir(homedir):
+    """
+    Stop the gpg-agent of a GnuPG homedir, then remove the homedir
+    """
+    try:
+        subprocess.run(["gpgconf", "--homedir", homedir, "--kill", "gpg-agent"],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning("cannot stop gpg-agent in %s: %s", homedir, e)
+    shutil.rmtree(homedir, ignore_errors=True)
+
+
+def pid_exists(pid):
+    """
+    Check if a process is running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PoolEntry(object):
+    """
+    A homedir in the pool, holding the imported key material for one
+    fingerprint
+    """
+    def __init__(self, homedir):
+        self.homedir = homedir
+        # True when the key material has been imported in the homedir
+        self.imported = False
+        # Number of requests currently using the homedir
+        self.users = 0
+        # Serialises the import of the key material
+        self.lock = threading.Lock()
+
+
+class GPGPool(object):
+    """
+    Keep pre-warmed GnuPG homedirs, indexed by fingerprint and evicted in LRU
+    order, and limit the number of gpg processes that can run at the same
+    time.
+
+    Homedirs are also indexed by the hash of the key material, so that a
+    refreshed key gets a new homedir and the old one is eventually evicted.
+
+    The homedirs live in a per-process directory inside KEYRINGS_TMPDIR, so
+    that different web server processes never share them.
+    """
+    def __init__(self, root=None, size=None, workers=None):
+        self.root = root or KEYRINGS_TMPDIR
+        self.size = size if size is not None else KEYRINGS_POOL_SIZE
+        self.workers = workers if workers is not None else KEYRINGS_POOL_WORKERS
+        self.semaphore = threading.BoundedSemaphore(self.workers)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = PoolStats()
+        self.pooldir = None
+        self.pooldir_pid = None
+        self.atexit_registered = False
+
+    def _remove_pooldir(self, pooldir):
+        for homedir in glob.glob(os.path.join(glob.escape(pooldir), "*")):
+            remove_homedir(homedir)
+        shutil.rmtree(pooldir, ignore_errors=True)
+
+    def _sweep(self):
+        """
+        Remove the pool directories left behind by processes that are no
+        longer running
+        """
+        for pooldir in glob.glob(os.path.join(glob.escape(self.root), "p*-*")):
+            mo = re.match(r"p(\d+)-", os.path.basename(pooldir))
+            if not mo: continue
+            pid = int(mo.group(1))
+            # This process has no pool directory yet, so one with its pid
+            # was left by an earlier process
+            if pid != os.getpid() and pid_exists(pid): continue
+            log.info("removing stale GnuPG pool directory %s", pooldir)
+            self._remove_pooldir(pooldir)
+
+    def _get_pooldir(self):
+        # Do not reuse the directory of a parent process after a fork
+        pid = os.getpid()
+        if self.pooldir is None or self.pooldir_pid != pid:
+            os.makedirs(self.root, exist_ok=True)
+            self._sweep()
+            self.pooldir = tempfile.mkdtemp(prefix="p{}-".format(pid), dir=self.root)
+            self.pooldir_pid = pid
+            self.entries = OrderedDict()
+            if not self.atexit_registered:
+                # Forked children inherit the registration
+                atexit.register(self.close)
+                self.atexit_registered = True
+        return self.pooldir
+
+    def _acquire_entry(self, fpr, key_hash):
+        """
+        Get the PoolEntry for fpr and key_hash, creating it if needed, and mark
+        it as in use
+        """
+        with self.lock:
+            pooldir = self._get_pooldir()
+            name = (fpr, key_hash)
+            entry = self.entries.get(name, None)
+            if entry is None:
+                # Keep the pathname short, since gpg-agent puts its socket in
+                # the homedir
+                homedir = tempfile.mkdtemp(dir=pooldir)
+                entry = self.entries[name] = PoolEntry(homedir)
+            else:
+                self.entries.move_to_end(name)
+            entry.users += 1
+            self._evict()
+            return entry
+
+    def _release_entry(self, entry):
+        with self.lock:
+            entry.users -= 1
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used homedirs until the pool fits its size.
+
+        Homedirs that are currently in use are never removed.
+
+        Must be called with self.lock held.
+        """
+        excess = len(self.entries) - self.size
+        if excess <= 0: return
+        for name, entry in list(self.entries.items()):
+            if excess <= 0: break
+            if entry.users: continue
+            del self.entries[name]
+            remove_homedir(entry.homedir)
+            self.stats.add("evictions")
+            excess -= 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Wait for one of the available gpg process slots
+        """
+        start = time.time()
+        self.semaphore.acquire()
+        try:
+            self.stats.add_wait(time.time() - start)
+            self.stats.add("spawns")
+            yield
+        finally:
+            self.semaphore.release()
+
+    @contextmanager
+    def gpg(self, fpr, key):
+        """
+        Context manager yielding a GPG object whose default keyring contains
+        the given ASCII armored key material.
+
+        The homedir can be shared by concurrent requests for the same
+        fingerprint: use the scratch_dir() method of the GPG object to get a
+        private place for temporary files.
+        """
+        from .models import GPG
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        entry = self._acquire_entry(fpr, hashlib.sha256(key).hexdigest())
+        try:
+            gpg = GPG(homedir=entry.homedir, use_default_keyring=True, pool=self)
+            with entry.lock:
+                if entry.imported:
+                    self.stats.add("hits")
+                else:
+                    self.stats.add("misses")
+                    gpg.run_checked(gpg.cmd("--import"), input=key)
+                    entry.imported = True
+            yield gpg
+        finally:
+            self._release_entry(entry)
+
+    def clear(self):
+        """
+        Remove all the homedirs in the pool
+        """
+        with self.lock:
+            for name, entry in list(self.entries.items()):
+                if entry.users: continue
+                del self.entries[name]
+                remove_homedir(entry.homedir)
+
+    def close(self):
+        """
+        Remove the pool directory of this process, stopping its gpg-agents.
+        This is run at exit.
+        """
+        with self.lock:
+            # Leave alone the directory of a parent process after a fork
+            if self.pooldir is None or self.pooldir_pid != os.getpid(): return
+            self._remove_pooldir(self.pooldir)
+            self.pooldir = None
+            self.pooldir_pid = None
+            self.entries = OrderedDict()
+
+
+# Pool shared by all the Key objects in this process
+pool = GPGPool()
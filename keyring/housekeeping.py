@@ -29,13 +29,15 @@ class Keyrings(hk.Task):
     KEYID_LEN = 16
 
     def run_main(self, stage):
-        self.dm = frozenset(kmodels.list_dm())
+        # Share the keyring index with the rest of the site, so that keyrings
+        # are only listed again if they changed
+        self.dm = kmodels.keyring_index.get("debian-maintainers.gpg")
         log.info("%s: Imported %d entries from dm keyring", self.IDENTIFIER, len(self.dm))
-        self.dd_u = frozenset(kmodels.list_dd_u())
+        self.dd_u = kmodels.keyring_index.get("debian-keyring.gpg")
         log.info("%s: Imported %d entries from dd_u keyring", self.IDENTIFIER, len(self.dd_u))
-        self.dd_nu = frozenset(kmodels.list_dd_nu())
+        self.dd_nu = kmodels.keyring_index.get("debian-nonupload.gpg")
         log.info("%s: Imported %d entries from dd_nu keyring", self.IDENTIFIER, len(self.dd_nu))
-        self.emeritus_dd = frozenset(kmodels.list_emeritus_dd())
+        self.emeritus_dd = kmodels.keyring_index.get("emeritus-keyring.gpg")
         log.info("%s: Imported %d entries from emeritus_dd keyring", self.IDENTIFIER, len(self.emeritus_dd))
 
         # Keep an index mapping key IDs to fingerprints and keyring type
@@ -229,6 +231,24 @@ class CleanUserKeys(hk.Task):
                 key.delete()
 
 
+class RefreshKeychecks(hk.Task):
+    """
+    Bring cached keycheck results of open processes up to date with the
+    keyrings, so that process pages do not need to run gpg
+    """
+    DEPENDS = [Keyrings]
+
+    def run_main(self, stage):
+        fprs = bmodels.Fingerprint.objects.filter(
+                is_active=True,
+                person__in=pmodels.Process.objects.filter(closed_time__isnull=True).values("person")).values_list("fpr", flat=True)
+        for key in kmodels.Key.objects.filter(fpr__in=fprs):
+            try:
+                key.keycheck()
+            except RuntimeError as e:
+                log.warning("%s: cannot refresh keycheck for %s: %s", self.IDENTIFIER, key.fpr, e)
+
+
 class KeyringMaint(hk.Task):
     """
     Update/regenerate the keyring with the keys of keyring-maint people
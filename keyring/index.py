@@ -0,0 +1,188 @@
+"""
+Index of the fingerprints contained in the keyrings, to answer membership
+queries without running gpg
+"""
+from django.conf import settings
+from backend.utils import atomic_writer
+import hashlib
+import io
+import os
+import os.path
+import struct
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+KEYRINGS = getattr(settings, "KEYRINGS", "/srv/keyring.debian.org/keyrings")
+KEYRINGS_INDEXDIR = getattr(settings, "KEYRINGS_INDEXDIR", "/srv/keyring.debian.org/data/keyring_index")
+
+
+def is_valid_fpr(fpr):
+    """
+    Check if a string is a 40 hex digit fingerprint
+    """
+    return len(fpr) == 40 and all(c in "0123456789ABCDEFabcdef" for c in fpr)
+
+
+class KeyringIndex(object):
+    """
+    Fingerprints contained in each keyring in KEYRINGS.
+
+    Each keyring is listed with gpg only once, and the result is stored in
+    memory and in a sorted binary file in KEYRINGS_INDEXDIR, which can be
+    reused by other processes. The index of a keyring is recomputed when the
+    mtime or the size of the keyring file changes.
+
+    The index file starts with a header with the mtime and size of the
+    keyring that was indexed and the number of fingerprints, followed by the
+    sorted fingerprints as one length byte and 20 bytes of binary data each.
+    """
+    MAGIC = b"NMKRIDX1"
+    HEADER = struct.Struct("<8sqqI")
+    RECORD = struct.Struct("<B20s")
+
+    def __init__(self, lister, keyrings_dir=None, index_dir=None):
+        """
+        lister is a function that, given a keyring pathname, generates the
+        fingerprints of all the keys in it
+        """
+        self.lister = lister
+        self.keyrings_dir = keyrings_dir or KEYRINGS
+        self.index_dir = index_dir or KEYRINGS_INDEXDIR
+        self.lock = threading.Lock()
+        # Map keyring name to ((mtime, size), frozenset of fingerprints)
+        self.cache = {}
+        # Map a tuple of keyring names to (generation, frozenset of key IDs)
+        self.keyid_cache = {}
+
+    def _stat(self, name):
+        try:
+            st = os.stat(os.path.join(self.keyrings_dir, name))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def index_pathname(self, name):
+        return os.path.join(self.index_dir, name + ".idx")
+
+    def _read_index(self, name, stat):
+        """
+        Read the fingerprints from the on-disk index, returning None if the
+        index is missing or does not match stat
+        """
+        try:
+            with io.open(self.index_pathname(name), "rb") as fd:
+                buf = fd.read()
+        except FileNotFoundError:
+            return None
+        if len(buf) < self.HEADER.size: return None
+        magic, mtime, size, count = self.HEADER.unpack_from(buf)
+        if magic != self.MAGIC or (mtime, size) != stat: return None
+        if len(buf) != self.HEADER.size + count * self.RECORD.size: return None
+        res = []
+        for length, data in self.RECORD.iter_unpack(buf[self.HEADER.size:]):
+            res.append(data[:length].hex().upper())
+        return frozenset(res)
+
+    def _valid_fprs(self, name, fprs):
+        """
+        Return a frozenset with the fingerprints that can be stored in the
+        index, logging the others
+        """
+        res = []
+        for fpr in fprs:
+            if not is_valid_fpr(fpr):
+                log.warning("keyring %s: skipping invalid fingerprint %r", name, fpr)
+                continue
+            res.append(fpr.upper())
+        return frozenset(res)
+
+    def _write_index(self, name, stat, fprs):
+        """
+        Write the on-disk index, skipping invalid fingerprints. Returns the
+        frozenset of the fingerprints written.
+        """
+        fprs = self._valid_fprs(name, fprs)
+        records = sorted(bytes.fromhex(fpr) for fpr in fprs)
+        with atomic_writer(self.index_pathname(name), chmod=0o644, sync=False) as fd:
+            fd.write(self.HEADER.pack(self.MAGIC, stat[0], stat[1], len(records)))
+            for data in records:
+                fd.write(self.RECORD.pack(len(data), data))
+        return fprs
+
+    def get(self, name):
+        """
+        Return a frozenset with all the fingerprints in the given keyring
+        """
+        stat = self._stat(name)
+        if stat is None:
+            log.warning("keyring %s not found in %s", name, self.keyrings_dir)
+            return frozenset()
+
+        cached = self.cache.get(name, None)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+
+        with self.lock:
+            cached = self.cache.get(name, None)
+            if cached is not None and cached[0] == stat:
+                return cached[1]
+
+            fprs = self._read_index(name, stat)
+            if fprs is None:
+                fprs = list(self.lister(os.path.join(self.keyrings_dir, name)))
+                try:
+                    fprs = self._write_index(name, stat, fprs)
+                except OSError as e:
+                    log.warning("cannot write keyring index for %s: %s", name, e)
+                    fprs = self._valid_fprs(name, fprs)
+                log.info("indexed %d fingerprints from keyring %s", len(fprs), name)
+            self.cache[name] = (stat, fprs)
+            return fprs
+
+    def contains(self, name, fpr):
+        """
+        Check if a fingerprint exists in a keyring
+        """
+        return fpr.upper() in self.get(name)
+
+    def generation(self, names):
+        """
+        Return a string that changes every time the contents of one of the
+        given keyrings change
+        """
+        parts = []
+        for name in names:
+            stat = self._stat(name)
+            if stat is None:
+                parts.append(name + ":-")
+            else:
+                parts.append("{}:{}:{}".format(name, stat[0], stat[1]))
+        return hashlib.sha1(";".join(parts).encode("utf-8")).hexdigest()
+
+    def keyids(self, names):
+        """
+        Return a frozenset with the long key IDs of all the keys in the given
+        keyrings
+        """
+        names = tuple(names)
+        generation = self.generation(names)
+        cached = self.keyid_cache.get(names, None)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        keyids = set()
+        for name in names:
+            keyids.update(fpr[-16:] for fpr in self.get(name))
+        keyids = frozenset(keyids)
+        with self.lock:
+            self.keyid_cache[names] = (generation, keyids)
+        return keyids
+
+    def invalidate(self):
+        """
+        Drop the in-memory index, forcing the next lookups to reload it
+        """
+        with self.lock:
+            self.cache = {}
+            self.keyid_cache = {}
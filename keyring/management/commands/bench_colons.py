@@ -0,0 +1,157 @@
+from django.core.management.base import BaseCommand, CommandError
+import sys
+import time
+import random
+import logging
+import keyring.models as kmodels
+from keyring import colons
+
+log = logging.getLogger(__name__)
+
+
+def legacy_parse_pub_fingerprints(lines):
+    """
+    Fingerprint parser used before keyring.colons, kept as a reference
+    """
+    mode = None
+    for line in lines:
+        try:
+            line = line.decode('utf-8')
+        except:
+            try:
+                line = line.decode('iso8859-1')
+            except:
+                line = line.decode('utf-8', errors='replace')
+        fields = line.split(":")
+        if fields[0] == "pub":
+            mode = "pub"
+        elif fields[0] == "sub":
+            mode = "sub"
+        elif fields[0] == "fpr":
+            if mode == "pub":
+                yield fields[9]
+
+
+def legacy_read_from_gpg(lines):
+    """
+    KeyData.read_from_gpg as it was before keyring.colons, kept as a
+    reference
+    """
+    keys = {}
+    pub = None
+    sub = None
+    cur_key = None
+    cur_uid = None
+    for lineno, line in enumerate(lines, start=1):
+        if line.startswith("pub:"):
+            pub = line.split(":")
+            sub = None
+            cur_key = None
+            cur_uid = None
+        elif line.startswith("fpr:"):
+            if pub is None:
+                if sub is not None:
+                    continue
+                else:
+                    raise Exception("gpg:{}: found fpr line with no previous pub line".format(lineno))
+            fpr = line.split(":")[9]
+            cur_key = keys.get(fpr, None)
+            if cur_key is None:
+                keys[fpr] = cur_key = kmodels.KeyData(fpr, pub)
+            pub = None
+            cur_uid = None
+        elif line.startswith("uid:"):
+            cur_uid = cur_key.get_uid(line.split(":"))
+        elif line.startswith("sig:"):
+            cur_uid.add_sig(line.split(":"))
+        elif line.startswith("sub:"):
+            sub = line.split(":")
+            cur_key.add_sub(sub)
+    return keys
+
+
+def synthetic_keyring(keys, uids, sigs, seed=0):
+    """
+    Generate gpg --with-colons --fixed-list-mode output for a synthetic
+    keyring.
+
+    With sigs=0 this looks like --list-keys output, else like --check-sigs
+    output.
+    """
+    rnd = random.Random(seed)
+
+    def hexid(size):
+        return "".join(rnd.choice("0123456789ABCDEF") for i in range(size))
+
+    signers = [hexid(16) for i in range(200)]
+    for k in range(keys):
+        fpr = hexid(40)
+        yield "pub:-:4096:1:{}:1415763159:1510628067::-:::scESC:::::::".format(fpr[-16:])
+        yield "fpr:::::::::{}:".format(fpr)
+        for u in range(uids):
+            yield "uid:-::::1479092073::{}::Ñame Surname {} <user{}-{}@example.org>:".format(hexid(40), k, k, u)
+            if not sigs: continue
+            yield "sig:!::1:{}:1479092073::::Ñame Surname {} <user{}-{}@example.org>:13x:::::10:".format(fpr[-16:], k, k, u)
+            for s in range(sigs):
+                signer = rnd.choice(signers)
+                yield "sig:!::1:{}:1479092073::::Signer {}:10x:::::10:".format(signer, signer)
+        for s in range(2):
+            sfpr = hexid(40)
+            yield "sub:-:4096:1:{}:1415763159:1510628097:::::e::::::".format(sfpr[-16:])
+            yield "fpr:::::::::{}:".format(sfpr)
+
+
+class Command(BaseCommand):
+    help = "benchmark the gpg colon output parsers on a synthetic keyring"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keys", type=int, default=5000, help="number of keys in the synthetic keyring")
+        parser.add_argument("--uids", type=int, default=3, help="number of uids per key")
+        parser.add_argument("--sigs", type=int, default=10, help="number of signatures per uid")
+        parser.add_argument("--rounds", type=int, default=3, help="number of times each parser is run")
+
+    def handle(self, **opts):
+        listing = [(x + "\n").encode("utf-8") for x in synthetic_keyring(opts["keys"], opts["uids"], 0)]
+        print("Synthetic --list-keys output: {} keys, {} lines, {} bytes".format(
+            opts["keys"], len(listing), sum(len(x) for x in listing)))
+        text = [x for x in synthetic_keyring(opts["keys"], opts["uids"], opts["sigs"])]
+        raw = [(x + "\n").encode("utf-8") for x in text]
+        print("Synthetic --check-sigs output: {} keys, {} lines, {} bytes".format(
+            opts["keys"], len(raw), sum(len(x) for x in raw)))
+
+        def bench(name, func, *args):
+            best = None
+            for i in range(opts["rounds"]):
+                start = time.perf_counter()
+                res = func(*args)
+                elapsed = time.perf_counter() - start
+                if best is None or elapsed < best: best = elapsed
+            print("  {:40s} {:8.3f}s".format(name, best))
+            return res, best
+
+        print("Fingerprint listing:")
+        old, old_time = bench("legacy _parse_pub_fingerprints", lambda: list(legacy_parse_pub_fingerprints(listing)))
+        new, new_time = bench("colons.pub_fingerprints", lambda: list(colons.pub_fingerprints(listing)))
+        if old != new: raise CommandError("fingerprint parsers returned different results")
+        print("  speedup: {:.1f}x".format(old_time / new_time))
+
+        # The legacy parser needs decoded lines
+        decode_lines = lambda: [x.decode("utf-8", errors="replace") for x in raw]
+
+        print("Key and signature data, from gpg output:")
+        old, old_time = bench("legacy KeyData.read_from_gpg", lambda: legacy_read_from_gpg(decode_lines()))
+        new, new_time = bench("KeyData.read_from_gpg", kmodels.KeyData.read_from_gpg, raw)
+        nosigs, nosigs_time = bench("KeyData.read_from_gpg(sigs=False)", lambda: kmodels.KeyData.read_from_gpg(raw, sigs=False))
+        if sorted(old.keys()) != sorted(new.keys()): raise CommandError("key data parsers returned different keys")
+        print("  speedup: {:.1f}x, {:.1f}x without signatures".format(old_time / new_time, old_time / nosigs_time))
+
+        print("Key and signature data, from stored check_sigs text:")
+        old, old_time = bench("legacy KeyData.read_from_gpg", legacy_read_from_gpg, text)
+        new, new_time = bench("KeyData.read_from_gpg", kmodels.KeyData.read_from_gpg, text)
+        print("  speedup: {:.1f}x".format(old_time / new_time))
+
+        print("Keycheck on parsed data:")
+        old_kc, old_time = bench("legacy parser", lambda: [k.keycheck().errors for k in legacy_read_from_gpg(decode_lines()).values()])
+        new_kc, new_time = bench("KeyData.read_from_gpg", lambda: [k.keycheck().errors for k in kmodels.KeyData.read_from_gpg(raw).values()])
+        if old_kc != new_kc: raise CommandError("keycheck results differ between parsers")
+        print("  speedup: {:.1f}x".format(old_time / new_time))
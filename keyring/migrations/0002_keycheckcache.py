@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keyring', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeycheckCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_hash', models.CharField(help_text='sha256 of the key material that was checked', max_length=64)),
+                ('generation', models.CharField(help_text='Generation of the keyrings used to check the signatures', max_length=40)),
+                ('data', models.TextField(help_text='JSON-encoded key, uid and signature data')),
+                ('updated', models.DateTimeField(help_text='Datetime when the signatures were last checked')),
+                ('key', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='keycheck_cache', to='keyring.Key')),
+            ],
+        ),
+    ]
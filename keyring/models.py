@@ -4,6 +4,7 @@ Code used to list entries in keyrings
 from django.db import models
 from django.conf import settings
 from django.utils.timezone import utc, now
+import hashlib
 import io
 import os
 import os.path
@@ -11,6 +12,9 @@ import subprocess
 from collections import namedtuple
 from backend.utils import StreamStdoutKeepStderr, require_dir
 from backend.models import FingerprintField
+from .gpgpool import pool as gpg_pool
+from .index import KeyringIndex
+from . import colons
 import time
 import re
 import datetime
@@ -32,6 +36,9 @@ KEYRINGS_TMPDIR = getattr(settings, "KEYRINGS_TMPDIR", "/srv/keyring.debian.org/
 KEYSERVER = getattr(settings, "KEYSERVER", "pgp.mit.edu")
 #KEYSERVER = getattr(settings, "KEYSERVER", "www.example.org")
 
+# Keyrings whose keys count as valid signers for keycheck
+KEYCHECK_KEYRINGS = ("debian-keyring.gpg", "debian-nonupload.gpg")
+
 
 @contextmanager
 def tempdir_gpg():
@@ -132,22 +139,23 @@ class Key(models.Model):
         # Joerg Jaspert <joerg@debian.org>,
         # Daniel Kahn Gillmor <dkg@fifthhorseman.net>,
         # and others.
-        with tempdir_gpg() as gpg:
-            gpg.run_checked(gpg.cmd("--import"), input=self.key.encode("utf-8"))
-
+        # Read the generation before running gpg, so that a keyring update
+        # happening meanwhile causes a refresh next time
+        generation = keyring_index.generation(KEYCHECK_KEYRINGS)
+        with gpg_pool.gpg(self.fpr, self.key) as gpg:
             # Check key
-            cmd = gpg.keyring_cmd(("debian-keyring.gpg", "debian-nonupload.gpg"), "--check-sigs", self.fpr)
+            cmd = gpg.keyring_cmd(KEYCHECK_KEYRINGS, "--check-sigs", self.fpr)
             self.check_sigs = gpg.run_checked(cmd).decode("utf-8", errors="replace")
             self.check_sigs_updated = now()
         self.save()
+        return self._store_keycheck(self._read_keydata(self.check_sigs.splitlines()), generation)
 
     def encrypt(self, data):
         """
         Encrypt the given data with this key, returning the ascii-armored
         encrypted result.
         """
-        with tempdir_gpg() as gpg:
-            gpg.run_checked(gpg.cmd("--import"), input=self.key.encode("utf-8"))
+        with gpg_pool.gpg(self.fpr, self.key) as gpg:
             cmd = gpg.cmd("--encrypt", "--armor", "--no-default-recipient", "--trust-model=always", "--recipient", self.fpr)
             return gpg.run_checked(cmd, input=data)
 
@@ -164,12 +172,11 @@ class Key(models.Model):
         Verify data using a detached signature
         """
         # See https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=826405
-        with tempdir_gpg() as gpg:
-            gpg.run_checked(gpg.cmd("--import"), input=self.key.encode("utf-8"))
-            data_file = os.path.join(gpg.homedir, "data.txt")
-            sig_file = os.path.join(gpg.homedir, "data.txt.asc")
-            status_log = os.path.join(gpg.homedir, "status.log")
-            logger_log = os.path.join(gpg.homedir, "logger.log")
+        with gpg_pool.gpg(self.fpr, self.key) as gpg, gpg.scratch_dir() as workdir:
+            data_file = os.path.join(workdir, "data.txt")
+            sig_file = os.path.join(workdir, "data.txt.asc")
+            status_log = os.path.join(workdir, "status.log")
+            logger_log = os.path.join(workdir, "logger.log")
             with io.open(data_file, "wb") as fd:
                 fd.write(data)
             with io.open(sig_file, "wb") as fd:
@@ -206,11 +213,10 @@ class Key(models.Model):
         Verify a signed text with this key, returning the signed payload
         """
         # See https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=826405
-        with tempdir_gpg() as gpg:
-            gpg.run_checked(gpg.cmd("--import"), input=self.key.encode("utf-8"))
-            data_file = os.path.join(gpg.homedir, "data.txt")
-            status_log = os.path.join(gpg.homedir, "status.log")
-            logger_log = os.path.join(gpg.homedir, "logger.log")
+        with gpg_pool.gpg(self.fpr, self.key) as gpg, gpg.scratch_dir() as workdir:
+            data_file = os.path.join(workdir, "data.txt")
+            status_log = os.path.join(workdir, "status.log")
+            logger_log = os.path.join(workdir, "logger.log")
             with io.open(data_file, "wb") as fd:
                 fd.write(data)
             cmd = gpg.cmd("--status-file", status_log, "--logger-file", logger_log, "--decrypt", data_file)
@@ -252,19 +258,129 @@ class Key(models.Model):
         if not msg.parsed: raise RuntimeError("OpenPGP MIME data not found")
         self.verify_detached(msg.text_data, msg.sig_data)
 
-    def keycheck(self):
-        if not self.check_sigs:
-            self.update_check_sigs()
+    def key_hash(self):
+        """
+        Hash of the key material, used to tell if cached results about it are
+        still valid
+        """
+        return hashlib.sha256(self.key.encode("utf-8")).hexdigest()
 
-        # Check the key data and signatures
-        keys = KeyData.read_from_gpg(self.check_sigs.splitlines())
+    def _read_keydata(self, lines):
+        """
+        Parse gpg --check-sigs output, returning the KeyData for this key
+        """
+        keys = KeyData.read_from_gpg(lines)
 
         # There should only be keycheck data for the fingerprint we gave gpg
         keydata = keys.get(self.fpr, None)
         if keydata is None:
             raise RuntimeError("keycheck results not found for fingerprint " + self.fpr)
+        return keydata
+
+    def _store_keycheck(self, keydata, generation):
+        cache, created = KeycheckCache.objects.update_or_create(key=self, defaults={
+            "key_hash": self.key_hash(),
+            "generation": generation,
+            "data": json.dumps(keydata.to_json()),
+            "updated": now(),
+        })
+        return cache
+
+    def _refresh_keycheck(self, cache, generation):
+        """
+        Update cached keycheck data after a keyring update, checking again
+        only the signatures whose outcome may have changed
+        """
+        keydata = cache.keydata()
+        signers = keyring_index.keyids(KEYCHECK_KEYRINGS)
+
+        # Long key IDs of the signers whose signatures need checking again
+        recheck = set()
+        total = pending = 0
+        for uid in keydata.uids.values():
+            for sig in uid.sigs.values():
+                # Skip self-signatures
+                if self.fpr.endswith(sig[4]): continue
+                total += 1
+                if sig[4] not in signers:
+                    # The signer is not in the keyrings anymore: gpg would
+                    # report that the key is missing
+                    sig[1] = "?"
+                elif sig[1] != "!":
+                    # The signer was added to the keyrings, or its key changed
+                    # since a failed check
+                    recheck.add(sig[4])
+                    pending += 1
+
+        if not recheck:
+            return self._store_keycheck(keydata, generation)
+
+        # If most signatures need checking, a full check costs the same
+        if pending * 2 > total:
+            return self.update_check_sigs()
+
+        with gpg_pool.gpg(self.fpr, self.key) as gpg, gpg.scratch_dir() as workdir:
+            cmd = gpg.keyring_cmd(KEYCHECK_KEYRINGS, "--export", "--armor", *sorted(recheck))
+            signer_keys = gpg.run_checked(cmd)
+            # Check signatures in a homedir that only has this key and the
+            # signers that changed
+            check_gpg = GPG(homedir=workdir, use_default_keyring=True, pool=gpg_pool)
+            check_gpg.run_checked(check_gpg.cmd("--import"), input=self.key.encode("utf-8") + b"\n" + signer_keys)
+            lines = check_gpg.run_checked(check_gpg.cmd("--check-sigs", self.fpr)).splitlines()
+        checked = self._read_keydata(lines)
+
+        for uidfpr, uid in keydata.uids.items():
+            checked_uid = checked.uids.get(uidfpr, None)
+            if checked_uid is None: continue
+            for k, sig in uid.sigs.items():
+                if sig[4] not in recheck: continue
+                checked_sig = checked_uid.sigs.get(k, None)
+                if checked_sig is not None:
+                    uid.sigs[k] = checked_sig
+
+        log.info("%s: keycheck refreshed checking %d of %d signatures", self.fpr, pending, total)
+        return self._store_keycheck(keydata, generation)
 
-        return KeycheckKeyResult(keydata)
+    def keycheck(self):
+        """
+        Check the key, returning a KeycheckKeyResult.
+
+        Parsed results are cached in KeycheckCache, and reused as long as the
+        key material and the keyrings do not change. After a keyring update,
+        only the signatures affected by the update are checked again.
+        """
+        generation = keyring_index.generation(KEYCHECK_KEYRINGS)
+        cache = KeycheckCache.objects.filter(key=self).first()
+
+        if cache is None and self.check_sigs:
+            # Reuse check_sigs computed before results were cached: since we
+            # do not know the keyrings it was computed with, it will be
+            # refreshed right away
+            cache = KeycheckCache(key_hash=self.key_hash(), generation="",
+                                  data=json.dumps(self._read_keydata(self.check_sigs.splitlines()).to_json()),
+                                  updated=self.check_sigs_updated)
+
+        if cache is None or cache.key_hash != self.key_hash():
+            cache = self.update_check_sigs()
+        elif cache.generation != generation:
+            cache = self._refresh_keycheck(cache, generation)
+
+        return KeycheckKeyResult(cache.keydata(), updated=cache.updated)
+
+
+class KeycheckCache(models.Model):
+    """
+    Parsed keycheck data for a key, valid for one version of the key material
+    and one generation of the keyrings
+    """
+    key = models.OneToOneField(Key, related_name="keycheck_cache")
+    key_hash = models.CharField(max_length=64, help_text="sha256 of the key material that was checked")
+    generation = models.CharField(max_length=40, help_text="Generation of the keyrings used to check the signatures")
+    data = models.TextField(help_text="JSON-encoded key, uid and signature data")
+    updated = models.DateTimeField(help_text="Datetime when the signatures were last checked")
+
+    def keydata(self):
+        return KeyData.from_json(json.loads(self.data))
 
 
 class GPG(object):
@@ -272,9 +388,11 @@ class GPG(object):
     Run GnuPG commands and parse their output
     """
 
-    def __init__(self, homedir=None, use_default_keyring=False):
+    def __init__(self, homedir=None, use_default_keyring=False, pool=None):
         self.homedir = homedir
         self.use_default_keyring = use_default_keyring
+        # If set, gpg processes are run through the slots of this GPGPool
+        self.pool = pool
 
     def _base_cmd(self):
         cmd = ["/usr/bin/gpg"]
@@ -336,6 +454,12 @@ class GPG(object):
         Run gpg with the given command, waiting for its completion, returning a triple
         (stdout, stderr, result)
         """
+        if self.pool is not None:
+            with self.pool.slot():
+                return self._run_cmd(cmd, input)
+        return self._run_cmd(cmd, input)
+
+    def _run_cmd(self, cmd, input):
         proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout, stderr = proc.communicate(input=input)
         result = proc.wait()
@@ -356,6 +480,18 @@ class GPG(object):
             ))
         return stdout
 
+    @contextmanager
+    def scratch_dir(self):
+        """
+        Create a temporary directory inside the homedir, for files used by only
+        one gpg invocation, since the homedir may be shared
+        """
+        pathname = tempfile.mkdtemp(prefix="work-", dir=self.homedir)
+        try:
+            yield pathname
+        finally:
+            shutil.rmtree(pathname, ignore_errors=True)
+
     def pipe_cmd(self, cmd):
         """
         Run gpg with the given command, returning a couple
@@ -369,32 +505,8 @@ class GPG(object):
         return proc, lines
 
 
-def _check_keyring(keyring, fpr):
-    """
-    Check if a fingerprint exists in a keyring
-    """
-    gpg = GPG()
-    return gpg.has_key(keyring, fpr)
-
-
 def _parse_pub_fingerprints(lines):
-    mode = None
-    for line in lines:
-        try:
-            line = line.decode('utf-8')
-        except:
-            try:
-                line = line.decode('iso8859-1')
-            except:
-                line = line.decode('utf-8', errors='replace')
-        fields = line.split(":")
-        if fields[0] == "pub":
-            mode = "pub"
-        elif fields[0] == "sub":
-            mode = "sub"
-        elif fields[0] == "fpr":
-            if mode == "pub":
-                yield fields[9]
+    return colons.pub_fingerprints(lines)
 
 
 def _list_keyring(keyring):
@@ -411,6 +523,24 @@ def _list_keyring(keyring):
         raise RuntimeError("gpg exited with status %d: %s" % (result, lines.stderr.getvalue().strip()))
 
 
+# Fingerprints in each keyring, shared by all the lookup functions below
+keyring_index = KeyringIndex(_list_keyring)
+
+
+def _check_keyring(keyring, fpr):
+    """
+    Check if a fingerprint exists in a keyring
+    """
+    return keyring_index.contains(keyring, fpr)
+
+
+def _iter_keyring(keyring):
+    """
+    Generate all fingerprints in a keyring, in sorted order
+    """
+    return iter(sorted(keyring_index.get(keyring)))
+
+
 def is_dm(fpr):
     return _check_keyring("debian-maintainers.gpg", fpr)
 
@@ -422,16 +552,16 @@ def is_dd_nu(fpr):
 
 
 def list_dm():
-    return _list_keyring("debian-maintainers.gpg")
+    return _iter_keyring("debian-maintainers.gpg")
 
 def list_dd_u():
-    return _list_keyring("debian-keyring.gpg")
+    return _iter_keyring("debian-keyring.gpg")
 
 def list_dd_nu():
-    return _list_keyring("debian-nonupload.gpg")
+    return _iter_keyring("debian-nonupload.gpg")
 
 def list_emeritus_dd():
-    return _list_keyring("emeritus-keyring.gpg")
+    return _iter_keyring("emeritus-keyring.gpg")
 
 
 class KeyData(object):
@@ -458,25 +588,67 @@ class KeyData(object):
     def keycheck(self):
         return KeycheckKeyResult(self)
 
+    def to_json(self):
+        """
+        Serialize to a JSON-compatible structure
+        """
+        return {
+            "fpr": self.fpr,
+            "pub": self.pub,
+            "uids": [{"uid": u.uid, "sigs": list(u.sigs.values())} for u in self.uids.values()],
+            "subkeys": list(self.subkeys.values()),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Rebuild a KeyData from the output of to_json()
+        """
+        res = cls(data["fpr"], data["pub"])
+        for u in data["uids"]:
+            uid = res.get_uid(u["uid"])
+            for sig in u["sigs"]:
+                uid.add_sig(sig)
+        for sub in data["subkeys"]:
+            res.add_sub(sub)
+        return res
+
     @classmethod
-    def read_from_gpg(cls, lines):
+    def read_from_gpg(cls, lines, sigs=True):
         """
-        Run the given gpg command and read key and signature data from its output
+        Read key and signature data from gpg --with-colons output.
+
+        lines can be str or bytes, as read from gpg. If sigs is False,
+        signature records are skipped.
         """
+        types = ["pub", "fpr", "uid", "sub"]
+        if sigs: types.append("sig")
+        # All the record types we read have 3 characters: we can look them up
+        # with a slice of the line, and skip the other lines without decoding
+        # them
+        wanted = colons.prefixes(types)
+
         keys = {}
         pub = None
         sub = None
         cur_key = None
         cur_uid = None
         for lineno, line in enumerate(lines, start=1):
-            if line.startswith("pub:"):
+            type = wanted.get(line[:4])
+            if type is None:
+                continue
+            elif type == "sig":
+                if cur_uid is None:
+                    raise Exception("gpg:{}: found sig line with no previous uid line".format(lineno))
+                cur_uid.add_sig(colons.split(line))
+            elif type == "pub":
                 # Keep track of this pub record, to correlate with the following
                 # fpr record
-                pub = line.split(":")
+                pub = colons.split(line)
                 sub = None
                 cur_key = None
                 cur_uid = None
-            elif line.startswith("fpr:"):
+            elif type == "fpr":
                 # Correlate fpr with the previous pub record, and start gathering
                 # information for a new key
                 if pub is None:
@@ -485,24 +657,20 @@ class KeyData(object):
                         continue
                     else:
                         raise Exception("gpg:{}: found fpr line with no previous pub line".format(lineno))
-                fpr = line.split(":")[9]
+                fpr = colons.split(line)[9]
                 cur_key = keys.get(fpr, None)
                 if cur_key is None:
                     keys[fpr] = cur_key = cls(fpr, pub)
                 pub = None
                 cur_uid = None
-            elif line.startswith("uid:"):
+            elif type == "uid":
                 if cur_key is None:
                     raise Exception("gpg:{}: found uid line with no previous pub+fpr lines".format(lineno))
-                cur_uid = cur_key.get_uid(line.split(":"))
-            elif line.startswith("sig:"):
-                if cur_uid is None:
-                    raise Exception("gpg:{}: found sig line with no previous uid line".format(lineno))
-                cur_uid.add_sig(line.split(":"))
-            elif line.startswith("sub:"):
+                cur_uid = cur_key.get_uid(colons.split(line))
+            elif type == "sub":
                 if cur_key is None:
                     raise Exception("gpg:{}: found sub line with no previous pub+fpr lines".format(lineno))
-                sub = line.split(":")
+                sub = colons.split(line)
                 cur_key.add_sub(sub)
 
         return keys
@@ -540,8 +708,10 @@ class KeycheckKeyResult(object):
     """
     Perform consistency checks on a key, based on the old keycheck.sh
     """
-    def __init__(self, key):
+    def __init__(self, key, updated=None):
         self.key = key
+        # Datetime when the signatures were checked, if known
+        self.updated = updated
         self.uids = []
         self.errors = set()
         self.capabilities = {}
@@ -1,8 +1,15 @@
 from django.test import TestCase, Client
 from django.urls import reverse
 from . import models as kmodels
+from .gpgpool import GPGPool
+from .index import KeyringIndex
 import io
 import json
+import os
+import tempfile
+import shutil
+import subprocess
+from unittest.mock import patch
 
 test_signed = """
 -----BEGIN PGP SIGNED MESSAGE-----
@@ -73,6 +80,60 @@ class LookupTest(TestCase):
         self.assertFalse(kmodels.is_dd_u(fpr))
         self.assertFalse(kmodels.is_dd_nu(fpr))
 
+class TestKeyringIndex(TestCase):
+    FPRS = ["1793D6AB75663E6BF104953A634F4BD1E7AD5568", "66B4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB"]
+    INVALID = ["0123456789ABCDEF0123456789ABCDEF", "X793D6AB75663E6BF104953A634F4BD1E7AD5568"]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.keyrings_dir = os.path.join(self.root, "keyrings")
+        self.index_dir = os.path.join(self.root, "index")
+        os.mkdir(self.keyrings_dir)
+        with open(os.path.join(self.keyrings_dir, "test.gpg"), "wb") as fd:
+            fd.write(b"test")
+        self.listed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def lister(self, pathname):
+        self.listed += 1
+        return iter(self.FPRS + self.INVALID)
+
+    def make_index(self):
+        return KeyringIndex(self.lister, keyrings_dir=self.keyrings_dir, index_dir=self.index_dir)
+
+    def test_lookup(self):
+        index = self.make_index()
+        # Invalid fingerprints are skipped
+        with self.assertLogs("keyring.index", level="WARNING") as logs:
+            self.assertEqual(index.get("test.gpg"), frozenset(self.FPRS))
+        self.assertEqual(len(logs.output), 2)
+        self.assertTrue(index.contains("test.gpg", self.FPRS[0]))
+        self.assertTrue(index.contains("test.gpg", self.FPRS[0].lower()))
+        self.assertFalse(index.contains("test.gpg", "0EED77DC41D760FDE44035FF5556A34E04A3610B"))
+        self.assertEqual(index.get("missing.gpg"), frozenset())
+        self.assertEqual(self.listed, 1)
+
+    def test_persistence(self):
+        self.make_index().get("test.gpg")
+        self.assertTrue(os.path.exists(os.path.join(self.index_dir, "test.gpg.idx")))
+
+        # A new index reads the on-disk file without listing the keyring again
+        self.assertEqual(self.make_index().get("test.gpg"), frozenset(self.FPRS))
+        self.assertEqual(self.listed, 1)
+
+    def test_invalidation(self):
+        index = self.make_index()
+        index.get("test.gpg")
+        with open(os.path.join(self.keyrings_dir, "test.gpg"), "ab") as fd:
+            fd.write(b"changed")
+        index.get("test.gpg")
+        self.assertEqual(self.listed, 2)
+        self.make_index().get("test.gpg")
+        self.assertEqual(self.listed, 2)
+
+
 class TestKeycheck(TestCase):
     def test_backend(self):
         test_fpr1 = "1793D6AB75663E6BF104953A634F4BD1E7AD5568"
@@ -214,6 +275,80 @@ class TestVerifyMIME(TestCase):
             key.verify(text.replace(b"NM process", b"MN process"))
 
 
+class TestGPGPool(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pool = GPGPool(root=self.root, size=1, workers=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _key(self, fpr):
+        kmodels.Key.objects.test_preload(fpr)
+        return kmodels.Key.objects.get(fpr=fpr)
+
+    def test_reuse(self):
+        key = self._key("1793D6AB75663E6BF104953A634F4BD1E7AD5568")
+        with self.pool.gpg(key.fpr, key.key) as gpg:
+            homedir = gpg.homedir
+            gpg.run_checked(gpg.cmd("--list-keys", key.fpr))
+        self.assertEqual(self.pool.stats.misses, 1)
+        self.assertEqual(self.pool.stats.hits, 0)
+        self.assertEqual(self.pool.stats.spawns, 2)
+
+        with self.pool.gpg(key.fpr, key.key) as gpg:
+            self.assertEqual(gpg.homedir, homedir)
+            gpg.run_checked(gpg.cmd("--list-keys", key.fpr))
+        self.assertEqual(self.pool.stats.misses, 1)
+        self.assertEqual(self.pool.stats.hits, 1)
+        self.assertEqual(self.pool.stats.spawns, 3)
+        self.assertEqual(self.pool.stats.hit_rate, 0.5)
+
+    def test_evict(self):
+        key1 = self._key("1793D6AB75663E6BF104953A634F4BD1E7AD5568")
+        key2 = self._key("66B4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB")
+        with self.pool.gpg(key1.fpr, key1.key) as gpg:
+            homedir1 = gpg.homedir
+        with self.pool.gpg(key2.fpr, key2.key) as gpg:
+            homedir2 = gpg.homedir
+        self.assertEqual(self.pool.stats.evictions, 1)
+        self.assertFalse(os.path.exists(homedir1))
+        self.assertTrue(os.path.exists(homedir2))
+
+    def test_cleanup(self):
+        key = self._key("1793D6AB75663E6BF104953A634F4BD1E7AD5568")
+        with self.pool.gpg(key.fpr, key.key) as gpg:
+            gpg.run_checked(gpg.cmd("--list-keys", key.fpr))
+        pooldir = self.pool.pooldir
+        self.assertTrue(os.path.isdir(pooldir))
+        self.pool.close()
+        self.assertFalse(os.path.exists(pooldir))
+        self.pool.close()
+
+    def test_sweep(self):
+        # Leftovers of a process that is not running
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        stale = os.path.join(self.root, "p{}-stale".format(proc.pid))
+        os.makedirs(os.path.join(stale, "homedir"))
+        # Directory of a running process
+        running = os.path.join(self.root, "p1-running")
+        os.mkdir(running)
+        self.pool._get_pooldir()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(running))
+        self.pool.close()
+
+    def test_stats_view(self):
+        client = Client()
+        response = client.get(reverse("keyring_gpg_pool_stats"))
+        self.assertEqual(response.status_code, 200)
+        decoded = response.json()
+        self.assertIn("hit_rate", decoded)
+        self.assertIn("spawns", decoded)
+        self.assertIn("queue_wait", decoded)
+
+
 class TestParsePubFingerprints(TestCase):
     INPUT="""pub:-:4096:1:E5EC4AC9BD627B05:1415763159:1510628067::-:::scESC:::::::
 fpr:::::::::B7A15F455B287F384174D5E9E5EC4AC9BD627B05:
@@ -237,3 +372,131 @@ uid:-::::1475515902::736F76B9B199686160E5FDCD5D2458C41826B6A4::Laura Arjona Rein
     def test_parse(self):
         fprs = [x for x in kmodels._parse_pub_fingerprints(x.encode("utf8") for x in self.INPUT.splitlines())]
         self.assertEqual(fprs, ["B7A15F455B287F384174D5E9E5EC4AC9BD627B05", "445E3AD036903F47E19B37B2F22674467E4AF4A3"])
+
+
+class TestReadFromGpg(TestCase):
+    INPUT = TestParsePubFingerprints.INPUT + """sig:!::1:F22674467E4AF4A3:1475515902::::Laura Arjona Reina <larjona@debian.org>:13x:::::8:
+sig:!::1:3D983C52EB85980C:1475515902::::Ondřej Nový <novy@ondrej.org>:10x:::::8:
+tru:t:1:1479092073:0:3:1:5
+"""
+
+    def test_parse(self):
+        for lines in (self.INPUT.splitlines(), [x.encode("utf-8") + b"\n" for x in self.INPUT.splitlines()]):
+            keys = kmodels.KeyData.read_from_gpg(lines)
+            self.assertEqual(sorted(keys.keys()), ["445E3AD036903F47E19B37B2F22674467E4AF4A3", "B7A15F455B287F384174D5E9E5EC4AC9BD627B05"])
+            key = keys["445E3AD036903F47E19B37B2F22674467E4AF4A3"]
+            self.assertEqual(key.pub[11], "scESC")
+            self.assertEqual(len(key.uids), 5)
+            uid = key.uids["736F76B9B199686160E5FDCD5D2458C41826B6A4"]
+            self.assertEqual(uid.name, "Laura Arjona Reina <laura.arjona@upm.es>")
+            self.assertEqual(sorted(x[9] for x in uid.sigs.values()), ["Laura Arjona Reina <larjona@debian.org>", "Ondřej Nový <novy@ondrej.org>"])
+            self.assertEqual(len(keys["B7A15F455B287F384174D5E9E5EC4AC9BD627B05"].subkeys), 3)
+
+    def test_skip_sigs(self):
+        keys = kmodels.KeyData.read_from_gpg(self.INPUT.splitlines(), sigs=False)
+        uid = keys["445E3AD036903F47E19B37B2F22674467E4AF4A3"].uids["736F76B9B199686160E5FDCD5D2458C41826B6A4"]
+        self.assertEqual(uid.sigs, {})
+
+    def test_latin1(self):
+        lines = [
+            b"pub:-:4096:1:E5EC4AC9BD627B05:1415763159:1510628067::-:::scESC:::::::\n",
+            b"fpr:::::::::B7A15F455B287F384174D5E9E5EC4AC9BD627B05:\n",
+            "uid:-::::1479092073::6585BDD130E2072419D0B256B410404B9C3B14C1::Ondřej Nový <novy@ondrej.org>:\n".encode("iso8859-2"),
+        ]
+        keys = kmodels.KeyData.read_from_gpg(lines)
+        uid = keys["B7A15F455B287F384174D5E9E5EC4AC9BD627B05"].uids["6585BDD130E2072419D0B256B410404B9C3B14C1"]
+        self.assertEqual(uid.name, "Ondřej Nový <novy@ondrej.org>".encode("iso8859-2").decode("iso8859-1"))
+
+
+
+class TestKeycheckCache(TestCase):
+    FPR = "1793D6AB75663E6BF104953A634F4BD1E7AD5568"
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.keyrings_dir = os.path.join(self.root, "keyrings")
+        os.mkdir(self.keyrings_dir)
+        for name in kmodels.KEYCHECK_KEYRINGS:
+            open(os.path.join(self.keyrings_dir, name), "wb").close()
+        self.pool = GPGPool(root=os.path.join(self.root, "pool"))
+        index = KeyringIndex(kmodels._list_keyring, keyrings_dir=self.keyrings_dir, index_dir=os.path.join(self.root, "index"))
+        for p in (
+                patch("keyring.models.KEYRINGS", self.keyrings_dir),
+                patch("keyring.models.keyring_index", index),
+                patch("keyring.models.gpg_pool", self.pool)):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.root)
+
+    def gpg(self, homedir, *args, input=None):
+        cmd = ["gpg", "--homedir", homedir, "--batch", "--quiet", "--no-tty", "--pinentry-mode", "loopback", "--passphrase", ""]
+        cmd.extend(args)
+        return subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+
+    def make_signed_key(self):
+        """
+        Create a signer key, and use it to sign the test key. Returns the
+        signed test key and the signer public key.
+        """
+        homedir = tempfile.mkdtemp(dir=self.root)
+        self.gpg(homedir, "--quick-generate-key", "Test Signer <signer@example.org>", "ed25519", "sign", "never")
+        with io.open(os.path.join("test_data", self.FPR + ".txt"), "rb") as fd:
+            self.gpg(homedir, "--import", input=fd.read())
+        self.gpg(homedir, "--yes", "--quick-sign-key", self.FPR, "Enrico Zini <enrico@debian.org>")
+        key = self.gpg(homedir, "--export", "--armor", self.FPR).decode("utf-8")
+        signer = self.gpg(homedir, "--export", "signer@example.org")
+        listing = self.gpg(homedir, "--with-colons", "--list-keys", "signer@example.org").decode("utf-8")
+        self.signer_keyid = next(x.split(":")[4] for x in listing.splitlines() if x.startswith("pub:"))
+        return key, signer
+
+    def signer_sigs(self, result):
+        for ku in result.uids:
+            if ku.uid.name != "Enrico Zini <enrico@debian.org>": continue
+            return [sig[1] for sig in ku.uid.sigs.values() if sig[4] == self.signer_keyid]
+
+    def test_cache(self):
+        kmodels.Key.objects.test_preload(self.FPR)
+        key = kmodels.Key.objects.get(fpr=self.FPR)
+        res = key.keycheck()
+        self.assertIsNotNone(res.updated)
+        spawns = self.pool.stats.spawns
+        self.assertGreater(spawns, 0)
+
+        # Cached results are used without running gpg
+        cached = kmodels.Key.objects.get(fpr=self.FPR).keycheck()
+        self.assertEqual(self.pool.stats.spawns, spawns)
+        self.assertEqual(cached.errors, res.errors)
+        self.assertEqual([(u.uid.name, len(u.sigs_no_key)) for u in cached.uids], [(u.uid.name, len(u.sigs_no_key)) for u in res.uids])
+
+        # Changing the key material invalidates the cache
+        key.key += "\n"
+        key.save()
+        key.keycheck()
+        self.assertGreater(self.pool.stats.spawns, spawns)
+
+    def test_incremental(self):
+        body, signer = self.make_signed_key()
+        key = kmodels.Key.objects.get_or_download(self.FPR, body=body)
+        self.assertEqual(self.signer_sigs(key.keycheck()), ["?"])
+
+        # Adding the signer to a keyring only checks its signatures
+        self.gpg(self.root, "--no-default-keyring", "--keyring", os.path.join(self.keyrings_dir, "debian-keyring.gpg"), "--import", input=signer)
+        spawns = self.pool.stats.spawns
+        res = key.keycheck()
+        self.assertEqual(self.signer_sigs(res), ["!"])
+        self.assertEqual(self.pool.stats.spawns - spawns, 3)
+        self.assertEqual(self.signer_sigs(key.keycheck()), ["!"])
+        self.assertEqual(self.pool.stats.spawns - spawns, 3)
+
+        # Results match a full check
+        key.update_check_sigs()
+        self.assertEqual(self.signer_sigs(kmodels.KeyData.read_from_gpg(key.check_sigs.splitlines())[self.FPR].keycheck()), ["!"])
+
+        # Removing the signer does not need gpg
+        open(os.path.join(self.keyrings_dir, "debian-keyring.gpg"), "wb").close()
+        spawns = self.pool.stats.spawns
+        self.assertEqual(self.signer_sigs(key.keycheck()), ["?"])
+        self.assertEqual(self.pool.stats.spawns, spawns)
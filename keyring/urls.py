@@ -8,4 +8,5 @@ from . import views
 
 urlpatterns = [
     url(r'^keycheck/(?P<fpr>[0-9A-Fa-f]{32,40})$', views.keycheck, name="keyring_keycheck"),
+    url(r'^gpg-pool-stats$', views.gpg_pool_stats, name="keyring_gpg_pool_stats"),
 ]
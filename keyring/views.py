@@ -93,3 +93,16 @@ def keycheck(request, fpr):
         return json_response({
             "error": str(e)
         }, status_code=500)
+
+
+def gpg_pool_stats(request):
+    """
+    Counters of the pool of GnuPG homedirs used by this server process
+    """
+    if request.method != "GET":
+        return http.HttpResponseForbidden("Only GET request is allowed here")
+    res = kmodels.gpg_pool.stats.as_dict()
+    res["size"] = len(kmodels.gpg_pool.entries)
+    res["max_size"] = kmodels.gpg_pool.size
+    res["workers"] = kmodels.gpg_pool.workers
+    return json_response(res)
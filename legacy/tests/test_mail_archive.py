@@ -7,6 +7,7 @@ from backend import models as bmodels
 from backend.unittest import NamedObjects
 import process.models as pmodels
 from process.unittest import ProcessFixtureMixin
+import glob
 import os
 
 
@@ -32,6 +33,9 @@ Test
     def tearDownClass(cls):
         super().tearDownClass()
         os.unlink(cls.mailbox_pathname)
+        # Remove compressed copies made for downloads, and the message index
+        for fname in glob.glob(cls.mailbox_pathname + ".*.gz") + glob.glob(cls.mailbox_pathname + ".idx"):
+            os.unlink(fname)
 
     @classmethod
     def __add_extra_tests__(cls):
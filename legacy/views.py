@@ -8,8 +8,8 @@ from django.utils.timezone import now
 from django.views.generic import View, TemplateView
 import backend.models as bmodels
 from backend import const
-from backend.mixins import VisitProcessMixin, VisitProcessTemplateView
-import backend.email
+from backend.mixins import VisitProcessMixin, VisitProcessTemplateView, MailArchiveMixin, MailArchiveMessageMixin
+from backend.mailbox_cache import CompressedMailbox
 import datetime
 import os
 import json
@@ -93,7 +93,7 @@ class Process(VisitProcessTemplateView):
                         "remarks": " ".join(sorted(keycheck.errors)) if keycheck.errors else "ok",
                     },
                     "uids": uids,
-                    "updated": key.check_sigs_updated,
+                    "updated": keycheck.updated,
                 }
             else:
                 ctx["keycheck"] = {
@@ -115,34 +115,16 @@ class MailArchive(VisitProcessMixin, View):
 
         user_fname = "%s.mbox" % (self.process.person.uid or self.process.person.email)
 
-        res = http.HttpResponse(content_type="application/octet-stream")
-        res["Content-Disposition"] = "attachment; filename=%s.gz" % user_fname
-
-        # Compress the mailbox and pass it to the request
-        from gzip import GzipFile
-        import os.path
-        import shutil
-        # The last mtime argument seems to only be supported in python 2.7
-        outfd = GzipFile(user_fname, "wb", 9, res) #, os.path.getmtime(fname))
-        try:
-            with open(fname, "rb") as infd:
-                shutil.copyfileobj(infd, outfd)
-        finally:
-            outfd.close()
-        return res
+        # Serve a cached compressed copy of the mailbox
+        mbox = CompressedMailbox(fname, user_fname)
+        return mbox.serve(request, user_fname + ".gz")
 
 
-class DisplayMailArchive(VisitProcessMixin, TemplateView):
+class DisplayMailArchive(MailArchiveMixin, VisitProcessMixin, TemplateView):
     template_name = "process/display-mail-archive.html"
     require_visit_perms = "view_mbox"
+    message_url_name = "legacy_display_mail_archive_message"
 
-    def get_context_data(self, **kw):
-        ctx = super(DisplayMailArchive, self).get_context_data(**kw)
 
-        fname = self.process.mailbox_file
-        if fname is None:
-            raise http.Http404
-
-        ctx["mails"] = backend.email.get_mbox_as_dicts(fname)
-        ctx["class"] = "clickable"
-        return ctx
+class DisplayMailArchiveMessage(MailArchiveMessageMixin, VisitProcessMixin, View):
+    require_visit_perms = "view_mbox"
@@ -32,6 +32,7 @@ class WATPing(op.Operation):
             self._process = pmodels.Process.objects.create(self.person, const.STATUS_EMERITUS_DD)
             self._process.hide_until = self.audit_time + datetime.timedelta(days=30)
             self._process.save()
+            self._process.update_am_dashboard()
         self._process.add_log(self.audit_author, self.audit_notes, is_public=True, logdate=self.audit_time)
 
     def _mock_execute(self):
@@ -98,6 +99,7 @@ class WATRemove(op.Operation):
         requirement.approved_time = self.audit_time
         requirement.save()
         requirement.add_log(self.audit_author, "Requirement automatically satisfied", True, action="req_approve", logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
     def notify(self, request=None):
         import process.views
@@ -20,7 +20,11 @@
 
 
 import django_housekeeping as hk
+from django.db.models import Q
 from minechangelogs import models as mmodels
+from backend import const
+import backend.models as bmodels
+import process.models as pmodels
 import logging
 
 log = logging.getLogger(__name__)
@@ -29,8 +33,19 @@ class IndexChangelogs(hk.Task):
     """
     Update minechangelogs index
     """
+    # The indexer forks a pool of worker processes
+    EXCLUSIVE = True
+
     def run_main(self, stage):
         indexer = mmodels.Indexer()
-        with mmodels.parse_projectb() as changes:
-            indexer.index(changes)
+        source = mmodels.parse_projectb()
+        source.load_state()
+        indexer.index_projectb(source)
         indexer.flush()
+
+        # Precompute the default queries of DDs and active applicants
+        persons = bmodels.Person.objects.filter(
+            Q(status__in=(const.STATUS_DD_U, const.STATUS_DD_NU))
+            | Q(pk__in=pmodels.Process.objects.filter(closed_time__isnull=True).values("person"))
+            | Q(pk__in=bmodels.Process.objects.filter(is_active=True).values("person"))).distinct()
+        mmodels.update_person_hits(persons)
@@ -18,7 +18,6 @@
 from django.core.management.base import BaseCommand, CommandError
 import django.db
 from django.conf import settings
-import optparse
 import sys
 import logging
 from minechangelogs import models as mmodels
@@ -27,10 +26,18 @@ log = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Update minechangelogs index'
-    option_list = BaseCommand.option_list + (
-        optparse.make_option("--quiet", action="store_true", dest="quiet", default=None, help="Disable progress reporting"),
-        optparse.make_option("--oldentries", action="store", metavar="FILE", help="Also read old entries from a file"),
-    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quiet", action="store_true", default=None, help="Disable progress reporting")
+        parser.add_argument("--oldentries", action="store", metavar="FILE", help="Also read old entries from a file")
+        parser.add_argument("--workers", action="store", type=int, default=None,
+                            help="Number of worker processes building documents (default: settings.MINECHANGELOGS_INDEX_WORKERS)")
+        parser.add_argument("--batch-size", action="store", type=int, default=None,
+                            help="Number of documents indexed between commits and checkpoints (default: settings.MINECHANGELOGS_INDEX_BATCH)")
+        parser.add_argument("--max-rows", action="store", type=int, default=None,
+                            help="Stop after reading this many changes from projectb: the next run resumes from there")
+        parser.add_argument("--max-rate", action="store", type=float, default=None,
+                            help="Read at most this many changes per second from projectb")
 
     def handle(self, oldentries=None, **opts):
         FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
@@ -39,10 +46,11 @@ class Command(BaseCommand):
         else:
             logging.basicConfig(level=logging.INFO, stream=sys.stderr, format=FORMAT)
 
-        indexer = mmodels.Indexer()
+        indexer = mmodels.Indexer(workers=opts["workers"], batch_size=opts["batch_size"])
         if oldentries:
             indexer.index(mmodels.parse_changelog(oldentries))
 
-        with mmodels.parse_projectb() as changes:
-            indexer.index(changes)
+        source = mmodels.parse_projectb(max_rows=opts["max_rows"], max_rate=opts["max_rate"])
+        source.load_state()
+        indexer.index_projectb(source)
         indexer.flush()
@@ -11,6 +11,13 @@ import projectb.models as pmodels
 from backend import utils
 import datetime
 import time
+import collections
+import itertools
+import multiprocessing
+import threading
+import hashlib
+import struct
+import array
 import re
 import os
 import os.path
@@ -22,6 +29,15 @@ log = logging.getLogger(__name__)
 
 MINECHANGELOGS_CACHEDIR = getattr(settings, "MINECHANGELOGS_CACHEDIR", "./data/mc_cache")
 MINECHANGELOGS_INDEXDIR = getattr(settings, "MINECHANGELOGS_INDEXDIR", "./data/mc_index")
+MINECHANGELOGS_INDEX_WORKERS = getattr(settings, "MINECHANGELOGS_INDEX_WORKERS", 4)
+MINECHANGELOGS_INDEX_BATCH = getattr(settings, "MINECHANGELOGS_INDEX_BATCH", 5000)
+# Number of changes read from projectb in each keyset page, and in each fetch
+# from the server-side cursor
+MINECHANGELOGS_PROJECTB_PAGE_SIZE = getattr(settings, "MINECHANGELOGS_PROJECTB_PAGE_SIZE", 20000)
+MINECHANGELOGS_PROJECTB_FETCH_SIZE = getattr(settings, "MINECHANGELOGS_PROJECTB_FETCH_SIZE", 500)
+MINECHANGELOGS_HITSDIR = getattr(settings, "MINECHANGELOGS_HITSDIR", os.path.join(MINECHANGELOGS_CACHEDIR, "person_hits"))
+# Number of query result pages kept in memory
+MINECHANGELOGS_QUERY_CACHE_SIZE = getattr(settings, "MINECHANGELOGS_QUERY_CACHE_SIZE", 128)
 
 def parse_changelog(fname):
     """
@@ -64,10 +80,25 @@ class parse_projectb(object):
             for changelog_entry in changes:
                 process(changelog_entry)
     """
-    def __init__(self, statefile=None):
+    def __init__(self, statefile=None, page_size=None, fetch_size=None, max_rate=None, max_rows=None):
+        """
+        page_size and fetch_size default to MINECHANGELOGS_PROJECTB_PAGE_SIZE
+        and MINECHANGELOGS_PROJECTB_FETCH_SIZE.
+
+        If max_rate is set, reading is slowed down to at most that many rows
+        per second. If max_rows is set, the stream stops after that many
+        rows, and the next run resumes from the checkpoint.
+        """
         if statefile is None:
             statefile = os.path.join(MINECHANGELOGS_CACHEDIR, "index-checkpoint.json")
         self.statefile = statefile
+        self.page_size = page_size or MINECHANGELOGS_PROJECTB_PAGE_SIZE
+        self.fetch_size = fetch_size or MINECHANGELOGS_PROJECTB_FETCH_SIZE
+        self.max_rate = max_rate
+        self.max_rows = max_rows
+        # Map each year to the number of rows read and the seconds spent
+        # reading them
+        self.stats = {}
 
     def load_state(self):
         """
@@ -103,54 +134,113 @@ class parse_projectb(object):
         with utils.atomic_writer(self.statefile, mode="wt") as outfd:
             json.dump(state, outfd)
 
-    def get_changes(self):
+    def iter_pages(self, old_seen):
         """
-        Produce information about new uploads since the last run
-        """
-        cur = pmodels.cursor()
-
-        # Read last checkpoint state
-        old_seen = self.state.get("old_seen", None)
-        old_seen_ids = self.state.get("old_seen_ids", [])
+        Generate all the changes seen from old_seen onwards, as raw rows
+        ordered by (seen, id).
 
-        # Get the new changes, limited to the newest version
+        Rows are read in pages of page_size rows, each one continuing after
+        the (seen, id) of the last row of the previous page, so that no query
+        needs to hold the whole history.
+        """
         q = """
 SELECT c.id, c.seen, c.source, c.version,
        c.date, c.changedby, ch.changelog
   FROM changes c
   JOIN changelogs ch ON ch.id=c.changelog_id
 """
-        if old_seen is None:
-            cur.execute(q + " ORDER BY seen")
-            #cur.execute(q + " WHERE seen >= '2011-07-01 00:00:00' ORDER BY seen")
-        else:
-            cur.execute(q + " WHERE seen >= %s ORDER BY seen", (old_seen,))
+        start = time.time()
+        count = 0
+        last = None
+        while True:
+            if last is not None:
+                where, args = " WHERE (c.seen, c.id) > (%s, %s)", (last[1], last[0])
+            elif old_seen is not None:
+                where, args = " WHERE c.seen >= %s", (old_seen,)
+            else:
+                where, args = "", ()
+            page = 0
+            for row in pmodels.stream(q + where + " ORDER BY c.seen, c.id LIMIT %s", args + (self.page_size,), fetch_size=self.fetch_size):
+                yield row
+                last = row
+                page += 1
+            if page < self.page_size: break
+
+            # Throttle between pages, when requested
+            count += page
+            if self.max_rate:
+                delay = count / self.max_rate - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def iter_changes(self):
+        """
+        Produce information about new uploads since the last run, as (seen, id,
+        entry) tuples.
+
+        This does not change the checkpoint state: use mark_indexed to record
+        which entries have been processed.
+        """
+        # Read last checkpoint state
+        old_seen = self.state.get("old_seen", None)
+        old_seen_ids = frozenset(self.state.get("old_seen_ids", []))
 
         log.info("projectb: querying changelogs...")
         last_year = None
         last_year_count = 0
-        for id, seen, source, version, date, changedby, changelog in cur:
+        last_year_start = time.time()
+        count = 0
+
+        def log_year():
+            elapsed = time.time() - last_year_start
+            self.stats[last_year] = (last_year_count, elapsed)
+            log.info("projectb:%s: %d entries read in %.1fs (%.1f rows/s).", last_year, last_year_count, elapsed,
+                     last_year_count / elapsed if elapsed else 0)
+
+        pages = self.iter_pages(old_seen)
+        for id, seen, source, version, date, changedby, changelog in pages:
             if last_year is None or last_year != seen.year:
                 if last_year is None:
                     log.info("projectb: start of changelog stream.")
                 else:
-                    log.info("projectb:%d: %d entries read.", last_year, last_year_count)
+                    log_year()
                 last_year = seen.year
                 last_year_count = 0
+                last_year_start = time.time()
             # Skip the rare cases of partially processed multiple sources on the same instant
             if id in old_seen_ids: continue
-            if old_seen is None or seen > old_seen:
-                old_seen = seen
-                old_seen_ids = []
-            old_seen_ids.append(id)
 
             # Pass on the info to be indexed
-            yield "%s_%s" % (source, version), date, changedby, changelog
+            yield seen, id, ("%s_%s" % (source, version), date, changedby, changelog)
             last_year_count += 1
-        log.info("projectb:%s: %d entries read. End of changelogs stream.", last_year, last_year_count)
+            count += 1
+            if self.max_rows is not None and count >= self.max_rows:
+                log.info("projectb: stopping after %d entries.", count)
+                break
+        # Release the server-side cursor if we stopped early
+        pages.close()
+        if last_year is not None:
+            log_year()
+        log.info("projectb: end of changelogs stream.")
+
+    def mark_indexed(self, seen, id):
+        """
+        Record in the checkpoint state that the change with the given seen
+        time and id has been processed
+        """
+        old_seen = self.state.get("old_seen", None)
+        if old_seen is None or seen > old_seen:
+            self.state["old_seen"] = seen
+            self.state["old_seen_ids"] = []
+        self.state.setdefault("old_seen_ids", []).append(id)
 
-        self.state["old_seen"] = old_seen
-        self.state["old_seen_ids"] = old_seen_ids
+    def get_changes(self):
+        """
+        Produce information about new uploads since the last run
+        """
+        for seen, id, entry in self.iter_changes():
+            self.mark_indexed(seen, id)
+            yield entry
 
     def __enter__(self):
         self.load_state()
@@ -162,72 +252,200 @@ SELECT c.id, c.seen, c.source, c.version,
         return False
 
 
+re_split = re.compile(r"[^\w_@.-]+")
+re_ts = re.compile(r"(\w+\s*,\s*\d+\s+\w+\s*\d+\s+\d+:\d+:\d+)")
+
+
+def tokenise(s):
+    return re_split.split(s)
+
+
+def build_document(entry):
+    """
+    Build the Xapian document for a changelog entry.
+
+    Returns a (xid, document, ts) tuple.
+    """
+    tag, date, changedby, changelog = entry
+    xid = "XP" + tag
+    document = xapian.Document()
+    document.set_data(changelog + "\n" + " -- " + changedby + "  " + date)
+    #print date
+    # Ignore timezones for our purposes: dealing with timezones in
+    # python means dealing with one of the most demented pieces of code
+    # people have ever conceived, or otherwise it means introducing
+    # piles of external dependencies that maybe do the job. We can get
+    # away without timezones, it is a lucky thing and we take advantage
+    # of such strokes of luck.
+    ts = 0
+    mo = re_ts.match(date)
+    if mo:
+        #ts = time.mktime(time.strptime(mo.group(1), "%a, %d %b %Y %H:%M:%S"))
+        parsed = email.utils.parsedate_tz(mo.group(1))
+        if parsed is not None:
+            ts = time.mktime(parsed[:9])
+    #parsed = dateutil.parser.parse(date)
+    #parsed = email.utils.parsedate_tz(date)
+    #ts = time.mktime(parsed[:9]) - parsed[9]
+    document.add_value(0, xapian.sortable_serialise(ts))
+    document.add_term(xid)
+    pos = 0
+    lines = changelog.split("\n")[1:]
+    lines.append(changedby)
+    for l in lines:
+        for tok in tokenise(l):
+            tok = tok.strip(".-")
+            if not tok: continue
+            # see ircd (2.10.04+-1)
+            if len(tok) > 100: continue
+            if tok.isdigit(): continue
+            document.add_posting(tok, pos)
+            pos += 1
+    return xid, document, ts
+
+
+def _build_serialised(entries):
+    """
+    Build documents in a worker process, returning them serialised so that
+    they can be sent back to the indexer
+    """
+    res = []
+    for entry in entries:
+        xid, document, ts = build_document(entry)
+        res.append((xid, document.serialise(), ts))
+    return res
+
+
 class Indexer(object):
-    def __init__(self):
+    """
+    Add changelog entries to the minechangelogs index.
+
+    Documents are built by a pool of worker processes, and added to the
+    database in batches of batch_size documents, each committed in its own
+    transaction.
+    """
+    # Number of entries sent to a worker at a time
+    CHUNK_SIZE = 100
+
+    def __init__(self, workers=None, batch_size=None):
         if not os.path.isdir(MINECHANGELOGS_INDEXDIR):
             os.makedirs(MINECHANGELOGS_INDEXDIR)
+        self.workers = workers if workers is not None else MINECHANGELOGS_INDEX_WORKERS
+        self.batch_size = batch_size or MINECHANGELOGS_INDEX_BATCH
+        # Maximum number of chunks waiting to be built or added, which bounds
+        # the memory used when the producer is faster than the workers
+        self.queue_size = max(self.workers, 1) * 4
         self.xdb = xapian.WritableDatabase(MINECHANGELOGS_INDEXDIR, xapian.DB_CREATE_OR_OPEN)
         self.xdb.begin_transaction()
-        self.re_split = re.compile(r"[^\w_@.-]+")
-        self.re_ts = re.compile(r"(\w+\s*,\s*\d+\s+\w+\s*\d+\s+\d+:\d+:\d+)")
         self.max_ts = None
+        # Number of documents added since the last commit
+        self.pending = 0
 
     def tokenise(self, s):
-        return self.re_split.split(s)
+        return tokenise(s)
+
+    def _build(self, items):
+        """
+        Build the documents for (marker, entry) items, generating (marker, xid,
+        document, ts) tuples in input order
+        """
+        if self.workers <= 1:
+            for marker, entry in items:
+                yield (marker,) + build_document(entry)
+            return
+
+        items = iter(items)
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            # Queue of (markers, AsyncResult) for the chunks being built
+            queue = collections.deque()
+            while True:
+                chunk = list(itertools.islice(items, self.CHUNK_SIZE))
+                if chunk:
+                    markers = [x[0] for x in chunk]
+                    queue.append((markers, pool.apply_async(_build_serialised, ([x[1] for x in chunk],))))
+                    if len(queue) < self.queue_size:
+                        continue
+                elif not queue:
+                    break
+                markers, result = queue.popleft()
+                for marker, (xid, data, ts) in zip(markers, result.get()):
+                    yield marker, xid, xapian.Document.unserialise(data), ts
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def add(self, xid, document, ts):
+        """
+        Add a built document to the index
+        """
+        self.xdb.replace_document(xid, document)
+        if self.max_ts is None or ts > self.max_ts:
+            self.max_ts = ts
+        self.pending += 1
+
+    def _run(self, items, on_commit=None):
+        """
+        Index (marker, entry) items, committing every batch_size documents.
+
+        After each commit, on_commit is called, if given, with the list of the
+        markers of the entries committed.
+        """
+        markers = []
+        for marker, xid, document, ts in self._build(items):
+            self.add(xid, document, ts)
+            markers.append(marker)
+            if self.pending >= self.batch_size:
+                self.commit()
+                if on_commit is not None:
+                    on_commit(markers)
+                markers = []
+        if markers and on_commit is not None:
+            self.commit()
+            on_commit(markers)
 
     def index(self, entries):
-        count = 0
-        for tag, date, changedby, changelog in entries:
-            count += 1
-            #if count % 1000 == 0:
-            #    print date
-            xid = "XP" + tag
-            document = xapian.Document()
-            document.set_data(changelog + "\n" + " -- " + changedby + "  " + date)
-            #print date
-            # Ignore timezones for our purposes: dealing with timezones in
-            # python means dealing with one of the most demented pieces of code
-            # people have ever conceived, or otherwise it means introducing
-            # piles of external dependencies that maybe do the job. We can get
-            # away without timezones, it is a lucky thing and we take advantage
-            # of such strokes of luck.
-            ts = 0
-            mo = self.re_ts.match(date)
-            if mo:
-                #ts = time.mktime(time.strptime(mo.group(1), "%a, %d %b %Y %H:%M:%S"))
-                parsed = email.utils.parsedate_tz(mo.group(1))
-                if parsed is not None:
-                    ts = time.mktime(parsed[:9])
-            #parsed = dateutil.parser.parse(date)
-            #parsed = email.utils.parsedate_tz(date)
-            #ts = time.mktime(parsed[:9]) - parsed[9]
-            document.add_value(0, xapian.sortable_serialise(ts))
-            document.add_term(xid)
-            pos = 0
-            lines = changelog.split("\n")[1:]
-            lines.append(changedby)
-            for l in lines:
-                for tok in self.tokenise(l):
-                    tok = tok.strip(".-")
-                    if not tok: continue
-                    # see ircd (2.10.04+-1)
-                    if len(tok) > 100: continue
-                    if tok.isdigit(): continue
-                    document.add_posting(tok, pos)
-                    pos += 1
-            self.xdb.replace_document(xid, document)
-            if self.max_ts is None or ts > self.max_ts:
-                self.max_ts = ts
+        """
+        Index (tag, date, changedby, changelog) changelog entries
+        """
+        self._run((None, entry) for entry in entries)
 
-    def flush(self):
+    def index_projectb(self, source):
         """
-        Flush and save indexing information
+        Index new changes from a parse_projectb object, saving its checkpoint
+        state after each commit, so that an interrupted run can resume from
+        the last commit
         """
+        def on_commit(markers):
+            for seen, id in markers:
+                source.mark_indexed(seen, id)
+            source.save_state()
+            log.info("projectb: indexed up to %s", source.state["old_seen"])
+
+        self._run((((seen, id), entry) for seen, id, entry in source.iter_changes()), on_commit=on_commit)
+
+    def _save_metadata(self):
         if self.max_ts is None:
             self.xdb.set_metadata("max_ts", "0")
         else:
             self.xdb.set_metadata("max_ts", str(self.max_ts))
         self.xdb.set_metadata("last_indexed", str(time.time()))
+
+    def commit(self):
+        """
+        Commit the documents added so far, and start a new transaction
+        """
+        self._save_metadata()
+        self.xdb.commit_transaction()
+        self.xdb.begin_transaction()
+        self.pending = 0
+
+    def flush(self):
+        """
+        Flush and save indexing information
+        """
+        self._save_metadata()
         self.xdb.commit_transaction()
 
 def info():
@@ -240,12 +458,25 @@ def info():
         last_indexed = float(xdb.get_metadata("last_indexed")),
     )
 
-def query(keywords):
+def normalise_keywords(keywords):
     """
-    Get changelog entries matching the given keywords
+    Return a sorted tuple with the distinct non-empty keywords, with their
+    whitespace normalised
     """
-    xdb = xapian.Database(MINECHANGELOGS_INDEXDIR)
+    res = set()
+    for a in keywords:
+        a = " ".join(a.split())
+        if a: res.add(a)
+    return tuple(sorted(res))
+
+
+def build_query(keywords, since=None, until=None):
+    """
+    Build a Xapian query matching any of the given keywords, optionally
+    restricted to entries dated between the since and until timestamps.
 
+    Returns None if there are no keywords.
+    """
     q = None
     for a in keywords:
         a = a.strip()
@@ -259,6 +490,36 @@ def query(keywords):
             q = p
         else:
             q = xapian.Query(xapian.Query.OP_OR, q, p)
+    if q is None: return None
+
+    # Entry timestamps are stored in value slot 0
+    if since is not None and until is not None:
+        r = xapian.Query(xapian.Query.OP_VALUE_RANGE, 0, xapian.sortable_serialise(since), xapian.sortable_serialise(until))
+    elif since is not None:
+        r = xapian.Query(xapian.Query.OP_VALUE_GE, 0, xapian.sortable_serialise(since))
+    elif until is not None:
+        r = xapian.Query(xapian.Query.OP_VALUE_LE, 0, xapian.sortable_serialise(until))
+    else:
+        r = None
+    if r is not None:
+        q = xapian.Query(xapian.Query.OP_FILTER, q, r)
+    return q
+
+
+def _document_text(document):
+    data = document.get_data()
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    return data
+
+
+def query(keywords, since=None, until=None):
+    """
+    Get all changelog entries matching the given keywords
+    """
+    xdb = xapian.Database(MINECHANGELOGS_INDEXDIR)
+
+    q = build_query(keywords, since, until)
     if q is None: return
 
     enquire = xapian.Enquire(xdb)
@@ -271,5 +532,256 @@ def query(keywords):
         count = matches.size()
         if count == 0: break
         for m in matches:
-            yield m.document.get_data()
+            yield _document_text(m.document)
         first += 100
+
+
+class SearchResult(object):
+    """
+    One page of results of a minechangelogs query
+    """
+    def __init__(self, keywords, offset, limit, total=0, entries=None):
+        self.keywords = keywords
+        self.offset = offset
+        self.limit = limit
+        # Estimated total number of matching entries
+        self.total = total
+        # List of (timestamp, text) tuples
+        self.entries = entries if entries is not None else []
+
+    @property
+    def last(self):
+        """
+        1-based position of the last entry in this page
+        """
+        return self.offset + len(self.entries)
+
+    @property
+    def has_previous(self):
+        return self.offset > 0
+
+    @property
+    def has_next(self):
+        return self.last < self.total
+
+    def as_dict(self):
+        return {
+            "keywords": list(self.keywords),
+            "offset": self.offset,
+            "limit": self.limit,
+            "total": self.total,
+            "entries": [{"ts": ts, "text": text} for ts, text in self.entries],
+        }
+
+
+class QueryCache(object):
+    """
+    LRU cache of SearchResult objects
+    """
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            res = self.entries.get(key, None)
+            if res is not None:
+                self.entries.move_to_end(key)
+            return res
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+query_cache = QueryCache(MINECHANGELOGS_QUERY_CACHE_SIZE)
+
+
+def search(keywords, offset=0, limit=100, since=None, until=None):
+    """
+    Get one page of changelog entries matching the given keywords, newest
+    first, optionally restricted to entries dated between the since and until
+    timestamps.
+
+    Results are cached until the index is updated.
+    """
+    keywords = normalise_keywords(keywords)
+    xdb = xapian.Database(MINECHANGELOGS_INDEXDIR)
+    cache_key = (keywords, since, until, offset, limit, xdb.get_metadata("last_indexed"))
+    res = query_cache.get(cache_key)
+    if res is not None: return res
+
+    res = SearchResult(keywords, offset, limit)
+    q = build_query(keywords, since, until)
+    if q is not None:
+        enquire = xapian.Enquire(xdb)
+        enquire.set_query(q)
+        enquire.set_sort_by_value(0, True)
+        matches = enquire.get_mset(offset, limit)
+        res.total = matches.get_matches_estimated()
+        for m in matches:
+            res.entries.append((xapian.sortable_unserialise(m.document.get_value(0)), _document_text(m.document)))
+
+    query_cache.put(cache_key, res)
+    return res
+
+
+def person_keywords(person):
+    """
+    Return the keywords used by default to look for changelog entries of a
+    person
+    """
+    query = [
+        person.fullname,
+        person.email,
+    ]
+    if person.cn and person.mn and person.sn:
+        # some people don't use their middle names in changelogs
+        query.append("{} {}".format(person.cn, person.sn))
+    if person.uid:
+        query.append(person.uid)
+    return query
+
+
+class PersonHits(object):
+    """
+    Precomputed results of the default query for a person.
+
+    They are stored in MINECHANGELOGS_HITSDIR, one file per person, with a
+    header followed by the Xapian document IDs of the matching entries,
+    sorted newest first, as an array of 32 bit integers.
+
+    The header contains a hash of the keywords used, so that results are
+    ignored if the name or email of the person changed since they were
+    computed.
+    """
+    MAGIC = b"NMMCHIT1"
+    # magic, keywords sha1, first timestamp, last timestamp, count
+    HEADER = struct.Struct("<8s20sddI")
+
+    def __init__(self, keywords, docids, first=None, last=None):
+        self.keywords = keywords
+        self.docids = docids
+        # Timestamps of the oldest and newest entries
+        self.first = first
+        self.last = last
+
+    @classmethod
+    def keywords_hash(cls, keywords):
+        return hashlib.sha1("\n".join(keywords).encode("utf-8")).digest()
+
+    @classmethod
+    def pathname(cls, person):
+        return os.path.join(MINECHANGELOGS_HITSDIR, "{}.hits".format(person.pk))
+
+    @property
+    def count(self):
+        return len(self.docids)
+
+    @property
+    def first_date(self):
+        if self.first is None: return None
+        return datetime.datetime.fromtimestamp(self.first)
+
+    @property
+    def last_date(self):
+        if self.last is None: return None
+        return datetime.datetime.fromtimestamp(self.last)
+
+    @classmethod
+    def compute(cls, xdb, keywords):
+        """
+        Run the query for the given keywords on xdb, returning a PersonHits
+        with all its results
+        """
+        keywords = normalise_keywords(keywords)
+        docids = array.array("I")
+        q = build_query(keywords)
+        if q is None: return cls(keywords, docids)
+        enquire = xapian.Enquire(xdb)
+        enquire.set_query(q)
+        enquire.set_sort_by_value(0, True)
+        matches = enquire.get_mset(0, xdb.get_doccount())
+        first = last = None
+        for m in matches:
+            docids.append(m.docid)
+            ts = xapian.sortable_unserialise(m.document.get_value(0))
+            if last is None: last = ts
+            first = ts
+        return cls(keywords, docids, first, last)
+
+    def save(self, person):
+        with utils.atomic_writer(self.pathname(person), sync=False) as fd:
+            fd.write(self.HEADER.pack(self.MAGIC, self.keywords_hash(self.keywords),
+                                      self.first if self.first is not None else float("nan"),
+                                      self.last if self.last is not None else float("nan"),
+                                      len(self.docids)))
+            fd.write(self.docids.tobytes())
+
+    @classmethod
+    def load(cls, person, keywords=None):
+        """
+        Load the precomputed results for a person.
+
+        Returns None if there are none, or if they were computed for keywords
+        different than the given ones, or than the default ones for the
+        person.
+        """
+        if keywords is None:
+            keywords = person_keywords(person)
+        keywords = normalise_keywords(keywords)
+        try:
+            with open(cls.pathname(person), "rb") as fd:
+                buf = fd.read()
+        except FileNotFoundError:
+            return None
+        if len(buf) < cls.HEADER.size: return None
+        magic, khash, first, last, count = cls.HEADER.unpack_from(buf)
+        if magic != cls.MAGIC or khash != cls.keywords_hash(keywords): return None
+        docids = array.array("I")
+        docids.frombytes(buf[cls.HEADER.size:])
+        if len(docids) != count: return None
+        if first != first: first = None
+        if last != last: last = None
+        return cls(keywords, docids, first, last)
+
+    def search(self, offset=0, limit=100):
+        """
+        Return a page of results as a SearchResult, without running a query
+        """
+        res = SearchResult(self.keywords, offset, limit, total=self.count)
+        if not self.docids: return res
+        xdb = xapian.Database(MINECHANGELOGS_INDEXDIR)
+        for docid in self.docids[offset:offset + limit]:
+            try:
+                document = xdb.get_document(docid)
+            except xapian.DocNotFoundError:
+                continue
+            res.entries.append((xapian.sortable_unserialise(document.get_value(0)), _document_text(document)))
+        return res
+
+
+def update_person_hits(persons):
+    """
+    Precompute the results of the default query for all the given persons,
+    and remove the stale results of all other persons
+    """
+    xdb = xapian.Database(MINECHANGELOGS_INDEXDIR)
+    done = set()
+    for person in persons:
+        hits = PersonHits.compute(xdb, person_keywords(person))
+        hits.save(person)
+        done.add(os.path.basename(PersonHits.pathname(person)))
+
+    for fn in os.listdir(MINECHANGELOGS_HITSDIR) if os.path.isdir(MINECHANGELOGS_HITSDIR) else ():
+        if fn.endswith(".hits") and fn not in done:
+            os.unlink(os.path.join(MINECHANGELOGS_HITSDIR, fn))
+    log.info("minechangelogs: precomputed changelog entries for %d people", len(done))
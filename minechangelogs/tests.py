@@ -6,12 +6,20 @@ from backend import const
 from backend import models as bmodels
 from backend.unittest import PersonFixtureMixin
 from unittest.mock import patch
+from minechangelogs import models as mmodels
+from django.utils.timezone import utc
+import datetime
+import time
+import tempfile
+import shutil
+import os
 
 class TestMinechangelogs(PersonFixtureMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
         cls.url = reverse("minechangelogs_search", kwargs={ "key": cls.persons.dc.lookup_key })
+        cls.json_url = reverse("minechangelogs_search_json", kwargs={ "key": cls.persons.dc.lookup_key })
 
     @classmethod
     def __add_extra_tests__(cls):
@@ -31,7 +39,158 @@ class TestMinechangelogs(PersonFixtureMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response["Content-Type"], "text/plain")
 
+        response = client.post(self.url, data={"query": "test", "since": "2017-01-01", "page": 2})
+        self.assertEqual(response.status_code, 200)
+
+        response = client.get(self.json_url, data={"q": "test", "limit": 10})
+        self.assertEqual(response.status_code, 200)
+        decoded = response.json()
+        self.assertEqual(decoded["keywords"], ["test"])
+        self.assertEqual(decoded["limit"], 10)
+        self.assertIsInstance(decoded["entries"], list)
+
     def _test_forbidden(self, visitor):
         client = self.make_test_client(self.persons[visitor])
         response = client.get(self.url)
         self.assertPermissionDenied(response)
+        response = client.get(self.json_url)
+        self.assertPermissionDenied(response)
+
+
+def mock_stream(rows):
+    """
+    Emulate projectb.models.stream on the changes queries, ignoring their
+    text and only looking at their arguments
+    """
+    def stream(query, args=(), fetch_size=1000):
+        *where, limit = args
+        res = sorted(rows, key=lambda r: (r[1], r[0]))
+        if len(where) == 2:
+            res = [r for r in res if (r[1], r[0]) > tuple(where)]
+        elif len(where) == 1:
+            res = [r for r in res if r[1] >= where[0]]
+        return iter(res[:limit])
+    return stream
+
+
+class TestIndexer(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        base = datetime.datetime(2017, 1, 1, tzinfo=utc)
+        self.rows = []
+        for i in range(30):
+            self.rows.append((i, base + datetime.timedelta(days=i // 3), "pkg{}".format(i), "1.{}".format(i),
+                              "Sun, 01 Jan 2017 12:00:00 +0000", "Test Uploader <test@example.org>",
+                              "pkg{} (1.{}) unstable; urgency=low\n\n  * Fixed bug {}\n".format(i, i, i)))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def index(self, name, workers):
+        statefile = os.path.join(self.workdir, name + ".json")
+        with patch("minechangelogs.models.MINECHANGELOGS_INDEXDIR", os.path.join(self.workdir, name)):
+            with patch("projectb.models.stream", mock_stream(self.rows)):
+                indexer = mmodels.Indexer(workers=workers, batch_size=7)
+                source = mmodels.parse_projectb(statefile)
+                source.load_state()
+                indexer.index_projectb(source)
+                indexer.flush()
+        source = mmodels.parse_projectb(statefile)
+        source.load_state()
+        return source
+
+    def test_parallel(self):
+        serial = self.index("serial", 1)
+        parallel = self.index("parallel", 3)
+        self.assertEqual(serial.state, parallel.state)
+        self.assertEqual(parallel.state["old_seen_ids"], [27, 28, 29])
+
+        import xapian
+        xdb1 = xapian.Database(os.path.join(self.workdir, "serial"))
+        xdb2 = xapian.Database(os.path.join(self.workdir, "parallel"))
+        self.assertEqual(xdb1.get_doccount(), 30)
+        self.assertEqual(xdb2.get_doccount(), 30)
+        for term in ("XPpkg7_1.7", "Fixed", "test@example.org"):
+            self.assertEqual(xdb1.get_termfreq(term), xdb2.get_termfreq(term))
+
+    def test_resume(self):
+        self.index("index", 2)
+        # A new change seen at the same time as the last indexed ones is
+        # picked up, and nothing else is indexed again
+        self.rows.append((30, self.rows[-1][1], "new", "1", "Sun, 01 Jan 2017 12:00:00 +0000",
+                          "Test Uploader <test@example.org>", "new (1) unstable; urgency=low\n\n  * New\n"))
+        source = mmodels.parse_projectb(os.path.join(self.workdir, "index.json"))
+        source.load_state()
+        with patch("projectb.models.stream", mock_stream(self.rows)):
+            self.assertEqual([x[0] for x in source.get_changes()], ["new_1"])
+        self.assertEqual(source.state["old_seen_ids"], [27, 28, 29, 30])
+
+    def test_paging(self):
+        source = mmodels.parse_projectb(os.path.join(self.workdir, "paging.json"), page_size=4)
+        source.load_state()
+        with patch("projectb.models.stream", mock_stream(self.rows)):
+            self.assertEqual([x[1] for x in source.iter_changes()], list(range(30)))
+        self.assertEqual(source.stats[2017][0], 30)
+
+        # Stop after max_rows, and resume from the checkpoint
+        source = mmodels.parse_projectb(os.path.join(self.workdir, "paging.json"), page_size=4, max_rows=10)
+        source.load_state()
+        with patch("projectb.models.stream", mock_stream(self.rows)):
+            self.assertEqual(len(list(source.get_changes())), 10)
+            source.save_state()
+            source = mmodels.parse_projectb(os.path.join(self.workdir, "paging.json"), page_size=4)
+            source.load_state()
+            self.assertEqual([x[1] for x in source.iter_changes()], list(range(10, 30)))
+
+    def test_search(self):
+        # Entries are dated on consecutive days from 2017-01-01
+        for i, row in enumerate(self.rows):
+            row = list(row)
+            row[4] = (datetime.datetime(2017, 1, 1, 12) + datetime.timedelta(days=i)).strftime("%a, %d %b %Y %H:%M:%S +0000")
+            self.rows[i] = tuple(row)
+        self.index("index", 1)
+
+        with patch("minechangelogs.models.MINECHANGELOGS_INDEXDIR", os.path.join(self.workdir, "index")):
+            mmodels.query_cache.clear()
+            res = mmodels.search(["Fixed", "  Fixed  "], offset=0, limit=10)
+            self.assertEqual(res.keywords, ("Fixed",))
+            self.assertEqual(res.total, 30)
+            self.assertEqual(len(res.entries), 10)
+            self.assertTrue(res.has_next)
+            self.assertFalse(res.has_previous)
+            self.assertTrue(res.entries[0][1].startswith("pkg29 "))
+
+            # Results are cached
+            self.assertIs(mmodels.search(["Fixed"], offset=0, limit=10), res)
+
+            # Filter by date
+            since = time.mktime(datetime.datetime(2017, 1, 10).timetuple())
+            until = time.mktime(datetime.datetime(2017, 1, 15).timetuple())
+            res = mmodels.search(["Fixed"], offset=0, limit=10, since=since, until=until)
+            self.assertEqual([x[1].split()[0] for x in res.entries], ["pkg13", "pkg12", "pkg11", "pkg10", "pkg9"])
+
+    def test_person_hits(self):
+        class MockPerson(object):
+            pk = 1
+            fullname = "Test Uploader"
+            email = "test@example.org"
+            cn = mn = sn = uid = None
+        person = MockPerson()
+
+        self.index("index", 1)
+        with patch("minechangelogs.models.MINECHANGELOGS_INDEXDIR", os.path.join(self.workdir, "index")):
+            with patch("minechangelogs.models.MINECHANGELOGS_HITSDIR", os.path.join(self.workdir, "hits")):
+                mmodels.update_person_hits([person])
+                hits = mmodels.PersonHits.load(person)
+                self.assertEqual(hits.count, 30)
+                self.assertEqual(sorted(hits.docids), list(range(1, 31)))
+                self.assertIsNotNone(hits.first_date)
+
+                res = hits.search(offset=5, limit=10)
+                self.assertEqual(res.total, 30)
+                self.assertEqual(len(res.entries), 10)
+
+                # Precomputed results are not used if the keywords change
+                self.assertIsNone(mmodels.PersonHits.load(person, ["Someone Else"]))
+                person.email = "changed@example.org"
+                self.assertIsNone(mmodels.PersonHits.load(person))
@@ -4,4 +4,5 @@ from . import views
 urlpatterns = [
     # Show changelogs (minechangelogs)
     url(r'^search/(?P<key>[^/]+)?$', views.MineChangelogs.as_view(), name="minechangelogs_search"),
+    url(r'^search-json/(?P<key>[^/]+)?$', views.MineChangelogsJSON.as_view(), name="minechangelogs_search_json"),
 ]
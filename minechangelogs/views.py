@@ -2,11 +2,26 @@ from django.utils.translation import ugettext as _
 from django import http, template, forms
 from django.conf import settings
 from django.views.generic.edit import FormView
+from django.views.generic import View
 from django.core.exceptions import PermissionDenied
 import backend.models as bmodels
 import minechangelogs.models as mmodels
 from backend.mixins import VisitorMixin
+from apikeys.mixins import APIVisitorMixin
 import datetime
+import time
+
+
+def date_range(since, until):
+    """
+    Convert an inclusive range of dates, each of which can be None, to
+    timestamps comparable with the ones in the index
+    """
+    if since is not None:
+        since = time.mktime(since.timetuple())
+    if until is not None:
+        until = time.mktime((until + datetime.timedelta(days=1)).timetuple()) - 1
+    return since, until
 
 
 class MinechangelogsForm(forms.Form):
@@ -21,11 +36,25 @@ class MinechangelogsForm(forms.Form):
         label=_("Download"),
         help_text=_("Activate this field to download the changelog instead of displaying it"),
     )
+    since = forms.DateField(
+        required=False,
+        label=_("Since"),
+        help_text=_("Only show entries dated on or after this day (YYYY-MM-DD)"),
+    )
+    until = forms.DateField(
+        required=False,
+        label=_("Until"),
+        help_text=_("Only show entries dated on or before this day (YYYY-MM-DD)"),
+    )
+    # Set by the pagination buttons
+    page = forms.IntegerField(required=False, min_value=1)
 
 
 class MineChangelogs(VisitorMixin, FormView):
     template_name = "minechangelogs/minechangelogs.html"
     form_class = MinechangelogsForm
+    # Number of entries shown in each page
+    paginate_by = 100
 
     def check_permissions(self):
         super(MineChangelogs, self).check_permissions()
@@ -44,17 +73,7 @@ class MineChangelogs(VisitorMixin, FormView):
         res = super(MineChangelogs, self).get_initial()
         if not self.person:
             return res
-
-        query = [
-            self.person.fullname,
-            self.person.email,
-        ]
-        if self.person.cn and self.person.mn and self.person.sn:
-            # some people don't use their middle names in changelogs
-            query.append("{} {}".format(self.person.cn, self.person.sn))
-        if self.person.uid:
-            query.append(self.person.uid)
-        return {"query": "\n".join(query)}
+        return {"query": "\n".join(mmodels.person_keywords(self.person))}
 
     def get_context_data(self, **kw):
         ctx = super(MineChangelogs, self).get_context_data(**kw)
@@ -65,13 +84,35 @@ class MineChangelogs(VisitorMixin, FormView):
             info=info,
             person=self.person,
         )
+        # Show the precomputed results of the default query right away
+        if self.person and "result" not in ctx:
+            hits = mmodels.PersonHits.load(self.person)
+            if hits is not None:
+                result = hits.search(limit=self.paginate_by)
+                ctx.update(
+                    result=result,
+                    entries=[text for ts, text in result.entries],
+                    page=1,
+                    keywords=list(hits.keywords))
         return ctx
 
+    def search(self, keywords, page, since, until):
+        """
+        Get a page of results, using the precomputed ones when possible
+        """
+        offset = (page - 1) * self.paginate_by
+        if self.person and since is None and until is None:
+            hits = mmodels.PersonHits.load(self.person, keywords)
+            if hits is not None:
+                return hits.search(offset=offset, limit=self.paginate_by)
+        return mmodels.search(keywords, offset=offset, limit=self.paginate_by, since=since, until=until)
+
     def form_valid(self, form):
         query = form.cleaned_data["query"]
         keywords = [x.strip() for x in query.split("\n")]
-        entries = mmodels.query(keywords)
+        since, until = date_range(form.cleaned_data["since"], form.cleaned_data["until"])
         if form.cleaned_data["download"]:
+            entries = mmodels.query(keywords, since, until)
             def send_entries():
                 for e in entries:
                     yield e
@@ -83,8 +124,64 @@ class MineChangelogs(VisitorMixin, FormView):
                 res["Content-Disposition"] = 'attachment; filename=changelogs.txt'
             return res
 
-        entries = list(entries)
+        page = form.cleaned_data["page"] or 1
+        result = self.search(keywords, page, since, until)
         return self.render_to_response(self.get_context_data(
             form=form,
-            entries=entries,
+            result=result,
+            entries=[text for ts, text in result.entries],
+            page=page,
             keywords=keywords))
+
+
+class MineChangelogsJSON(APIVisitorMixin, View):
+    """
+    Query minechangelogs, returning one page of results as JSON.
+
+    Keywords are given as one or more q arguments, and default to the ones
+    used for the person in the URL. offset, limit, since and until
+    (YYYY-MM-DD) are also supported.
+    """
+    max_limit = 1000
+
+    def check_permissions(self):
+        super(MineChangelogsJSON, self).check_permissions()
+        if self.visitor is None:
+            raise PermissionDenied
+
+    def load_objects(self):
+        super(MineChangelogsJSON, self).load_objects()
+        key = self.kwargs.get("key", None)
+        if key:
+            self.person = bmodels.Person.lookup_or_404(key)
+        else:
+            self.person = None
+
+    def get(self, request, *args, **kw):
+        keywords = request.GET.getlist("q")
+        if not keywords and self.person:
+            keywords = mmodels.person_keywords(self.person)
+
+        dates = []
+        try:
+            offset = int(request.GET.get("offset", 0))
+            limit = min(int(request.GET.get("limit", 100)), self.max_limit)
+            for name in "since", "until":
+                val = request.GET.get(name, None)
+                dates.append(datetime.datetime.strptime(val, "%Y-%m-%d").date() if val else None)
+        except ValueError as e:
+            return http.JsonResponse({"e": str(e)}, status=400)
+        if offset < 0 or limit < 1:
+            return http.JsonResponse({"e": "invalid offset or limit"}, status=400)
+
+        since, until = date_range(*dates)
+        hits = None
+        if self.person and since is None and until is None:
+            hits = mmodels.PersonHits.load(self.person, keywords)
+        if hits is not None:
+            result = hits.search(offset=offset, limit=limit)
+        else:
+            result = mmodels.search(keywords, offset=offset, limit=limit, since=since, until=until)
+        res = result.as_dict()
+        res["last_indexed"] = mmodels.info()["last_indexed"]
+        return http.JsonResponse(res)
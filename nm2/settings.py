@@ -18,6 +18,12 @@ MANAGERS = ADMINS
 DEFAULT_FROM_EMAIL = "nm@debian.org"
 SERVER_EMAIL = "nm@debian.org"
 
+# Outgoing mail can be queued by setting EMAIL_BACKEND to
+# "backend.mailqueue.QueueBackend" in local_settings.py; this needs the
+# send_queued_mail command running (see README.md). Queued mail is delivered
+# through MAIL_QUEUE_BACKEND.
+MAIL_QUEUE_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -188,7 +194,7 @@ LOGGING = {
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
-            'class': 'django.utils.log.AdminEmailHandler'
+            'class': 'backend.log.AdminEmailHandler'
         }
     },
     'loggers': {
@@ -234,6 +240,9 @@ TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 # LDAP server to use to access Debian's official LDAP information
 LDAP_SERVER = "ldap://db.debian.org"
+# Directory where housekeeping keeps a snapshot of the people in LDAP, to
+# report what changed since the previous run; None disables it
+LDAP_SNAPSHOT_DIR = None
 
 # Location of a keyring-maint mirror
 KEYRINGS = os.path.join(DATA_DIR, "keyrings")
@@ -241,6 +250,20 @@ KEYRINGS = os.path.join(DATA_DIR, "keyrings")
 # Location of temporary keyrings used by keycheck
 KEYRINGS_TMPDIR = os.path.join(DATA_DIR, "tmp_keyrings")
 
+# Location of the index of the fingerprints in each keyring
+KEYRINGS_INDEXDIR = os.path.join(DATA_DIR, "keyring_index")
+if TESTING:
+    # Do not leave indexes of the keyrings used by tests in DATA_DIR
+    import tempfile, atexit, shutil
+    KEYRINGS_INDEXDIR = tempfile.mkdtemp(prefix="nm-test-keyring-index-")
+    atexit.register(shutil.rmtree, KEYRINGS_INDEXDIR, True)
+
+# Number of pre-warmed GnuPG homedirs kept by each server process
+KEYRINGS_POOL_SIZE = 64
+
+# Maximum number of gpg processes each server process runs at the same time
+KEYRINGS_POOL_WORKERS = 4
+
 # Keyring used to validate signatures of keyring-maint members
 KEYRING_MAINT_KEYRING = os.path.join(DATA_DIR, "keyring-maint.gpg")
 
@@ -250,9 +273,31 @@ KEYRING_MAINT_GIT_REPO = os.path.join(DATA_DIR, "keyring-maint.git")
 # Work paths used by minechangelogs (indexing cache and the index itself)
 MINECHANGELOGS_CACHEDIR = os.path.join(DATA_DIR, "mc_cache")
 MINECHANGELOGS_INDEXDIR = os.path.join(DATA_DIR, "mc_index")
+# Number of worker processes used to build minechangelogs documents
+MINECHANGELOGS_INDEX_WORKERS = 4
+# Number of documents indexed between minechangelogs commits and checkpoints
+MINECHANGELOGS_INDEX_BATCH = 5000
+# Number of changes read from projectb per query, and per server-side cursor
+# fetch, when indexing minechangelogs
+MINECHANGELOGS_PROJECTB_PAGE_SIZE = 20000
+MINECHANGELOGS_PROJECTB_FETCH_SIZE = 500
+# Precomputed minechangelogs results for DDs and applicants
+MINECHANGELOGS_HITSDIR = os.path.join(MINECHANGELOGS_CACHEDIR, "person_hits")
+# Number of minechangelogs query result pages cached in memory
+MINECHANGELOGS_QUERY_CACHE_SIZE = 128
+
+# State of the incremental import of last upload dates from projectb
+PROJECTB_LAST_UPLOAD_STATEFILE = os.path.join(DATA_DIR, "projectb_last_upload.json")
 
 # Directory where site backups are stored
 HOUSEKEEPING_ROOT = os.path.join(DATA_DIR, "housekeeping")
+# Maximum number of housekeeping tasks run at the same time by
+# ./manage.py run_housekeeping
+HOUSEKEEPING_WORKERS = 4
+# Only back up the people that changed since the last full backup, doing a
+# full backup every BACKUP_FULL_INTERVAL days
+BACKUP_INCREMENTAL = False
+BACKUP_FULL_INTERVAL = 7
 
 # Directory where applicant mailboxes are stored
 PROCESS_MAILBOX_DIR = os.path.join(DATA_DIR, "applicant-mailboxes")
@@ -75,6 +75,11 @@ class Person(VisitPersonMixin, TemplateView):
             show_new_change_warning=show_new_change_warning,
         )
 
+        # Precomputed minechangelogs results, for the people who can see them
+        if self.visitor is not None:
+            import minechangelogs.models as mmodels
+            ctx["changelog_hits"] = mmodels.PersonHits.load(self.person)
+
         if self.person.bio:
             ctx["bio_html"] = markdown.markdown(self.person.bio, safe_mode="escape")
         else:
@@ -17,3 +17,13 @@ class WarnProcessesStuckEarly(hk.Task):
     def run_main(self, stage):
         stuck_cutoff = now() - datetime.timedelta(days=7)
         ping_stuck_processes(stuck_cutoff, self.hk.housekeeper.user)
+
+
+class RefreshAMDashboard(hk.Task):
+    """
+    Recompute the AM dashboard entries, to pick up changes made outside of the
+    process operations, like edits in the admin interface
+    """
+    def run_main(self, stage):
+        import process.models as pmodels
+        pmodels.AMDashboardEntry.objects.rebuild()
@@ -31,5 +31,6 @@ process. Feel free to reapply in the future.
             process.closed_by = audit_author
             process.closed_time = logdate
             process.save()
+            process.update_am_dashboard()
 
 
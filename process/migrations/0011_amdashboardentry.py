@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process', '0010_process_hide_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AMDashboardEntry',
+            fields=[
+                ('process', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='am_dashboard_entry', serialize=False, to='process.Process')),
+                ('bucket', models.CharField(choices=[('current', 'Processes needing attention'), ('approved', 'Processes approved but not yet closed'), ('hidden', 'Not shown')], max_length=16)),
+                ('visible_from', models.DateTimeField(blank=True, help_text='Do not show the process in the dashboard before this time', null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -2,9 +2,106 @@ from django.core.exceptions import PermissionDenied
 from django.shortcuts import redirect, get_object_or_404
 from django.utils.timezone import now
 from backend.mixins import VisitPersonMixin
+from backend.utils import cached_property
 from . import models as pmodels
 
-def compute_process_status(process, visitor, visit_perms=None):
+def compute_processes_status(processes, visitor, visit_perms=None, resolver=None):
+    """
+    Compute the status of many processes at once, using a fixed number of
+    queries regardless of the number of processes.
+
+    If resolver is a PermissionResolver, the current AM assignments are taken
+    from it, and shared with the permission checks made in the same request.
+
+    Returns a list of (process, status) pairs, in the same order as
+    processes, where status is the dict returned by compute_process_status.
+    """
+    from django.db.models import Q
+    from process.models import REQUIREMENT_TYPES_DICT
+    processes = list(processes)
+    by_id = {p.pk: p for p in processes}
+    if not by_id: return []
+
+    # Requirements, grouped by process
+    requirements = {pk: {} for pk in by_id}
+    advocate_reqs = {}
+    for r in pmodels.Requirement.objects.filter(process_id__in=by_id.keys()).select_related("approved_by"):
+        r.process = by_id[r.process_id]
+        requirements[r.process_id][r.type] = r
+        if r.type == "advocate":
+            advocate_reqs[r.pk] = r.process_id
+
+    # Advocates, from the statements of the advocate requirements
+    advocates = {pk: set() for pk in by_id}
+    if advocate_reqs:
+        for s in pmodels.Statement.objects.filter(requirement_id__in=advocate_reqs.keys()).select_related("uploaded_by"):
+            advocates[advocate_reqs[s.requirement_id]].add(s.uploaded_by)
+
+    # Log entries visible to the visitor, grouped by process
+    logs = {pk: [] for pk in by_id}
+    log = pmodels.Log.objects.filter(process_id__in=by_id.keys()).order_by("logdate", "pk").select_related("changed_by", "requirement")
+    if not (visitor is not None and visitor.is_admin) and (not visit_perms or "view_private_log" not in visit_perms):
+        log = log.filter(Q(is_public=True) | Q(changed_by=visitor))
+    for l in log:
+        l.process = by_id[l.process_id]
+        logs[l.process_id].append(l)
+
+    # Current AM assignments
+    am_assignments = {}
+    if resolver is not None:
+        resolver.prefetch(processes)
+        for process in processes:
+            am_assignments[process.pk] = resolver.current_am_assignment(process)
+    else:
+        for a in pmodels.AMAssignment.objects.filter(process_id__in=by_id.keys(), unassigned_by__isnull=True).select_related("am", "am__person"):
+            a.process = by_id[a.process_id]
+            am_assignments[a.process_id] = a
+
+    sort_key = lambda x: REQUIREMENT_TYPES_DICT[x.type].sort_order
+    res = []
+    for process in processes:
+        reqs = requirements[process.pk]
+        rok = [r for r in reqs.values() if r.approved_by_id is not None]
+        rnok = [r for r in reqs.values() if r.approved_by_id is None]
+        log = logs[process.pk]
+        am_assignment = am_assignments.get(process.pk)
+
+        # Check the foreign key ids, to avoid a query per process
+        if process.closed_by_id is not None:
+            summary = "Closed"
+        elif process.frozen_by_id is not None:
+            if process.approved_by_id is not None:
+                summary = "Approved"
+            else:
+                summary = "Frozen for review"
+        elif process.approved_by_id is not None:
+            summary = "Approved"
+        elif not rnok:
+            summary = "Waiting for review"
+        elif am_assignment is not None:
+            if am_assignment.paused:
+                summary = "AM Hold"
+            else:
+                summary = "AM"
+        else:
+            summary = "Collecting requirements"
+
+        res.append((process, {
+            "requirements": reqs,
+            "requirements_sorted": sorted(reqs.values(), key=sort_key),
+            "requirements_ok": sorted(rok, key=sort_key),
+            "requirements_missing": sorted(rnok, key=sort_key),
+            "log_first": log[0] if log else None,
+            "log_last": log[-1] if log else None,
+            "log": log,
+            "advocates": sorted(advocates[process.pk], key=lambda x:x.uid),
+            "am_assignment": am_assignment,
+            "summary": summary,
+        }))
+    return res
+
+
+def compute_process_status(process, visitor, visit_perms=None, resolver=None):
     """
     Return a dict with the process status:
     {
@@ -12,67 +109,23 @@ def compute_process_status(process, visitor, visit_perms=None):
         "requirements_missing": [list of Requirement],
         "log_first": Log,
         "log_last": Log,
+        "am_assignment": current AMAssignment or None,
     }
     """
-    from process.models import REQUIREMENT_TYPES_DICT
-    rok = []
-    rnok = []
-    requirements = {}
-    for r in process.requirements.all():
-        if r.approved_by:
-            rok.append(r)
-        else:
-            rnok.append(r)
-        requirements[r.type] = r
+    return compute_processes_status([process], visitor, visit_perms, resolver=resolver)[0][1]
 
-    # Compute the list of advocates
-    adv = requirements.get("advocate", None)
-    advocates = set()
-    if adv is not None:
-        for s in adv.statements.all():
-            advocates.add(s.uploaded_by)
 
-    log = process.log.order_by("logdate").select_related("changed_by", "requirement")
-    if not (visitor is not None and visitor.is_admin) and (not visit_perms or "view_private_log" not in visit_perms):
-        from django.db.models import Q
-        log = log.filter(Q(is_public=True) | Q(changed_by=visitor))
-    log = list(log)
-
-    am_assignment = process.current_am_assignment
-
-    if process.closed:
-        summary = "Closed"
-    elif process.frozen_by:
-        if process.approved_by:
-            summary = "Approved"
-        else:
-            summary = "Frozen for review"
-    elif process.approved_by:
-        summary = "Approved"
-    elif not rnok:
-        summary = "Waiting for review"
-    elif am_assignment is not None:
-        if am_assignment.paused:
-            summary = "AM Hold"
-        else:
-            summary = "AM"
-    else:
-        summary = "Collecting requirements"
-
-    return {
-        "requirements": requirements,
-        "requirements_sorted": sorted(list(requirements.values()), key=lambda x: REQUIREMENT_TYPES_DICT[x.type].sort_order),
-        "requirements_ok": sorted(rok, key=lambda x: REQUIREMENT_TYPES_DICT[x.type].sort_order),
-        "requirements_missing": sorted(rnok, key=lambda x: REQUIREMENT_TYPES_DICT[x.type].sort_order),
-        "log_first": log[0] if log else None,
-        "log_last": log[-1] if log else None,
-        "log": log,
-        "advocates": sorted(advocates, key=lambda x:x.uid),
-        "summary": summary,
-    }
+class PermissionResolverMixin(object):
+    """
+    Add self.permission_resolver, to share the facts used to compute
+    permissions over processes and requirements for the whole request
+    """
+    @cached_property
+    def permission_resolver(self):
+        return pmodels.PermissionResolver(self.visitor)
 
 
-class VisitProcessMixin(VisitPersonMixin):
+class VisitProcessMixin(PermissionResolverMixin, VisitPersonMixin):
     """
     Visit a person process. Adds self.person, self.process and
     self.visit_perms with the permissions the visitor has over the person
@@ -81,7 +134,7 @@ class VisitProcessMixin(VisitPersonMixin):
         return self.process.person
 
     def get_visit_perms(self):
-        return self.process.permissions_of(self.visitor)
+        return self.process.permissions_of(self.visitor, resolver=self.permission_resolver)
 
     def get_process(self):
         return get_object_or_404(pmodels.Process.objects.select_related("person"), pk=self.kwargs["pk"])
@@ -97,7 +150,7 @@ class VisitProcessMixin(VisitPersonMixin):
         return ctx
 
     def compute_process_status(self):
-        return compute_process_status(self.process, self.visitor, self.visit_perms)
+        return compute_process_status(self.process, self.visitor, self.visit_perms, resolver=self.permission_resolver)
 
 
 class RequirementMixin(VisitProcessMixin):
@@ -111,11 +164,11 @@ class RequirementMixin(VisitProcessMixin):
             return self.kwargs.get("type", None)
 
     def get_requirement(self):
-        process = get_object_or_404(pmodels.Process, pk=self.kwargs["pk"])
-        return get_object_or_404(pmodels.Requirement, process=process, type=self.get_requirement_type())
+        return get_object_or_404(pmodels.Requirement.objects.select_related("process", "process__person"),
+                                 process_id=self.kwargs["pk"], type=self.get_requirement_type())
 
     def get_visit_perms(self):
-        return self.requirement.permissions_of(self.visitor)
+        return self.requirement.permissions_of(self.visitor, resolver=self.permission_resolver)
 
     def get_process(self):
         return self.requirement.process
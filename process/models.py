@@ -6,6 +6,7 @@ from django.db import models, transaction
 import backend.models as bmodels
 from backend.utils import cached_property
 from backend import const
+import datetime
 import re
 import os
 from collections import namedtuple
@@ -26,20 +27,23 @@ REQUIREMENT_TYPES_DICT = { x.tag: x for x in REQUIREMENT_TYPES }
 
 
 class ProcessVisitorPermissions(bmodels.PersonVisitorPermissions):
-    def __init__(self, process, visitor):
-        super(ProcessVisitorPermissions, self).__init__(process.person, visitor)
+    def __init__(self, process, visitor, resolver=None):
+        if resolver is None:
+            resolver = PermissionResolver(visitor)
+        super(ProcessVisitorPermissions, self).__init__(process.person, visitor, resolver=resolver)
         self.process = process
-        self.process_frozen = self.process.frozen_by is not None
-        self.process_approved = self.process.approved_by is not None
+        self.process_frozen = self.process.frozen_by_id is not None
+        self.process_approved = self.process.approved_by_id is not None
+        self.process_closed = self.process.closed_by_id is not None
 
-        self.process_has_am_ok = self.process.requirements.filter(type="am_ok").exists()
-        self.current_am_assignment = self.process.current_am_assignment
+        self.process_has_am_ok = resolver.has_am_ok(self.process)
+        self.current_am_assignment = resolver.current_am_assignment(self.process)
         if self.current_am_assignment is not None:
             self.is_current_am = self.current_am_assignment.am.person == self.visitor
         else:
             self.is_current_am = False
 
-        if not self.process.closed and self.visitor is not None and not self.visitor.pending:
+        if not self.process_closed and self.visitor is not None and not self.visitor.pending:
             self.add("add_log")
 
         if self.visitor is None:
@@ -47,7 +51,7 @@ class ProcessVisitorPermissions(bmodels.PersonVisitorPermissions):
         elif self.visitor.is_admin:
             self.add("view_mbox")
             self.add("view_private_log")
-            if not self.process.closed:
+            if not self.process_closed:
                 if not self.process_frozen:
                     self.add("proc_freeze")
                     if self.process_has_am_ok:
@@ -59,11 +63,11 @@ class ProcessVisitorPermissions(bmodels.PersonVisitorPermissions):
                     self.add("proc_unapprove")
                 else:
                     self.update(("proc_unfreeze", "proc_approve"))
-                if not self.process.closed:
+                if not self.process_closed:
                     self.add("proc_close")
         elif self.visitor == self.person:
             self.add("view_mbox")
-            if not self.process.closed:
+            if not self.process_closed:
                 self.add("proc_close")
         elif self.visitor.is_am:
             self.add("view_mbox")
@@ -80,24 +84,24 @@ class ProcessVisitorPermissions(bmodels.PersonVisitorPermissions):
 
 
 class RequirementVisitorPermissions(ProcessVisitorPermissions):
-    def __init__(self, requirement, visitor):
-        super(RequirementVisitorPermissions, self).__init__(requirement.process, visitor)
+    def __init__(self, requirement, visitor, resolver=None):
+        super(RequirementVisitorPermissions, self).__init__(requirement.process, visitor, resolver=resolver)
         self.requirement = requirement
 
         if self.visitor is None:
             pass
         elif self.visitor.is_admin:
-            if not self.process.closed:
+            if not self.process_closed:
                 if self.requirement.type != "keycheck":
                     self.add("edit_statements")
-                self.add("req_unapprove" if self.requirement.approved_by else "req_approve")
+                self.add("req_unapprove" if self.requirement.approved_by_id else "req_approve")
         elif not self.process_frozen:
             if self.requirement.type == "intent":
                 if self.visitor == self.person: self.add("edit_statements")
-                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by else "req_approve")
+                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by_id else "req_approve")
             elif self.requirement.type == "sc_dmup":
                 if self.visitor == self.person: self.add("edit_statements")
-                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by else "req_approve")
+                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by_id else "req_approve")
             elif self.requirement.type == "advocate":
                 if self.process.applying_for == const.STATUS_DC_GA:
                     if self.visitor.status in (const.STATUS_DM, const.STATUS_DM_GA, const.STATUS_DD_NU, const.STATUS_DD_U):
@@ -114,13 +118,132 @@ class RequirementVisitorPermissions(ProcessVisitorPermissions):
                 elif self.process.applying_for == const.STATUS_DD_U:
                     if self.visitor.status in (const.STATUS_DD_NU, const.STATUS_DD_U):
                         self.add("edit_statements")
-                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by else "req_approve")
+                if self.visitor.is_dd: self.add("req_unapprove" if self.requirement.approved_by_id else "req_approve")
             elif self.requirement.type == "am_ok":
                 if self.current_am_assignment:
                     if self.is_current_am:
                         self.add("edit_statements")
                     elif self.visitor.is_am:
-                        self.add("req_unapprove" if self.requirement.approved_by else "req_approve")
+                        self.add("req_unapprove" if self.requirement.approved_by_id else "req_approve")
+
+
+class ActiveProcess(namedtuple("ActiveProcess", ("applying_for", "frozen"))):
+    """
+    Summary of an open process, used when computing person permissions
+    """
+    __slots__ = ()
+
+
+class PermissionResolver(object):
+    """
+    Compute the permissions of a visitor over processes and requirements,
+    memoising the facts that they depend on.
+
+    A resolver is meant to live for the duration of a request: computing the
+    permissions of a requirement after those of its process does not query
+    the database again. Use prefetch() to load the facts about many processes
+    with a fixed number of queries.
+    """
+    def __init__(self, visitor):
+        self.visitor = visitor
+        # Map person IDs to a list of ActiveProcess
+        self._active_processes = {}
+        # Map process IDs to True if the process has an am_ok requirement
+        self._has_am_ok = {}
+        # Map process IDs to their current AMAssignment, or None
+        self._am_assignments = {}
+        self._process_perms = {}
+        self._requirement_perms = {}
+
+    def _prefetch_persons(self, person_ids):
+        person_ids = [x for x in person_ids if x not in self._active_processes]
+        if not person_ids: return
+        for pk in person_ids:
+            self._active_processes[pk] = []
+        for person_id, applying_for, frozen_by_id in Process.objects.filter(person_id__in=person_ids, closed_time__isnull=True) \
+                                                            .values_list("person_id", "applying_for", "frozen_by_id"):
+            self._active_processes[person_id].append(ActiveProcess(applying_for, frozen_by_id is not None))
+
+    def prefetch(self, processes):
+        """
+        Load the facts about the given processes and their applicants, using a
+        fixed number of queries
+        """
+        by_id = {p.pk: p for p in processes if p.pk not in self._has_am_ok}
+        if not by_id: return
+        process_ids = list(by_id.keys())
+
+        self._prefetch_persons(set(p.person_id for p in by_id.values()))
+
+        with_am_ok = frozenset(Requirement.objects.filter(process_id__in=process_ids, type="am_ok").values_list("process_id", flat=True))
+        for pk in process_ids:
+            self._has_am_ok[pk] = pk in with_am_ok
+            self._am_assignments[pk] = None
+
+        for a in AMAssignment.objects.filter(process_id__in=process_ids, unassigned_by__isnull=True).select_related("am", "am__person"):
+            a.process = by_id[a.process_id]
+            self._am_assignments[a.process_id] = a
+
+    def active_processes(self, person):
+        """
+        Return the list of ActiveProcess of a person
+        """
+        self._prefetch_persons((person.pk,))
+        return self._active_processes[person.pk]
+
+    def has_am_ok(self, process):
+        """
+        Check if the process has an am_ok requirement
+        """
+        self.prefetch((process,))
+        return self._has_am_ok[process.pk]
+
+    def current_am_assignment(self, process):
+        """
+        Return the current AMAssignment of a process, or None if there is none
+        """
+        self.prefetch((process,))
+        return self._am_assignments[process.pk]
+
+    def process(self, process):
+        """
+        Return the ProcessVisitorPermissions for a process
+        """
+        res = self._process_perms.get(process.pk)
+        if res is None:
+            res = self._process_perms[process.pk] = ProcessVisitorPermissions(process, self.visitor, resolver=self)
+        return res
+
+    def requirement(self, requirement):
+        """
+        Return the RequirementVisitorPermissions for a requirement
+        """
+        res = self._requirement_perms.get(requirement.pk)
+        if res is None:
+            res = self._requirement_perms[requirement.pk] = RequirementVisitorPermissions(requirement, self.visitor, resolver=self)
+        return res
+
+    def processes(self, processes):
+        """
+        Return a dict mapping process IDs to the ProcessVisitorPermissions of
+        each of the given processes, using a fixed number of queries
+        """
+        processes = list(processes)
+        self.prefetch(processes)
+        return {p.pk: self.process(p) for p in processes}
+
+    def requirements(self, requirements):
+        """
+        Return a dict mapping requirement IDs to the
+        RequirementVisitorPermissions of each of the given requirements, using
+        a fixed number of queries.
+
+        The requirements should have their process and process.person already
+        loaded, for example with select_related("process", "process__person").
+        """
+        requirements = list(requirements)
+        self.prefetch(r.process for r in requirements)
+        return {r.pk: self.requirement(r) for r in requirements}
 
 
 class ProcessManager(models.Manager):
@@ -200,6 +323,8 @@ class ProcessManager(models.Manager):
         for req in requirements:
             r = Requirement.objects.create(process=res, type=req)
 
+        res.update_am_dashboard()
+
         return res
 
     def in_early_stage(self):
@@ -272,10 +397,19 @@ class Process(models.Model):
         except AMAssignment.DoesNotExist:
             return None
 
-    def permissions_of(self, visitor):
+    def update_am_dashboard(self):
+        """
+        Recompute the AM dashboard entry for this process, after its state
+        changed
+        """
+        AMDashboardEntry.objects.refresh([self])
+
+    def permissions_of(self, visitor, resolver=None):
         """
         Compute which ProcessVisitorPermissions \a visitor has over this process
         """
+        if resolver is not None:
+            return resolver.process(self)
         return ProcessVisitorPermissions(self, visitor)
 
     def add_log(self, changed_by, logtext, is_public=False, action="", logdate=None):
@@ -315,6 +449,19 @@ class Process(models.Model):
             outfile.seek(0)
             return outfile.read()
 
+    def get_statements_digest(self):
+        """
+        Return a string that changes when the output of get_statements_as_mbox
+        changes
+        """
+        import hashlib
+        digest = hashlib.sha1()
+        for row in Statement.objects.filter(requirement__process=self).order_by("pk").values_list(
+                "pk", "requirement__type", "uploaded_time", "statement",
+                "uploaded_by__cn", "uploaded_by__mn", "uploaded_by__sn", "uploaded_by__email"):
+            digest.update(repr(row).encode("utf-8"))
+        return digest.hexdigest()
+
     @property
     def archive_email(self):
         return "archive-{}@nm.debian.org".format(self.pk)
@@ -379,10 +526,12 @@ class Requirement(models.Model):
             conditional_escape(self.get_absolute_url()),
             conditional_escape(REQUIREMENT_TYPES_DICT[self.type].desc)))
 
-    def permissions_of(self, visitor):
+    def permissions_of(self, visitor, resolver=None):
         """
         Compute which permissions \a visitor has over this requirement
         """
+        if resolver is not None:
+            return resolver.requirement(self)
         return RequirementVisitorPermissions(self, visitor)
 
     def add_log(self, changed_by, logtext, is_public=False, action="", logdate=None):
@@ -524,7 +673,7 @@ class Requirement(models.Model):
                             "remarks": " ".join(sorted(keycheck.errors)) if keycheck.errors else "ok",
                         },
                         "uids": uids,
-                        "updated": key.check_sigs_updated,
+                        "updated": keycheck.updated,
                     }
 
                     if keycheck.errors:
@@ -631,3 +780,133 @@ class Log(models.Model):
             return Log.objects.filter(logdate__lt=self.logdate, process=self.process).order_by("-logdate")[0]
         except IndexError:
             return None
+
+
+class AMDashboardEntryManager(models.Manager):
+    def visible(self, when=None):
+        """
+        Return the entries that the AM dashboard shows at the given time
+        (default: now)
+        """
+        if when is None: when = now()
+        return self.get_queryset() \
+                .filter(process__closed_time__isnull=True) \
+                .exclude(bucket=AMDashboardEntry.BUCKET_HIDDEN) \
+                .filter(models.Q(visible_from__isnull=True) | models.Q(visible_from__lte=when))
+
+    def _compute(self, process, requirements, has_am):
+        """
+        Compute the (bucket, visible_from) pair for a process
+        """
+        if process.frozen_by_id is not None or process.approved_by_id is not None:
+            if process.approved_by_id is not None:
+                return AMDashboardEntry.BUCKET_APPROVED, None
+            return AMDashboardEntry.BUCKET_CURRENT, None
+
+        visible_from = process.hide_until
+
+        if process.applying_for in (const.STATUS_EMERITUS_DD, const.STATUS_REMOVED_DD):
+            return AMDashboardEntry.BUCKET_CURRENT, visible_from
+
+        for_ga = process.applying_for in (const.STATUS_DC_GA, const.STATUS_DM_GA)
+
+        needs_am_report = False
+        for req in requirements:
+            if req.type == "intent":
+                if not req.approved_by_id: return AMDashboardEntry.BUCKET_HIDDEN, None
+                # Hide all processes with a statement of intent approved less
+                # than 4 days ago
+                if not for_ga and req.approved_time:
+                    shown = req.approved_time + datetime.timedelta(days=4)
+                    if visible_from is None or shown > visible_from:
+                        visible_from = shown
+            elif req.type == "sc_dmup":
+                if not req.approved_by_id: return AMDashboardEntry.BUCKET_HIDDEN, None
+            elif req.type == "advocate":
+                if not req.approved_by_id: return AMDashboardEntry.BUCKET_HIDDEN, None
+            elif req.type == "am_ok":
+                needs_am_report = req.approved_by_id is None
+
+        if needs_am_report and has_am:
+            return AMDashboardEntry.BUCKET_HIDDEN, None
+
+        return AMDashboardEntry.BUCKET_CURRENT, visible_from
+
+    def refresh(self, processes):
+        """
+        Recompute the dashboard entries of the given processes, using a fixed
+        number of queries per BULK_BATCH_SIZE entries created or changed
+        """
+        by_id = {p.pk: p for p in processes}
+        if not by_id: return
+
+        requirements = {pk: [] for pk in by_id}
+        for r in Requirement.objects.filter(process_id__in=by_id.keys(), type__in=("intent", "sc_dmup", "advocate", "am_ok")):
+            requirements[r.process_id].append(r)
+
+        assigned = frozenset(AMAssignment.objects.filter(process_id__in=by_id.keys(), unassigned_by__isnull=True)
+                                                 .values_list("process_id", flat=True))
+
+        existing = {e.process_id: e for e in self.filter(process_id__in=by_id.keys())}
+        closed = []
+        created = []
+        changed = []
+        # bulk_create and bulk_update do not set auto_now fields
+        updated = now()
+        for pk, process in by_id.items():
+            if process.closed_time is not None:
+                if pk in existing: closed.append(pk)
+                continue
+            bucket, visible_from = self._compute(process, requirements[pk], pk in assigned)
+            entry = existing.get(pk)
+            if entry is None:
+                created.append(AMDashboardEntry(process=process, bucket=bucket, visible_from=visible_from, updated=updated))
+            elif entry.bucket != bucket or entry.visible_from != visible_from:
+                entry.bucket = bucket
+                entry.visible_from = visible_from
+                entry.updated = updated
+                changed.append(entry)
+
+        if created:
+            self.bulk_create(created, batch_size=bmodels.BULK_BATCH_SIZE)
+        bmodels.bulk_update(AMDashboardEntry, changed, ("bucket", "visible_from", "updated"))
+        if closed:
+            self.filter(process_id__in=closed).delete()
+
+    def rebuild(self):
+        """
+        Recompute the entries of all open processes, and remove the entries of
+        closed processes
+        """
+        with transaction.atomic():
+            self.filter(process__closed_time__isnull=False).delete()
+            self.refresh(Process.objects.filter(closed_time__isnull=True))
+
+
+class AMDashboardEntry(models.Model):
+    """
+    Precomputed position of an open process in the AM dashboard.
+
+    Entries are updated by the operations that change the state of a process.
+    Conditions that only depend on the passing of time, like hide_until or a
+    recently approved statement of intent, are stored as visible_from, so that
+    entries do not go stale when time passes.
+    """
+    BUCKET_CURRENT = "current"
+    BUCKET_APPROVED = "approved"
+    BUCKET_HIDDEN = "hidden"
+    BUCKETS = (
+        (BUCKET_CURRENT, _("Processes needing attention")),
+        (BUCKET_APPROVED, _("Processes approved but not yet closed")),
+        (BUCKET_HIDDEN, _("Not shown")),
+    )
+
+    process = models.OneToOneField(Process, primary_key=True, related_name="am_dashboard_entry")
+    bucket = models.CharField(max_length=16, choices=BUCKETS)
+    visible_from = models.DateTimeField(null=True, blank=True, help_text=_("Do not show the process in the dashboard before this time"))
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = AMDashboardEntryManager()
+
+    def __str__(self):
+        return "{}: {}".format(self.process, self.bucket)
@@ -128,6 +128,7 @@ class RequirementApprove(op.Operation):
         self.requirement.approved_time = self.audit_time
         self.requirement.save()
         self.requirement.add_log(self.audit_author, self.audit_notes, action="req_approve", is_public=True, logdate=self.audit_time)
+        self.requirement.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -139,6 +140,7 @@ class RequirementUnapprove(op.Operation):
         self.requirement.approved_time = None
         self.requirement.save()
         self.requirement.add_log(self.audit_author, self.audit_notes, action="req_unapprove", is_public=True, logdate=self.audit_time)
+        self.requirement.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -150,6 +152,7 @@ class ProcessFreeze(op.Operation):
         self.process.frozen_time = self.audit_time
         self.process.save()
         self.process.add_log(self.audit_author, self.audit_notes, action="proc_freeze", is_public=True, logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -161,6 +164,7 @@ class ProcessUnfreeze(op.Operation):
         self.process.frozen_time = None
         self.process.save()
         self.process.add_log(self.audit_author, self.audit_notes, action="proc_unfreeze", is_public=True, logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -173,6 +177,7 @@ class ProcessApprove(op.Operation):
         self.process.approved_time = self.audit_time
         self.process.save()
         self.process.add_log(self.audit_author, self.audit_notes, action="proc_approve", is_public=True, logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -184,6 +189,7 @@ class ProcessUnapprove(op.Operation):
         self.process.approved_time = None
         self.process.save()
         self.process.add_log(self.audit_author, self.audit_notes, action="proc_unapprove", is_public=True, logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -195,6 +201,7 @@ class ProcessClose(op.Operation):
         self.process.closed_by = self.audit_author
         self.process.closed_time = self.audit_time
         self.process.save()
+        self.process.update_am_dashboard()
         self.process.person.status = self.process.applying_for
         self.process.person.status_changed = self.audit_time
         self.process.person.save(audit_author=self.audit_author, audit_notes=self.audit_notes)
@@ -235,6 +242,7 @@ class ProcessAssignAM(op.Operation):
             self.am.save()
 
         requirement.add_log(self.audit_author, self.audit_notes, is_public=True, action="assign_am", logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
     def notify(self, request=None):
         from .email import notify_am_assigned
@@ -256,6 +264,7 @@ class ProcessUnassignAM(op.Operation):
         self.assignment.unassigned_time = self.audit_time
         self.assignment.save()
         requirement.add_log(self.audit_author, self.audit_notes, is_public=True, action="unassign_am", logdate=self.audit_time)
+        self.assignment.process.update_am_dashboard()
 
 
 @op.Operation.register
@@ -294,6 +303,7 @@ class ProcessStatementAdd(op.Operation):
 
         if self.requirement.approved_by:
             self.requirement.add_log(self.requirement.approved_by, "New statement received, the requirement seems satisfied", True, action="req_approve", logdate=self.audit_time)
+        self.requirement.process.update_am_dashboard()
 
     def notify(self, request=None):
         if self.requirement.type not in ("intent", "advocate", "am_ok"):
@@ -407,6 +417,7 @@ class ProcessApproveRT(op.Operation):
         self.process.approved_time = self.audit_time
         self.process.save()
         self.process.add_log(self.audit_author, self.audit_notes, action="proc_approve", is_public=True, logdate=self.audit_time)
+        self.process.update_am_dashboard()
 
     def notify(self, request=None):
         if self.process.applying_for in (const.STATUS_EMERITUS_DD, const.STATUS_REMOVED_DD):
@@ -464,6 +475,7 @@ class RequestEmeritus(op.Operation):
         # For example, the mail with the emeritus link is sent in cleartext, and someone else may click on it
         process.hide_until = self.audit_time + datetime.timedelta(days=5)
         process.save()
+        process.update_am_dashboard()
 
         self._statement = statement
 
@@ -529,6 +541,7 @@ class ProcessCancel(op.Operation):
         self.process.closed_time = self.audit_time
         self.process.hide_until = None
         self.process.save()
+        self.process.update_am_dashboard()
 
 
 @op.Operation.register
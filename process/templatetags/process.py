@@ -12,4 +12,16 @@ register = template.Library()
 def process_status(process, view):
     from process.mixins import compute_process_status
     perms = getattr(view, "visit_perms", None)
-    return compute_process_status(process, view.visitor, perms)
+    resolver = getattr(view, "permission_resolver", None)
+    return compute_process_status(process, view.visitor, perms, resolver=resolver)
+
+@register.filter
+def with_process_status(processes, view):
+    """
+    Return a list of (process, status) pairs, computing the status of all
+    processes with a fixed number of queries
+    """
+    from process.mixins import compute_processes_status
+    perms = getattr(view, "visit_perms", None)
+    resolver = getattr(view, "permission_resolver", None)
+    return compute_processes_status(processes, view.visitor, perms, resolver=resolver)
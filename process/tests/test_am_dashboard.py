@@ -5,6 +5,7 @@ from backend import const
 from backend import models as bmodels
 import process.models as pmodels
 from process.unittest import ProcessFixtureMixin
+import datetime
 
 
 class TestAMDashboard(ProcessFixtureMixin, TestCase):
@@ -33,3 +34,101 @@ class TestAMDashboard(ProcessFixtureMixin, TestCase):
         client = self.make_test_client(visitor)
         response = client.get(reverse("process_am_dashboard"))
         self.assertPermissionDenied(response)
+
+
+class TestAMDashboardEntries(ProcessFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.processes.create("dc", person=cls.persons.dc, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.persons.create("am", status=const.STATUS_DD_NU)
+        cls.ams.create("am", person=cls.persons.am)
+
+    def assertEntry(self, bucket, visible_from=None):
+        entry = pmodels.AMDashboardEntry.objects.get(process=self.processes.dc)
+        self.assertEqual(entry.bucket, bucket)
+        self.assertEqual(entry.visible_from, visible_from)
+
+    def assertShown(self, when=None):
+        visible = pmodels.AMDashboardEntry.objects.visible(when).values_list("process_id", flat=True)
+        self.assertIn(self.processes.dc.pk, visible)
+
+    def assertHidden(self, when=None):
+        visible = pmodels.AMDashboardEntry.objects.visible(when).values_list("process_id", flat=True)
+        self.assertNotIn(self.processes.dc.pk, visible)
+
+    def test_ops(self):
+        import process.ops as pops
+        process = self.processes.dc
+        self.assertEntry("hidden")
+        self.assertHidden()
+
+        approved = {}
+        for type in "intent", "sc_dmup", "advocate":
+            req = process.requirements.get(type=type)
+            op = pops.RequirementApprove(audit_author=self.persons.fd, audit_notes="approved", requirement=req)
+            op.execute()
+            approved[type] = op.audit_time
+
+        # A recently approved intent keeps the process hidden for 4 days
+        shown = approved["intent"] + datetime.timedelta(days=4)
+        self.assertEntry("current", shown)
+        self.assertHidden()
+        self.assertShown(shown)
+
+        # hide_until extends the hiding period
+        process.refresh_from_db()
+        process.hide_until = shown + datetime.timedelta(days=1)
+        process.save()
+        process.update_am_dashboard()
+        self.assertEntry("current", process.hide_until)
+        self.assertHidden(shown)
+        self.assertShown(process.hide_until)
+
+        # A process with an AM working on it is hidden
+        pops.ProcessAssignAM(audit_author=self.persons.fd, process=process, am=self.ams.am).execute()
+        self.assertEntry("hidden")
+
+        # Frozen and approved processes are always shown
+        process.refresh_from_db()
+        pops.ProcessFreeze(audit_author=self.persons.fd, audit_notes="frozen", process=process).execute()
+        self.assertEntry("current")
+        self.assertShown()
+        pops.ProcessApprove(audit_author=self.persons.fd, audit_notes="approved", process=process).execute()
+        self.assertEntry("approved")
+        self.assertShown()
+
+        pops.ProcessClose(audit_author=self.persons.fd, audit_notes="closed", process=process).execute()
+        self.assertFalse(pmodels.AMDashboardEntry.objects.filter(process=process).exists())
+
+    def test_rebuild(self):
+        pmodels.AMDashboardEntry.objects.all().delete()
+        pmodels.AMDashboardEntry.objects.rebuild()
+        self.assertEntry("hidden")
+
+    def test_refresh_queries(self):
+        for name in "dm", "dc_ga":
+            self.processes.create(name, person=self.persons[name], applying_for=const.STATUS_DD_U, fd_comment="test")
+        processes = list(pmodels.Process.objects.filter(closed_time__isnull=True))
+        pmodels.AMDashboardEntry.objects.all().delete()
+        # Requirements, assignments, existing entries, and one insert
+        with self.assertNumQueries(4):
+            pmodels.AMDashboardEntry.objects.refresh(processes)
+        self.assertEqual(pmodels.AMDashboardEntry.objects.filter(bucket="hidden").count(), 3)
+
+        # One update for all the changed entries
+        for process in processes:
+            process.approved_by = self.persons.fd
+            process.approved_time = now()
+        with self.assertNumQueries(4):
+            pmodels.AMDashboardEntry.objects.refresh(processes)
+        self.assertEqual(pmodels.AMDashboardEntry.objects.filter(bucket="approved").count(), 3)
+
+    def test_queries(self):
+        self.processes.dc.approved_by = self.persons.fd
+        self.processes.dc.approved_time = now()
+        self.processes.dc.save()
+        self.processes.dc.update_am_dashboard()
+        with self.assertNumQueries(1):
+            entries = list(pmodels.AMDashboardEntry.objects.visible().select_related("process", "process__person"))
+            self.assertEqual([e.process.person for e in entries], [self.persons.dc])
@@ -0,0 +1,185 @@
+from django.test import TestCase
+from django.conf import settings
+from unittest.mock import patch, MagicMock
+import importlib.machinery
+import importlib.util
+import threading
+import tempfile
+import shutil
+import json
+import io
+import os
+
+# archive-process-email is a standalone script run by the MTA
+loader = importlib.machinery.SourceFileLoader(
+    "archive_process_email", os.path.join(settings.PROJECT_DIR, "..", "archive-process-email"))
+ape = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+loader.exec_module(ape)
+
+MESSAGE = b"Delivered-To: archive-42@nm.debian.org\nSubject: Test\n\nTest body\n"
+
+
+class FakeCursor(list):
+    def execute(self, query, args):
+        self.executed = getattr(self, "executed", 0) + 1
+
+
+def fake_connection(rows):
+    db = MagicMock()
+    db.cursor.return_value = FakeCursor(rows)
+    return db, lambda q: q
+
+
+class TestConnectionPool(TestCase):
+    def test_pool(self):
+        with patch.object(ape, "open_db", side_effect=lambda sqlite: fake_connection([])) as open_db:
+            pool = ape.ConnectionPool(size=1)
+            conn1 = pool.acquire()
+            conn2 = pool.acquire()
+            self.assertEqual(open_db.call_count, 2)
+
+            # Idle connections are reused
+            pool.release(conn1)
+            self.assertIs(pool.acquire(), conn1)
+            self.assertEqual(open_db.call_count, 2)
+
+            # Connections in excess of the pool size are closed
+            pool.release(conn1)
+            pool.release(conn2)
+            conn2[0].close.assert_called_once_with()
+            conn1[0].close.assert_not_called()
+
+            # Broken connections are closed
+            conn = pool.acquire()
+            pool.release(conn, broken=True)
+            conn[0].close.assert_called_once_with()
+            self.assertEqual(pool.idle, [])
+
+
+class TestMailboxLookup(TestCase):
+    def make_lookup(self, rows, ttl=60):
+        self.cursor = FakeCursor(rows)
+        pool = MagicMock()
+        pool.acquire.return_value = (MagicMock(cursor=lambda: self.cursor), lambda q: q)
+        return ape.MailboxLookup(pool=pool, ttl=ttl)
+
+    def test_cache(self):
+        lookup = self.make_lookup([("test-key",)])
+        msg = MagicMock()
+        with patch.object(ape.time, "monotonic", return_value=1000):
+            self.assertEqual(lookup.lookup("test", msg), "test-key.mbox")
+            self.assertEqual(lookup.lookup("test", msg), "test-key.mbox")
+        self.assertEqual(self.cursor.executed, 1)
+
+        # Cached results expire after the ttl
+        with patch.object(ape.time, "monotonic", return_value=1061):
+            self.assertEqual(lookup.lookup("test", msg), "test-key.mbox")
+        self.assertEqual(self.cursor.executed, 2)
+
+    def test_not_found(self):
+        lookup = self.make_lookup([])
+        msg = MagicMock()
+        self.assertIsNone(lookup.lookup("test=example.org", msg))
+        # Failed lookups are not cached
+        self.assertIsNone(lookup.lookup("test=example.org", msg))
+        self.assertEqual(self.cursor.executed, 2)
+
+
+class TestLatencyStats(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_stats(self):
+        pathname = os.path.join(self.workdir, "stats.json")
+        stats = ape.LatencyStats(pathname, interval=3600)
+        for i in range(1, 101):
+            stats.add(i / 100, error=(i == 100))
+        data = stats.as_dict()
+        self.assertEqual(data["messages"], 100)
+        self.assertEqual(data["errors"], 1)
+        self.assertAlmostEqual(data["mean"], 0.505)
+        self.assertEqual(data["p50"], 0.51)
+        self.assertEqual(data["p95"], 0.96)
+        self.assertEqual(data["max"], 1.0)
+
+        # The first delivery is published right away, then once per interval
+        with open(pathname) as fd:
+            self.assertEqual(json.load(fd)["messages"], 1)
+        stats.publish()
+        with open(pathname) as fd:
+            self.assertEqual(json.load(fd)["messages"], 100)
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.socket = os.path.join(self.workdir, "socket")
+        self.stats = ape.LatencyStats()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def serve(self, dest):
+        server = ape.make_server(self.socket, MagicMock(), self.stats, dest=dest)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+
+    def test_deliver(self):
+        self.serve(self.workdir)
+        reply = ape.deliver_via_daemon(io.BytesIO(MESSAGE), self.socket)
+        mbox = os.path.join(self.workdir, "process-42.mbox")
+        self.assertEqual(reply, "250 " + mbox)
+        with open(mbox, "rb") as fd:
+            delivered = fd.read()
+        self.assertTrue(delivered.startswith(b"From "))
+        self.assertIn(b"Subject: Test\n\nTest body\n", delivered)
+        self.assertEqual(self.stats.count, 1)
+
+    def test_error(self):
+        self.serve(os.path.join(self.workdir, "missing"))
+        with self.assertLogs("archive-process-email", level="ERROR"):
+            reply = ape.deliver_via_daemon(io.BytesIO(MESSAGE), self.socket)
+        self.assertTrue(reply.startswith("451 FileNotFoundError"))
+        self.assertEqual(self.stats.errors, 1)
+
+    def test_not_running(self):
+        self.assertIsNone(ape.deliver_via_daemon(io.BytesIO(MESSAGE), self.socket))
+
+
+class TestClient(TestCase):
+    def run_main(self, *args):
+        stdin = io.TextIOWrapper(io.BytesIO(MESSAGE))
+        with patch.object(ape.sys, "stdin", stdin):
+            return ape.main(list(args))
+
+    def test_delivered_by_daemon(self):
+        with patch.object(ape, "deliver_via_daemon", return_value="250 /tmp/test.mbox"), \
+                patch.object(ape, "deliver") as deliver:
+            self.assertIsNone(self.run_main("--socket", "/nonexistent"))
+        deliver.assert_not_called()
+
+    def test_fallback(self):
+        # Deliver directly if the daemon is not running
+        with patch.object(ape, "deliver") as deliver:
+            self.assertIsNone(self.run_main("--socket", "/nonexistent"))
+        deliver.assert_called_once()
+
+    def test_tempfail(self):
+        with patch.object(ape, "deliver_via_daemon", return_value="451 OSError: disk full"), \
+                patch.object(ape, "deliver") as deliver, \
+                patch.object(ape.sys, "stderr", io.StringIO()):
+            self.assertEqual(self.run_main("--socket", "/nonexistent"), 75)
+        deliver.assert_not_called()
+
+    def test_dest_with_socket(self):
+        with patch.object(ape.sys, "stderr", io.StringIO()):
+            with self.assertRaises(SystemExit):
+                self.run_main("--socket", "/nonexistent", "--dest", "/tmp")
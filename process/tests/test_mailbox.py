@@ -0,0 +1,211 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from django.utils.http import http_date
+from backend import const
+from backend.mailbox_index import MailboxIndex
+from unittest.mock import patch
+import process.models as pmodels
+import tempfile
+import errno
+import gzip
+import glob
+import os
+from .common import ProcessFixtureMixin, test_fingerprint1, test_fpr1_signed_valid_text
+
+
+class TestMailboxDownload(ProcessFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.persons.create("app", status=const.STATUS_DC)
+        cls.processes.create("app", person=cls.persons.app, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.fingerprints.create("app", person=cls.persons.app, fpr=test_fingerprint1, is_active=True, audit_skip=True)
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PROCESS_MAILBOX_DIR=self.workdir.name)
+        self.settings.enable()
+        self.mbox = os.path.join(self.workdir.name, "process-{}.mbox".format(self.processes.app.pk))
+        with open(self.mbox, "wt") as fd:
+            print("From nobody Sun Jun 24 19:12:52 2012\nFrom: Test <test@example.org>\nSubject: Test\n\nTest\n", file=fd)
+        self.url = reverse("process_mailbox_download", args=[self.processes.app.pk])
+        self.client = self.make_test_client("fd")
+
+    def tearDown(self):
+        self.settings.disable()
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def test_download(self):
+        with patch.object(pmodels.Process, "get_statements_as_mbox", autospec=True, return_value=b"STATEMENTS") as gen:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            data = b"".join(response.streaming_content)
+            with open(self.mbox, "rb") as fd:
+                self.assertEqual(gzip.decompress(data), fd.read() + b"\nSTATEMENTS")
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+            etag = response["ETag"]
+            last_modified = response["Last-Modified"]
+            self.assertEqual(gen.call_count, 1)
+
+            # The compressed mailbox is reused
+            response = self.client.get(self.url)
+            self.assertEqual(b"".join(response.streaming_content), data)
+            self.assertEqual(gen.call_count, 1)
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+            # Resume a download
+            response = self.client.get(self.url, HTTP_RANGE="bytes=10-", HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response["Content-Range"], "bytes 10-{}/{}".format(len(data) - 1, len(data)))
+            self.assertEqual(b"".join(response.streaming_content), data[10:])
+            response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+            self.assertEqual(b"".join(response.streaming_content), data[-5:])
+            response = self.client.get(self.url, HTTP_RANGE="bytes={}-".format(len(data)))
+            self.assertEqual(response.status_code, 416)
+            # The range is ignored if the file changed
+            response = self.client.get(self.url, HTTP_RANGE="bytes=10-", HTTP_IF_RANGE='"outdated"')
+            self.assertEqual(response.status_code, 200)
+
+            # A new statement refreshes the cache
+            self.statements.create("intent", requirement=self.processes.app.requirements.get(type="intent"), fpr=self.fingerprints.app,
+                                   statement=test_fpr1_signed_valid_text, uploaded_by=self.persons.app, uploaded_time=now())
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(gen.call_count, 2)
+            self.assertEqual(len(glob.glob(self.mbox + ".*.gz")), 1)
+
+            # So does a change in the mailbox
+            with open(self.mbox, "at") as fd:
+                print("From nobody Sun Jun 24 19:12:53 2012\nSubject: Test 2\n\nTest\n", file=fd)
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(gen.call_count, 3)
+            self.assertEqual(len(glob.glob(self.mbox + ".*.gz")), 1)
+
+    def test_last_modified(self):
+        os.utime(self.mbox, (1340565172, 1340565172))
+        response = self.client.get(self.url)
+        self.assertEqual(response["Last-Modified"], "Sun, 24 Jun 2012 19:12:52 GMT")
+        last_modified = response["Last-Modified"]
+
+        # Statements are newer than the mailbox
+        uploaded = now().replace(microsecond=0)
+        self.statements.create("intent", requirement=self.processes.app.requirements.get(type="intent"), fpr=self.fingerprints.app,
+                               statement=test_fpr1_signed_valid_text, uploaded_by=self.persons.app, uploaded_time=uploaded)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Last-Modified"], http_date(uploaded.timestamp()))
+
+    def test_cache_not_writable(self):
+        with patch.object(pmodels.Process, "get_statements_as_mbox", autospec=True, return_value=b"STATEMENTS"):
+            with patch("backend.mailbox_cache.atomic_writer", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+                with self.assertLogs("backend.mailbox_cache", level="WARNING"):
+                    response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            data = b"".join(response.streaming_content)
+        with open(self.mbox, "rb") as fd:
+            self.assertEqual(gzip.decompress(data), fd.read() + b"\nSTATEMENTS")
+        self.assertEqual(glob.glob(self.mbox + ".*.gz"), [])
+
+    def test_missing(self):
+        os.unlink(self.mbox)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestMailboxIndex(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.mbox = os.path.join(self.workdir.name, "test.mbox")
+
+    def tearDown(self):
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def append(self, subject, body="Test", mode="at"):
+        with open(self.mbox, mode) as fd:
+            print("From nobody Sun Jun 24 19:12:52 2012\nFrom: Test <test@example.org>\n"
+                  "Date: Sun, 24 Jun 2012 19:12:52 +0200\nSubject: {}\n\n{}\n".format(subject, body), file=fd)
+
+    def test_index(self):
+        self.append("=?utf-8?q?Caf=C3=A9?=", "First\n>From quoted", mode="wt")
+        self.append("Second")
+        index = MailboxIndex(self.mbox)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.summary(0), {"From": "Test <test@example.org>", "Date": "Sun, 24 Jun 2012 19:12:52 +0200", "Subject": "Café",
+                                             "RawFrom": "Test <test@example.org>"})
+        self.assertEqual([index.get_body(i) for i in range(2)], ["First\n>From quoted", "Test"])
+        self.assertTrue(os.path.exists(index.index_pathname))
+
+        # The index is reused and extended when the mailbox grows
+        with patch.object(MailboxIndex, "_scan", autospec=True, side_effect=MailboxIndex._scan) as scan:
+            self.assertEqual(MailboxIndex(self.mbox).messages, index.messages)
+            self.assertEqual(scan.call_count, 0)
+            self.append("Third")
+            index = MailboxIndex(self.mbox)
+            self.assertEqual(scan.call_args[0][2], index.messages[1][0])
+        self.assertEqual([index.summary(i)["Subject"] for i in range(3)], ["Café", "Second", "Third"])
+        self.assertEqual(index.get_body(2), "Test")
+
+        # A rewritten mailbox is indexed from scratch
+        self.append("Rewritten", mode="wt")
+        index = MailboxIndex(self.mbox)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.summary(0)["Subject"], "Rewritten")
+
+
+class TestMailboxDisplay(ProcessFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.persons.create("app", status=const.STATUS_DC)
+        cls.processes.create("app", person=cls.persons.app, applying_for=const.STATUS_DD_U, fd_comment="test")
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(PROCESS_MAILBOX_DIR=self.workdir.name)
+        self.settings.enable()
+        with open(os.path.join(self.workdir.name, "process-{}.mbox".format(self.processes.app.pk)), "wt") as fd:
+            for i in range(5):
+                print("From nobody Sun Jun 24 19:12:52 2012\nSubject: Test {}\n\nBody <{}>\n".format(i, i), file=fd)
+        self.client = self.make_test_client("fd")
+
+    def tearDown(self):
+        self.settings.disable()
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def test_display(self):
+        from process.views import DisplayMailArchive
+        url = reverse("process_mailbox_show", args=[self.processes.app.pk])
+        with patch.object(DisplayMailArchive, "paginate_by", 2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([m["Subject"] for m in response.context["mails"]], ["Test 0", "Test 1"])
+            response = self.client.get(url, data={"page": 3})
+            self.assertEqual([m["Subject"] for m in response.context["mails"]], ["Test 4"])
+            self.assertEqual(response.context["mails"][0]["url"], reverse("process_mailbox_message", args=[self.processes.app.pk, 4]))
+            self.assertNotContains(response, "Body")
+            response = self.client.get(url, data={"page": 4})
+            self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(reverse("process_mailbox_message", args=[self.processes.app.pk, 4]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"<p>Body &lt;4&gt;</p>")
+        response = self.client.get(reverse("process_mailbox_message", args=[self.processes.app.pk, 5]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_permissions(self):
+        client = self.make_test_client(None)
+        response = client.get(reverse("process_mailbox_message", args=[self.processes.app.pk, 0]))
+        self.assertEqual(response.status_code, 403)
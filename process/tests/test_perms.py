@@ -589,4 +589,47 @@ class TestVisitApplicant(ProcessFixtureMixin, TestCase):
         self.assertPerms(expected)
 
 
+class TestPermissionResolver(ProcessFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.persons.create("am", status=const.STATUS_DD_NU)
+        cls.ams.create("am", person=cls.persons.am)
+        cls.processes.create("dc", person=cls.persons.dc, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.processes.create("dm", person=cls.persons.dm, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.processes.create("dd_nu", person=cls.persons.dd_nu, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.amassignments.create("am", process=cls.processes.dc, am=cls.ams.am, assigned_by=cls.persons.fd, assigned_time=now())
+
+    def test_same_perms(self):
+        processes = list(pmodels.Process.objects.filter(closed_time__isnull=True).select_related("person"))
+        requirements = list(pmodels.Requirement.objects.filter(process__in=processes).select_related("process", "process__person"))
+        for visitor in None, "dc", "dm", "dd_nu", "am", "fd":
+            visitor = self.persons[visitor] if visitor else None
+            resolver = pmodels.PermissionResolver(visitor)
+            perms = resolver.processes(processes)
+            for p in processes:
+                self.assertEqual(set(perms[p.pk]), set(p.permissions_of(visitor)))
+            perms = resolver.requirements(requirements)
+            for r in requirements:
+                self.assertEqual(set(perms[r.pk]), set(r.permissions_of(visitor)))
+
+    def test_queries(self):
+        processes = list(pmodels.Process.objects.filter(closed_time__isnull=True).select_related("person"))
+        requirements = list(pmodels.Requirement.objects.filter(process__in=processes).select_related("process", "process__person"))
+
+        resolver = pmodels.PermissionResolver(self.persons.am)
+        with self.assertNumQueries(3):
+            resolver.processes(processes[:1])
+
+        resolver = pmodels.PermissionResolver(self.persons.am)
+        with self.assertNumQueries(3):
+            resolver.processes(processes)
+
+        # Facts are memoised for the lifetime of the resolver
+        with self.assertNumQueries(0):
+            resolver.requirements(requirements)
+            for p in processes:
+                self.assertIs(p.permissions_of(self.persons.am, resolver=resolver), resolver.process(p))
+
+
 # TODO: process closed but not frozen and approved (aborted)
@@ -0,0 +1,61 @@
+from django.test import TestCase
+from django.utils.timezone import now
+from backend import const
+import process.models as pmodels
+from process.mixins import compute_process_status, compute_processes_status
+from process.unittest import ProcessFixtureMixin
+
+
+class TestProcessStatus(ProcessFixtureMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.persons.create("am", status=const.STATUS_DD_NU)
+        cls.ams.create("am", person=cls.persons.am)
+        cls.processes.create("dc", person=cls.persons.dc, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.processes.create("dm", person=cls.persons.dm, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.processes.create("dd_nu", person=cls.persons.dd_nu, applying_for=const.STATUS_DD_U, fd_comment="test")
+        cls.amassignments.create("am", process=cls.processes.dc, am=cls.ams.am, assigned_by=cls.persons.fd, assigned_time=now())
+        for name in "dc", "dm", "dd_nu":
+            cls.processes[name].add_log(cls.persons.fd, "public " + name, is_public=True)
+            cls.processes[name].add_log(cls.persons.fd, "private " + name, is_public=False)
+
+    def assertSameStatus(self, a, b):
+        self.assertEqual(a.keys(), b.keys())
+        for k in a.keys():
+            self.assertEqual(a[k], b[k], k)
+
+    def test_batch(self):
+        processes = list(pmodels.Process.objects.filter(closed_time__isnull=True).order_by("pk"))
+        for visitor in self.persons.dc, self.persons.fd:
+            statuses = compute_processes_status(processes, visitor)
+            self.assertEqual([p for p, s in statuses], processes)
+            for process, status in statuses:
+                self.assertSameStatus(status, compute_process_status(process, visitor))
+
+        status = dict(compute_processes_status(processes, self.persons.dc))
+        self.assertEqual(status[self.processes.dc]["summary"], "AM")
+        self.assertEqual(status[self.processes.dc]["am_assignment"], self.amassignments.am)
+        self.assertEqual([l.logtext for l in status[self.processes.dm]["log"]], ["public dm"])
+        self.assertIsNone(status[self.processes.dm]["am_assignment"])
+
+        status = dict(compute_processes_status(processes, self.persons.fd))
+        self.assertEqual([l.logtext for l in status[self.processes.dm]["log"]], ["public dm", "private dm"])
+
+    def test_queries(self):
+        processes = list(pmodels.Process.objects.filter(closed_time__isnull=True))
+        self.assertEqual(compute_processes_status([], self.persons.dc), [])
+        with self.assertNumQueries(4):
+            compute_processes_status(processes[:1], self.persons.dc)
+        with self.assertNumQueries(4):
+            statuses = compute_processes_status(processes, self.persons.dc)
+        # Rendering the status does not hit the database again
+        with self.assertNumQueries(0):
+            for process, status in statuses:
+                for r in status["requirements_sorted"]:
+                    r.approved_by
+                    r.process
+                for l in status["log"]:
+                    l.changed_by
+                if status["am_assignment"]:
+                    status["am_assignment"].am.person
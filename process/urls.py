@@ -20,6 +20,7 @@ urlpatterns = [
     url(r'^(?P<pk>\d+)/unassign_am$', views.UnassignAM.as_view(), name="process_unassign_am"),
     url(r'^(?P<pk>\d+)/mailbox/download$', views.MailArchive.as_view(), name="process_mailbox_download"), # TODO: test
     url(r'^(?P<pk>\d+)/mailbox$', views.DisplayMailArchive.as_view(), name="process_mailbox_show"), # TODO: test
+    url(r'^(?P<pk>\d+)/mailbox/(?P<msg>\d+)$', views.DisplayMailArchiveMessage.as_view(), name="process_mailbox_message"),
     url(r'^(?P<pk>\d+)/update_keycheck$', views.UpdateKeycheck.as_view(), name="process_update_keycheck"), # TODO: test
     url(r'^(?P<pk>\d+)/download_statements$', views.DownloadStatements.as_view(), name="process_download_statements"), # TODO: test
     url(r'^(?P<pk>\d+)/rt_ticket$', views.MakeRTTicket.as_view(), name="process_rt_ticket"),
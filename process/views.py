@@ -2,8 +2,9 @@ from django.utils.translation import ugettext as _
 from django.shortcuts import redirect, get_object_or_404
 from django.views.generic import TemplateView, View
 from django.views.generic.edit import FormView
-from django.utils.timezone import now
+from django.utils.timezone import now, make_naive, utc
 from django.db import transaction
+from django.db.models import Max
 from django import forms, http
 from django.core.exceptions import PermissionDenied
 from django.conf import settings
@@ -11,10 +12,11 @@ from django.urls import reverse, reverse_lazy
 from collections import OrderedDict
 from rest_framework import viewsets
 from backend.shortcuts import build_absolute_uri
-from backend.mixins import VisitorMixin, VisitPersonMixin, TokenAuthMixin
+from backend.mailbox_cache import CompressedMailbox
+from backend.mixins import VisitorMixin, VisitPersonMixin, TokenAuthMixin, MailArchiveMixin, MailArchiveMessageMixin
 from backend import const
 import backend.models as bmodels
-from .mixins import VisitProcessMixin, RequirementMixin, StatementMixin
+from .mixins import PermissionResolverMixin, VisitProcessMixin, RequirementMixin, StatementMixin
 import datetime
 import re
 import json
@@ -31,11 +33,12 @@ class ProcessViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Export process information
     """
-    queryset = pmodels.Process.objects.filter(closed_time__isnull=True).order_by("started")
+    queryset = pmodels.Process.objects.filter(closed_time__isnull=True).order_by("started") \
+                    .select_related("person").prefetch_related(bmodels.prefetch_active_fingerprint("person__fprs"))
     serializer_class = ProcessSerializer
 
 
-class List(VisitorMixin, TemplateView):
+class List(PermissionResolverMixin, VisitorMixin, TemplateView):
     """
     List active and recently closed processes
     """
@@ -49,42 +52,10 @@ class List(VisitorMixin, TemplateView):
         return ctx
 
 
-class AMDashboard(VisitorMixin, TemplateView):
+class AMDashboard(PermissionResolverMixin, VisitorMixin, TemplateView):
     require_visitor = "am"
     template_name = "process/amdashboard.html"
 
-    def _show_process(self, process):
-        """
-        Return True if the process should be shown in the dashboard, False if
-        it should not.
-        """
-        if process.frozen_by_id is not None or process.approved_by_id is not None: return True
-
-        if process.hide_until and process.hide_until > now(): return False
-
-        if process.applying_for in (const.STATUS_EMERITUS_DD, const.STATUS_REMOVED_DD): return True
-
-        for_ga = process.applying_for in (const.STATUS_DC_GA, const.STATUS_DM_GA)
-
-        needs_am_report = False
-        for req in process.requirements.all():
-            if req.type == "intent":
-                if not req.approved_by_id: return False
-                # Hide all processes with a statement of intent approved less
-                # than 4 days ago
-                if not for_ga and req.approved_time + datetime.timedelta(days=4) > now(): return False
-            elif req.type == "sc_dmup":
-                if not req.approved_by_id: return False
-            elif req.type == "advocate":
-                if not req.approved_by_id: return False
-            elif req.type == "am_ok":
-                needs_am_report = req.approved_by_id is None
-
-        if needs_am_report and process.current_am_assignment:
-            return False
-
-        return True
-
     def get_context_data(self, **kw):
         from django.db.models import Min, Max
         ctx = super().get_context_data(**kw)
@@ -92,12 +63,13 @@ class AMDashboard(VisitorMixin, TemplateView):
         import process.models as pmodels
         processes = []
         approved_processes = []
-        for p in pmodels.Process.objects.filter(closed_time__isnull=True).order_by("applying_for"):
-            if not self._show_process(p): continue
-            if p.approved:
-                approved_processes.append(p)
+        for entry in pmodels.AMDashboardEntry.objects.visible() \
+                        .select_related("process", "process__person") \
+                        .order_by("process__applying_for"):
+            if entry.bucket == pmodels.AMDashboardEntry.BUCKET_APPROVED:
+                approved_processes.append(entry.process)
             else:
-                processes.append(p)
+                processes.append(entry.process)
         ctx["current_processes"] = processes
         ctx["approved_processes"] = approved_processes
 
@@ -173,13 +145,14 @@ class AddProcessLog(VisitProcessMixin, View):
 
         if req_type:
             requirement = get_object_or_404(pmodels.Requirement, process=self.process, type=req_type)
+            requirement.process = self.process
+            visit_perms = requirement.permissions_of(self.visitor, resolver=self.permission_resolver)
             target = requirement
         else:
             requirement = None
+            visit_perms = self.visit_perms
             target = self.process
 
-        visit_perms = target.permissions_of(self.visitor)
-
         op = None
         if action in ("log_private", "log_public"):
             if "add_log" not in visit_perms: raise PermissionDenied
@@ -373,40 +346,35 @@ class MailArchive(VisitProcessMixin, View):
             self.process.applying_for,
             self.process.pk)
 
-        res = http.HttpResponse(content_type="application/octet-stream")
-        res["Content-Disposition"] = "attachment; filename=%s.gz" % user_fname
+        # Statements can change without touching the mailbox
+        last_statement = pmodels.Statement.objects.filter(requirement__process=self.process).aggregate(
+            last=Max("uploaded_time"))["last"]
+        if last_statement is not None:
+            last_statement = make_naive(last_statement, utc)
 
-        # Compress the mailbox and pass it to the request
-        from gzip import GzipFile
-        import os.path
-        import shutil
-        # The last mtime argument seems to only be supported in python 2.7
-        outfd = GzipFile(user_fname, "wb", 9, res) #, os.path.getmtime(fname))
-        try:
-            with open(fname, "rb") as infd:
-                shutil.copyfileobj(infd, outfd)
-            outfd.write(b"\n")
-            outfd.write(self.process.get_statements_as_mbox())
-        finally:
-            outfd.close()
-        return res
+        # Serve a cached compressed copy of the mailbox with the statements
+        mbox = CompressedMailbox(fname, user_fname,
+                                 extra=lambda: b"\n" + self.process.get_statements_as_mbox(),
+                                 extra_key=self.process.get_statements_digest(),
+                                 extra_last_modified=last_statement)
+        return mbox.serve(request, user_fname + ".gz")
 
 
-class DisplayMailArchive(VisitProcessMixin, TemplateView):
+class DisplayMailArchive(MailArchiveMixin, VisitProcessMixin, TemplateView):
     require_visit_perms = "view_mbox"
     template_name = "process/display-mail-archive.html"
+    message_url_name = "process_mailbox_message"
 
     def get_context_data(self, **kw):
-        import backend.email
         ctx = super(DisplayMailArchive, self).get_context_data(**kw)
-        fname = self.process.mailbox_file
-        if fname is None: raise http.Http404
-        ctx["mails"] = backend.email.get_mbox_as_dicts(fname)
         ctx["process"] = self.process
-        ctx["class"] = "clickable"
         return ctx
 
 
+class DisplayMailArchiveMessage(MailArchiveMessageMixin, VisitProcessMixin, View):
+    require_visit_perms = "view_mbox"
+
+
 class UpdateKeycheck(RequirementMixin, View):
     type = "keycheck"
     require_visit_perms = "update_keycheck"
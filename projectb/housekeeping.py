@@ -47,22 +47,4 @@ class UpdateLastUpload(hk.Task):
     DEPENDS = [MakeLink]
 
     def run_main(self, stage):
-        by_fpr = {}
-
-        with pmodels.cursor() as cur:
-            cur.execute("""
-SELECT MAX(s.install_date) as date, f.fingerprint
-          FROM source s
-          JOIN fingerprint f ON s.sig_fpr = f.id
-       GROUP BY f.fingerprint
-""")
-            for date, fpr in cur:
-                by_fpr[fpr] = date
-            
-        for fpr in bmodels.Fingerprint.objects.all():
-            date = by_fpr.get(fpr.fpr)
-            if date is None: continue
-            if date == fpr.last_upload: continue
-            fpr.last_upload = date
-            # Skip audit since we are only updating statistics data
-            fpr.save(audit_skip=True)
+        pmodels.LastUploadSync().run()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+import sys
+import logging
+from projectb import models as pmodels
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Update the date of the last upload done with each key from projectb"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quiet", action="store_true", default=None, help="Disable progress reporting")
+        parser.add_argument("--full", action="store_true", help="Read all uploads instead of only the new ones")
+
+    def handle(self, **opts):
+        FORMAT = "%(asctime)-15s %(levelname)s %(message)s"
+        if opts["quiet"]:
+            logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format=FORMAT)
+        else:
+            logging.basicConfig(level=logging.INFO, stream=sys.stderr, format=FORMAT)
+
+        pmodels.LastUploadSync().run(full=opts["full"])
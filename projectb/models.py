@@ -5,8 +5,10 @@ We mainly use it to make a list of DMs
 """
 
 from django.db import models
-from django.db import connections
+from django.db import connections, transaction
 from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from backend import utils
 
 import datetime
 import sys
@@ -15,6 +17,8 @@ import re
 import time
 import subprocess
 import pickle
+import itertools
+import json
 import psycopg2
 import logging
 
@@ -27,6 +31,169 @@ def cursor():
     return connections['projectb'].cursor()
 
 
+_stream_ids = itertools.count()
+
+def stream(query, args=(), fetch_size=1000):
+    """
+    Run a query on the projectb database, generating the resulting rows
+    without loading them all in memory.
+
+    On PostgreSQL this uses a named server-side cursor, fetching fetch_size
+    rows at a time, inside a transaction that lasts until the generator is
+    exhausted or closed. Other databases, like the sqlite one used in tests,
+    fall back to fetchmany on a normal cursor.
+    """
+    conn = connections['projectb']
+    if conn.vendor != "postgresql":
+        with conn.cursor() as cur:
+            cur.execute(query, args)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows: break
+                for row in rows:
+                    yield row
+        return
+
+    with transaction.atomic(using='projectb'):
+        cur = conn.connection.cursor(name="nm_stream_{}_{}".format(os.getpid(), next(_stream_ids)))
+        try:
+            cur.itersize = fetch_size
+            cur.execute(query, args)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+
+# State of the incremental synchronisation of Fingerprint.last_upload
+PROJECTB_LAST_UPLOAD_STATEFILE = getattr(settings, "PROJECTB_LAST_UPLOAD_STATEFILE", "./data/projectb_last_upload.json")
+# Number of fingerprints looked up in projectb with each query
+LAST_UPLOAD_LOOKUP_SIZE = 500
+
+
+class LastUploadSync(object):
+    """
+    Copy the date of the last upload done with each key from projectb to
+    Fingerprint.last_upload.
+
+    The highest install_date seen is saved in a state file, and the next
+    runs only look at uploads installed from then on. Keys added to our
+    database since the previous run are looked up in all of projectb.
+
+    A full resync, as done on the first run, reads all uploads and also
+    corrects dates that went backwards.
+    """
+    def __init__(self, statefile=None):
+        self.statefile = statefile or PROJECTB_LAST_UPLOAD_STATEFILE
+
+    def load_state(self):
+        """
+        Read the last saved state
+        """
+        try:
+            with open(self.statefile) as infd:
+                state = json.load(infd)
+        except IOError:
+            state = {}
+
+        if "install_date" in state:
+            state["install_date"] = parse_datetime(state["install_date"])
+
+        return state
+
+    def save_state(self, state):
+        """
+        Atomically commit the state to disk
+        """
+        state = dict(state)
+        if state.get("install_date") is not None:
+            state["install_date"] = state["install_date"].isoformat()
+        with utils.atomic_writer(self.statefile, mode="wt") as outfd:
+            json.dump(state, outfd)
+
+    def fetch(self, since=None, fprs=None):
+        """
+        Generate (fingerprint, max install_date) for the uploads in projectb,
+        optionally limited to those installed since the given datetime, or
+        done with the given fingerprints
+        """
+        query = """
+SELECT f.fingerprint, MAX(s.install_date) as date
+  FROM source s
+  JOIN fingerprint f ON s.sig_fpr = f.id
+"""
+        if since is not None:
+            yield from stream(query + " WHERE s.install_date >= %s GROUP BY f.fingerprint", (since,))
+        elif fprs is not None:
+            fprs = list(fprs)
+            for start in range(0, len(fprs), LAST_UPLOAD_LOOKUP_SIZE):
+                chunk = fprs[start:start + LAST_UPLOAD_LOOKUP_SIZE]
+                yield from stream(query + " WHERE f.fingerprint IN ({}) GROUP BY f.fingerprint".format(
+                    ",".join(["%s"] * len(chunk))), chunk)
+        else:
+            yield from stream(query + " GROUP BY f.fingerprint")
+
+    def run(self, full=False):
+        """
+        Update Fingerprint.last_upload, returning a dict with statistics
+        """
+        import backend.models as bmodels
+        start = time.time()
+        state = {} if full else self.load_state()
+        since = state.get("install_date")
+        full = since is None
+        # Taken before reading projectb, so that keys added while we run are
+        # looked up again next time
+        max_fpr_id = bmodels.Fingerprint.objects.aggregate(models.Max("id"))["id__max"] or 0
+
+        by_fpr = {}
+        rows = 0
+
+        def merge(results):
+            nonlocal rows, since
+            for fpr, date in results:
+                rows += 1
+                if isinstance(date, str): date = parse_datetime(date)
+                if date is None: continue
+                old = by_fpr.get(fpr)
+                if old is None or date > old: by_fpr[fpr] = date
+                if since is None or date > since: since = date
+
+        if full:
+            merge(self.fetch())
+            fprs = bmodels.Fingerprint.objects.all()
+        else:
+            merge(self.fetch(since=since))
+            new_fprs = list(bmodels.Fingerprint.objects.filter(
+                pk__gt=state.get("fingerprint_id", 0), pk__lte=max_fpr_id).values_list("fpr", flat=True))
+            if new_fprs: merge(self.fetch(fprs=new_fprs))
+            fprs = bmodels.Fingerprint.objects.filter(fpr__in=list(by_fpr.keys()))
+
+        changes = []
+        for fpr in fprs:
+            date = by_fpr.get(fpr.fpr)
+            if date is None: continue
+            date = date.date()
+            if date == fpr.last_upload: continue
+            # In incremental mode, never move dates backwards
+            if not full and fpr.last_upload is not None and date < fpr.last_upload: continue
+            changes.append((fpr, {"last_upload": date}, None))
+        # Skip audit since we are only updating statistics data
+        changed = bmodels.Fingerprint.objects.bulk_change(changes, audit_skip=True)
+
+        self.save_state({"install_date": since, "fingerprint_id": max_fpr_id})
+
+        stats = {
+            "mode": "full" if full else "incremental",
+            "rows": rows,
+            "updated": len(changed),
+            "elapsed": time.time() - start,
+        }
+        log.info("last_upload %s sync: %d rows read from projectb, %d keys updated, %.2fs",
+                 stats["mode"], stats["rows"], stats["updated"], stats["elapsed"])
+        return stats
+
+
 CACHE_FILE="make-dm-list.cache"
 
 KEYRINGS = getattr(settings, "KEYRINGS", "/srv/keyring.debian.org/keyrings")
@@ -1,2 +1,84 @@
 from django.test import TestCase
+from django.utils.timezone import utc
+from backend.unittest import PersonFixtureMixin
+import backend.models as bmodels
+from . import models as pmodels
+import datetime
+import tempfile
+import os
 
+
+class MockLastUploadSync(pmodels.LastUploadSync):
+    """
+    LastUploadSync reading uploads from a list instead of projectb
+    """
+    def __init__(self, uploads, **kw):
+        super().__init__(**kw)
+        self.uploads = uploads
+        self.queries = []
+
+    def fetch(self, since=None, fprs=None):
+        self.queries.append((since, sorted(fprs) if fprs is not None else None))
+        res = {}
+        for fpr, date in self.uploads:
+            if since is not None and date < since: continue
+            if fprs is not None and fpr not in fprs: continue
+            if fpr not in res or date > res[fpr]: res[fpr] = date
+        return res.items()
+
+
+class TestLastUploadSync(PersonFixtureMixin, TestCase):
+    FPR1 = "1793D6AB75663E6BF104953A634F4BD1E7AD5568"
+    FPR2 = "66B4DFB68CB24EBBD8650BC4F4B4B0CC797EBFAB"
+    FPR3 = "0EED77DC41D760FDE44035FF5556A34E04A3610B"
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.statefile = os.path.join(self.workdir.name, "state.json")
+        self.fingerprints.create("dd_nu", person=self.persons.dd_nu, fpr=self.FPR1, is_active=True, audit_skip=True)
+        self.fingerprints.create("dm", person=self.persons.dm, fpr=self.FPR2, is_active=True, audit_skip=True)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def dt(self, day):
+        return datetime.datetime(2017, 1, day, 12, tzinfo=utc)
+
+    def last_upload(self, name):
+        return bmodels.Fingerprint.objects.get(pk=self.fingerprints[name].pk).last_upload
+
+    def test_incremental(self):
+        uploads = [(self.FPR1, self.dt(1)), (self.FPR1, self.dt(3)), (self.FPR2, self.dt(2)), (self.FPR3, self.dt(2))]
+        sync = MockLastUploadSync(uploads, statefile=self.statefile)
+        stats = sync.run()
+        self.assertEqual(stats["mode"], "full")
+        self.assertEqual(stats["updated"], 2)
+        self.assertEqual(self.last_upload("dd_nu"), datetime.date(2017, 1, 3))
+        self.assertEqual(self.last_upload("dm"), datetime.date(2017, 1, 2))
+
+        # New uploads and a new key: only those are looked up
+        uploads += [(self.FPR2, self.dt(5))]
+        self.fingerprints.create("dc", person=self.persons.dc, fpr=self.FPR3, is_active=True, audit_skip=True)
+        sync = MockLastUploadSync(uploads, statefile=self.statefile)
+        stats = sync.run()
+        self.assertEqual(stats["mode"], "incremental")
+        self.assertEqual(sync.queries, [(self.dt(3), None), (None, [self.FPR3])])
+        self.assertEqual(stats["updated"], 2)
+        self.assertEqual(self.last_upload("dm"), datetime.date(2017, 1, 5))
+        self.assertEqual(self.last_upload("dc"), datetime.date(2017, 1, 2))
+
+        # Nothing new
+        sync = MockLastUploadSync(uploads, statefile=self.statefile)
+        self.assertEqual(sync.run()["updated"], 0)
+        self.assertEqual(sync.queries, [(self.dt(5), None)])
+
+    def test_full(self):
+        sync = MockLastUploadSync([(self.FPR1, self.dt(3))], statefile=self.statefile)
+        sync.run()
+        # A full resync also moves dates backwards
+        sync = MockLastUploadSync([(self.FPR1, self.dt(1))], statefile=self.statefile)
+        self.assertEqual(sync.run(full=True)["updated"], 1)
+        self.assertEqual(sync.queries, [(None, None)])
+        self.assertEqual(self.last_upload("dd_nu"), datetime.date(2017, 1, 1))
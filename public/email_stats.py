@@ -4,11 +4,11 @@
 
 
 
-import mailbox
-import email
-import os
+import email.utils
+import array
 import time
-from collections import Counter, defaultdict
+from collections import Counter
+from backend.mailbox_index import MailboxIndex
 
 class Event(object):
     """
@@ -51,86 +51,129 @@ class Timeline(object):
         for e in self.events:
             e.print(file=file)
 
-def read_mbox(pathname):
+class Senders(object):
     """
-    Parse a mailbox and return a sequence of:
-    (timestamp, sender email address, sender real name)
-    """
-    mbox = mailbox.mbox(pathname)
-    for msg in mbox:
-        realname, addr = email.utils.parseaddr(msg["From"])
-        parsed = email.utils.parsedate_tz(msg["Date"])
-        if parsed is None:
-            ts = None
-        else:
-            ts = email.utils.mktime_tz(parsed)
-        yield ts, addr, realname
+    Timestamps and senders of the messages in a mailbox.
 
-def aggregate(parsed_mbox):
+    Addresses and real names are stored once, and messages are stored as
+    parallel arrays of timestamps, address ids and real name ids.
     """
-    Given (timestamp, address, realname) tuples, generate the same tuples
-    replacing address with the most common address among those used by people
-    with the same realname
-    """
-    # Convert into a list so we can iterate it twice
-    parsed_mbox = list(parsed_mbox)
-
-    # Map realnames to set of email addresses with their occurrence count
-    by_realname = defaultdict(Counter)
-    for ts, addr, realname in parsed_mbox:
+    def __init__(self):
+        self.ts = array.array("d")
+        self.addr = array.array("l")
+        self.name = array.array("l")
+        # Distinct addresses and real names, indexed by id
+        self.addrs = []
+        self.names = []
+        self._addr_ids = {}
+        self._name_ids = {}
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _intern(self, ids, values, value):
+        res = ids.get(value)
+        if res is None:
+            res = ids[value] = len(values)
+            values.append(value)
+        return res
+
+    def add(self, ts, addr, realname):
+        # Mails sent through the site are signed "Name via nm"
         if realname.endswith(" via nm"): realname = realname[:-7]
-        by_realname[realname][addr] += 1
-
-    # Compute the most common address for a realname
-    aliases = {}
-    for c in by_realname.values():
-        ranked = c.most_common()
-        for addr, count in ranked:
-            aliases[addr] = ranked[0][0]
-
-    for ts, addr, relname in parsed_mbox:
-        yield ts, aliases[addr], relname
-
-def filter_top2(parsed_mbox):
+        self.ts.append(ts)
+        self.addr.append(self._intern(self._addr_ids, self.addrs, addr))
+        self.name.append(self._intern(self._name_ids, self.names, realname))
+
+    @classmethod
+    def read(cls, pathname):
+        """
+        Read the senders of a mailbox, parsing only the From and Date headers
+        of each message. Messages without a valid date are skipped.
+        """
+        res = cls()
+        index = MailboxIndex(pathname)
+        for idx in range(len(index)):
+            msg = index.summary(idx)
+            parsed = email.utils.parsedate_tz(msg["Date"])
+            if parsed is None: continue
+            # Decoded names may contain commas: parse the undecoded header
+            realname, addr = email.utils.parseaddr(msg["RawFrom"])
+            res.add(email.utils.mktime_tz(parsed), addr, realname)
+        return res
+
+    def aliases(self):
+        """
+        Return an array mapping each address id to the id of the most common
+        address among those used by people with the same real name
+        """
+        # Count address use for each real name, in order of appearance
+        by_name = {}
+        for (name, addr), count in Counter(zip(self.name, self.addr)).items():
+            by_name.setdefault(name, Counter())[addr] = count
+
+        res = array.array("l", range(len(self.addrs)))
+        for counts in by_name.values():
+            ranked = counts.most_common()
+            for addr, count in ranked:
+                res[addr] = ranked[0][0]
+        return res
+
+    def get_gaps(self, ts_now=None):
+        """
+        Compute waiting gaps between the two most common senders, after
+        merging aliases
+        """
+        alias = self.aliases()
+        addr = array.array("l", (alias[a] for a in self.addr))
+
+        # Only keep the two most common addresses
+        top2 = { a for a, count in Counter(addr).most_common(2) }
+        selected = [i for i, a in enumerate(addr) if a in top2]
+        selected.sort(key=lambda i: (self.ts[i], self.addrs[addr[i]]))
+
+        timeline = Timeline()
+        for i in selected:
+            timeline.add(self.ts[i], self.addrs[addr[i]])
+        return timeline.gap_lengths(ts_now)
+
+def mailbox_get_gaps(pathname, ts_now=None):
     """
-    Given (timestamp, address, realname) tuples, generate only those of the two
-    most common addresses
+    Compute waiting gaps for a mailbox
     """
-    # Convert into a list so we can iterate it twice
-    parsed_mbox = list(parsed_mbox)
+    return Senders.read(pathname).get_gaps(ts_now)
 
-    # Count how many time addresses appear
-    addr_count = Counter()
-    for ts, addr, realname in parsed_mbox:
-        addr_count[addr] += 1
-
-    whitelist = { x[0] for x in addr_count.most_common(2) }
-    for ts, addr, realname in parsed_mbox:
-        if addr not in whitelist: continue
-        yield ts, addr, realname
+def percentile(values, p):
+    """
+    Compute the p-th percentile of a sorted sequence of numbers, interpolating
+    between the closest ranks
+    """
+    if not values: return None
+    pos = (len(values) - 1) * p / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
 
-def mailbox_get_gaps(pathname):
+def waiting_time_percentiles(processes, percentiles=(50, 90), ts_now=None):
     """
-    Compute waiting gaps for a mailbox
+    Compute percentiles of the time each of the two main correspondents in
+    the mailbox of each process has been waiting for a reply.
+
+    Returns a dict mapping process ids to dicts mapping addresses to the
+    list of the requested percentiles, in seconds. Processes without a
+    mailbox are skipped.
     """
-    timeline = Timeline()
-    for ts, addr, realname in sorted(filter_top2(aggregate(read_mbox(pathname)))):
-        timeline.add(ts, addr)
-    return timeline.gap_lengths()
-
-#for f in os.listdir("."):
-#    if not f.endswith(".mbox"): continue
-#    print(" *", f)
-#    #for ts, addr, realname in aggregate(read_mbox(f)):
-#    #    print(ts, addr, realname)
-#    timeline = Timeline()
-#    for ts, addr, realname in sorted(filter_top2(aggregate(read_mbox(f)))):
-#        timeline.add(ts, addr)
-#    byaddr = {}
-#    for addr, length in timeline.gap_lengths():
-#        byaddr.setdefault(addr, []).append(length)
-#        print(addr, length)
-#    for addr, lengths in byaddr.iteritems():
-#        print("Avg wtime for {}: {}".format(addr, sum(lengths)/len(lengths)))
-#
-#    #timeline.print()
+    if ts_now is None: ts_now = time.time()
+    res = {}
+    for process in processes:
+        pathname = process.mailbox_file
+        if pathname is None: continue
+        by_addr = {}
+        for addr, length in mailbox_get_gaps(pathname, ts_now):
+            by_addr.setdefault(addr, []).append(length)
+        stats = {}
+        for addr, lengths in by_addr.items():
+            lengths.sort()
+            stats[addr] = [percentile(lengths, p) for p in percentiles]
+        res[process.pk] = stats
+    return res
@@ -0,0 +1,58 @@
+from django.test import TestCase
+from public import email_stats
+from types import SimpleNamespace
+import email.utils
+import tempfile
+import os
+
+
+class TestEmailStats(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.mbox = os.path.join(self.workdir.name, "test.mbox")
+        self.base = 1340532000  # 2012-06-24 10:00 UTC
+        with open(self.mbox, "wt") as fd:
+            for sender, minutes in (
+                    ("Alice <alice@example.org>", 0),
+                    ("Bob <bob@example.org>", 60),
+                    # Out of order
+                    ("Alice <alice@example.org>", 150),
+                    # Alias of the most common address for the same name
+                    ("Alice via nm <nm@nm.debian.org>", 120),
+                    # Not one of the top two senders, with a comma in the
+                    # encoded name
+                    ("=?utf-8?q?Doe=2C_Carol?= <carol@example.org>", 180),
+                    ("Bob <bob@example.org>", 300),
+                    # Skipped, since it has no date
+                    ("Bob <bob@example.org>", None)):
+                print("From nobody Sun Jun 24 19:12:52 2012\nFrom: {}".format(sender), file=fd)
+                if minutes is not None:
+                    print("Date: {}".format(email.utils.formatdate(self.base + minutes * 60)), file=fd)
+                print("Subject: Test\n\nTest\n", file=fd)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+        super().tearDown()
+
+    def test_gaps(self):
+        senders = email_stats.Senders.read(self.mbox)
+        self.assertEqual(len(senders), 6)
+        self.assertIn("carol@example.org", senders.addrs)
+        self.assertEqual(list(email_stats.mailbox_get_gaps(self.mbox, ts_now=self.base + 360 * 60)), [
+            ("alice@example.org", 3600),
+            ("bob@example.org", 3600),
+            ("alice@example.org", 9000),
+            ("bob@example.org", 3600),
+        ])
+
+    def test_percentiles(self):
+        processes = [SimpleNamespace(pk=1, mailbox_file=self.mbox), SimpleNamespace(pk=2, mailbox_file=None)]
+        self.assertEqual(email_stats.waiting_time_percentiles(processes, (50, 100), ts_now=self.base + 360 * 60), {
+            1: {
+                "alice@example.org": [6300, 9000],
+                "bob@example.org": [3600, 3600],
+            }
+        })
+        self.assertIsNone(email_stats.percentile([], 50))
+        self.assertEqual(email_stats.percentile([1, 2, 3, 4], 50), 2.5)
@@ -184,13 +184,10 @@ class Stats(VisitorTemplateView):
         ctx["status_table_json"] = json.dumps([(s.sdesc, by_status.get(s.tag, 0)) for s in const.ALL_STATUS])
 
         # List of active processes with statistics
-        active_processes = []
-
-        # Build process list
         import process.models as pmodels
-        from process.mixins import compute_process_status
-        for p in pmodels.Process.objects.filter(closed_time__isnull=True):
-            active_processes.append((p, compute_process_status(p, self.visitor)))
+        from process.mixins import compute_processes_status
+        active_processes = compute_processes_status(
+                pmodels.Process.objects.filter(closed_time__isnull=True).select_related("person"), self.visitor)
         active_processes.sort(key=lambda x:(x[1]["log_first"].logdate if x[1]["log_first"] else None))
         ctx["active_processes"] = active_processes
 
@@ -22,6 +22,16 @@ class PermissionsTestCase(NMBasicFixtureMixin, NMTestUtilsMixin, TestCase):
         for u in allowed:
             self.assertVisit(WhenView(user=self.users[u]), ThenRedirect("^/$"))
 
+    def test_mail_queue(self):
+        class WhenView(NMTestUtilsWhen):
+            url = reverse("restricted_mail_queue")
+        allowed = frozenset(("fd", "dam"))
+        self.assertVisit(WhenView(), ThenForbidden())
+        for u in self.users.keys() - allowed:
+            self.assertVisit(WhenView(user=self.users[u]), ThenForbidden())
+        for u in allowed:
+            self.assertVisit(WhenView(user=self.users[u]), ThenSuccess())
+
     def test_db_export(self):
         class WhenView(NMTestUtilsWhen):
             url = reverse("restricted_db_export")
@@ -10,6 +10,8 @@ urlpatterns = [
     url(r'^db-export$', views.DBExport.as_view(), name="restricted_db_export"),
     # Mailbox stats
     url(r'^mailbox-stats$', views.MailboxStats.as_view(), name="mailbox_stats"),
+    # Outgoing mail queue
+    url(r'^mail-queue$', views.MailQueue.as_view(), name="restricted_mail_queue"),
 
     # Compatibility
     url(r'^ammain$', RedirectView.as_view(url="/process/am-dashboard", permanent=True)),
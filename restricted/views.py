@@ -89,3 +89,15 @@ class MailboxStats(VisitorTemplateView):
             emails=sorted(stats["emails"].items()),
         )
         return ctx
+
+
+class MailQueue(VisitorTemplateView):
+    template_name = "restricted/mail-queue.html"
+    require_visitor = "admin"
+
+    def get_context_data(self, **kw):
+        from backend import mailqueue
+        ctx = super(MailQueue, self).get_context_data(**kw)
+        ctx["stats"] = mailqueue.stats()
+        ctx["pending"] = bmodels.QueuedMail.objects.filter(sent__isnull=True).order_by("-failed", "next_attempt")[:100]
+        return ctx